@@ -0,0 +1,81 @@
+"""
+A Python module to import diabetes management data from various sources for use to
+integrate multiple views.
+
+Supported files:
+- Dexcom
+- Omnipod log files (manually copied from Omnipod)
+
+Future planned support:
+- AppleHealth data
+
+The module is split so that each part is only imported when first used:
+- people: the Person and Diabetic classes (standard library only)
+- profiling: opt-in timing and memory records for each stage of the pipeline (standard library only)
+- data: reading, caching and storing Omnipod and Dexcom data (pandas, numpy)
+- analysis: combined insulin and glucose analysis (pandas, numpy)
+- plotting: HoloViews charts (holoviews, bokeh)
+- cohort: batch analysis over many patients' exports (pandas, numpy)
+- service: a local service that ingests new exports and serves summaries as JSON (pandas, numpy)
+
+Everything is available from the top level, e.g. DiabetesMonitoring.bolus_efficacy.
+
+
+Chelsea Lapeikis
+University of Utah
+11-24-2017
+
+
+"""
+import importlib
+
+from .people import Person, Diabetic  # noqa: F401
+
+__version__ = '0.1'
+
+# Public names of each submodule, imported on first access
+_submodule_names = {
+    'data': ['regexMeal_IOB', 'regexCorrection_IOB', 'varOverride', 'regexIOB', 'omnipod_summary_types',
+             'bolus_clean_labels', 'omnipod_data_save', 'omnipod_event_types', 'omnipod_event_flags',
+             'omnipod_value_decimals', 'omnipod_tabular_columns', 'dexcom_data_save', 'dexcom_timestamp',
+             'dexcom_timestamp_format', 'dexcom_event_types', 'dexcom_event_subtypes', 'dexcom_dtypes',
+             'dexcom_read_dtypes', 'dexcom_glucose_limits', 'dexcom_chunk_rows', 'cache_suffixes',
+             'cache_time_flag', 'cache_hash_length', 'cache_generations', 'cache_block_bytes', 'store_key_columns',
+             'store_segment_limit', 'encode_time_columns', 'decode_time_columns', 'save_frame', 'load_frame',
+             'DiabetesData', 'Omnipod', 'omnipod_remove_summary', 'omnipod_extract_dedup', 'omnipod_classify',
+             'omnipod_extract_dedup_vectorized', 'omnipod_to_tabular', 'OmnipodEvents', 'omnipod_event_codes',
+             'omnipod_events', 'average_bolus', 'daily_bolus', 'Dexcom', 'dexcom_clean', 'dexcom_glucose_values',
+             'dexcom_categories', 'dexcom_concat_chunks', 'source_event_times', 'source_files', 'read_file',
+             'read_files', 'DiabetesStore'],
+    'analysis': ['glucose_tolerance', 'bolus_horizons', 'time_of_day_hours', 'time_of_day_labels',
+                 'nearest_readings', 'GlucoseSeries', 'glucose_series', 'bolus_time_of_day',
+                 'time_of_day_index', 'bolus_efficacy', 'bolus_efficacy_horizons', 'glucose_bolus_df',
+                 'cube_types', 'cube_measures', 'BolusCube', 'glucose_low', 'glucose_high', 'metric_windows',
+                 'turning_points', 'mage', 'GlucoseMetrics', 'compare_a1c_target', 'insulin_action_minutes',
+                 'insulin_peak_minutes', 'extended_bolus_minutes', 'iob_step', 'iob_columns',
+                 'insulin_action_curve', 'insulin_on_board', 'iob_check', 'basal_event_types', 'BasalTimeline',
+                 'basal_timeline', 'basal_check', 'reading_interval', 'gap_factor', 'sensor_warm_up',
+                 'sensor_change_gap', 'sensor_settle', 'calibration_pair_gap', 'transmitter_reset',
+                 'sensor_interval_kinds', 'SensorSessions', 'sensor_sessions'],
+    'plotting': ['chart_max_points', 'decimate_minmax', 'glucose_bolus_view', 'glucose_bolus_chart'],
+    'profiling': ['row_count', 'profile_stage', 'Profiler'],
+    'cohort': ['cohort_tables', 'patient_id_pattern', 'source_mtime', 'cohort_patient', 'Cohort'],
+    'service': ['service_host', 'service_port', 'service_poll_seconds', 'service_cache_entries',
+                'service_default_window', 'service_daily_columns', 'service_store_directory', 'parse_new_file',
+                'service_summaries', 'frame_json', 'query_time', 'json_value', 'IngestionService']
+}
+_submodules = {name: module for module, names in _submodule_names.items() for name in names}
+
+
+def __getattr__(name):
+    if name in _submodules:
+        value = getattr(importlib.import_module('.' + _submodules[name], __name__), name)
+        globals()[name] = value
+        return value
+    if name in _submodule_names:
+        return importlib.import_module('.' + name, __name__)
+    raise AttributeError("module %r has no attribute %r" % (__name__, name))
+
+
+def __dir__():
+    return sorted(list(globals()) + list(_submodules) + list(_submodule_names))
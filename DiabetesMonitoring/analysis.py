@@ -0,0 +1,1192 @@
+"""
+Analysis of combined Omnipod (insulin) and Dexcom (glucose) data.
+"""
+import pandas as pd
+import datetime
+import numpy as np
+
+from .profiling import profile_stage
+from .data import omnipod_events, omnipod_event_types, omnipod_value_decimals
+
+
+# Blood sugar and insulin measurements are matched within this tolerance, as the Dexcom measures every 5 minutes
+glucose_tolerance = pd.Timedelta("4.5 minutes")
+bolus_horizons = [30, 60, 90, 120, 180]
+# Parts of the day, split at these hours.  A bolus in hour 8 or earlier is in the morning, and so on.
+time_of_day_hours = [8, 12, 16]
+time_of_day_labels = ['1. Morning', '2. Afternoon', '3. Evening', '4. Post Evening']
+
+
+def nearest_readings(event_times, query_times, tolerance=glucose_tolerance):
+    """
+    A function to find the nearest reading to each query time, as pd.merge_asof(direction="nearest") does,
+    with one sorted search over the reading times.  Ties go to the earlier reading.
+
+    :param event_times: Sorted datetime64[ns] (or int64 nanosecond) reading times
+    :param query_times: An array of datetime64[ns] (or int64 nanosecond) times of any shape
+    :param tolerance: The largest allowed distance between a query and its reading
+    :return: An integer array shaped like query_times with the index of the nearest reading, or -1 if
+    there is none within the tolerance.
+    """
+    event_times = np.asarray(event_times).astype('datetime64[ns]').view('int64')
+    query_times = np.asarray(query_times).astype('datetime64[ns]').view('int64')
+    tolerance = pd.Timedelta(tolerance).value
+    if len(event_times) == 0:
+        return np.full(query_times.shape, -1, dtype='int64')
+
+    after = np.searchsorted(event_times, query_times, side='right')
+    before = np.clip(after - 1, 0, len(event_times) - 1)
+    after = np.clip(after, 0, len(event_times) - 1)
+    before_gap = np.abs(query_times - event_times[before])
+    after_gap = np.abs(event_times[after] - query_times)
+    nearest = np.where(before_gap <= after_gap, before, after)
+    gap = np.minimum(before_gap, after_gap)
+    return np.where(gap <= tolerance, nearest, -1)
+
+
+class GlucoseSeries(object):
+    """
+    A time-indexed series of glucose readings held as contiguous, sorted arrays: int64 nanosecond
+    timestamps and float32 values.  Build it once from dexcom_clean output with glucose_series, then
+    query date windows with range and match times to readings with nearest, without rescanning the
+    whole history.
+    """
+
+    def __init__(self, times, values):
+        times = np.asarray(times).astype('datetime64[ns]').view('int64')
+        values = np.asarray(values, dtype='float32')
+        if len(times) != len(values):
+            raise ValueError('times and values must be the same length.')
+        if len(times) > 1 and (np.diff(times) < 0).any():
+            order = np.argsort(times, kind='stable')
+            times, values = times[order], values[order]
+        self.times = np.ascontiguousarray(times)
+        self.values = np.ascontiguousarray(values)
+
+    def __len__(self):
+        return len(self.times)
+
+    @property
+    def event_times(self):
+        return self.times.view('datetime64[ns]')
+
+    def bounds(self, start=None, end=None):
+        """
+        A function to find the positions of a time window in the series.
+
+        :param start: The first time to include.  Default is the start of the series.
+        :param end: The last time to include.  Default is the end of the series.
+        :return: A (first, stop) pair of positions for slicing.
+        """
+        first = 0 if start is None else np.searchsorted(self.times, pd.Timestamp(start).value, side='left')
+        stop = len(self.times) if end is None else np.searchsorted(self.times, pd.Timestamp(end).value,
+                                                                   side='right')
+        return first, max(first, stop)
+
+    def range(self, start=None, end=None):
+        """
+        A function to select the readings between two times (inclusive).
+
+        :param start: The first time to include.  Default is the start of the series.
+        :param end: The last time to include.  Default is the end of the series.
+        :return: A GlucoseSeries sharing memory with this one.
+        """
+        first, stop = self.bounds(start, end)
+        window = GlucoseSeries.__new__(GlucoseSeries)
+        window.times = self.times[first:stop]
+        window.values = self.values[first:stop]
+        return window
+
+    def nearest(self, times, tolerance=glucose_tolerance):
+        """
+        A function to look up the reading nearest to each time, within a tolerance.
+
+        :param times: An array of datetime64 times of any shape
+        :param tolerance: The largest allowed distance between a time and its reading
+        :return: A float32 array shaped like times, with NaN where there is no reading within the tolerance.
+        """
+        # Unmatched times (-1) pick up the trailing NaN
+        return np.append(self.values, np.float32(np.nan))[nearest_readings(self.times, times, tolerance)]
+
+    def to_frame(self):
+        return pd.DataFrame({'event_time': self.event_times, 'Glucose Value (mg/dL)': self.values})
+
+
+def glucose_series(df_d, event_type=None):
+    """
+    A function to build a GlucoseSeries from a cleaned Dexcom dataframe.
+
+    :param df_d: A dataframe generated from dexcom_clean, or an existing GlucoseSeries (returned as-is)
+    :param event_type: Optionally, only keep rows of this Event Type (e.g. "EGV" to leave out calibrations)
+    :return: A GlucoseSeries of every timestamped Dexcom row.
+    """
+    if isinstance(df_d, GlucoseSeries):
+        return df_d
+    df_d = df_d[df_d['event_time'].notna()]
+    if event_type is not None:
+        df_d = df_d[df_d['Event Type'] == event_type]
+    return GlucoseSeries(df_d['event_time'].to_numpy(dtype='datetime64[ns]'),
+                         df_d['Glucose Value (mg/dL)'].to_numpy(dtype='float32'))
+
+
+# ----------------------------------------------------
+# ----------------------------------------------------
+
+
+def bolus_time_of_day(date_times, hours=time_of_day_hours, labels=time_of_day_labels):
+    """
+    A function to label each time with the part of the day it falls in.
+
+    :param date_times: A datetime series
+    :param hours: The hours splitting the day into parts
+    :param labels: A label for each part of the day, one more than the number of hours
+    :return: A numpy array of time of day labels.
+    """
+    if len(labels) != len(hours) + 1:
+        raise ValueError('There must be one more time of day label than split hours.')
+    return np.asarray(labels)[time_of_day_index(date_times, hours)]
+
+
+def time_of_day_index(date_times, hours=time_of_day_hours):
+    return np.asarray(hours).searchsorted(pd.Series(date_times).dt.hour.values)
+
+
+@profile_stage
+def bolus_efficacy(df_o, df_d, shift_minutes=120,
+                   min_date=datetime.datetime(2000, 1, 1, 0, 0, 0),
+                   max_date=None):
+    """
+    A function that will combine Insulin and Blood Glucose data, group the data by times of
+    day, and show the resulting blood sugar values a variable time period after the bolus.
+    Blood sugar and insulin measurements have a tolerance of 4.5 minutes as blood sugar is
+    measured by the Dexcom every 5 minutes.
+
+    Input:
+    :param df_o: A dataframe generated from an early function containing insulin/bolus information
+    :param df_d: A dataframe generated from the Dexcom data, or a GlucoseSeries built from it once with
+        glucose_series, so that calls for different windows do not each rebuild it from the whole history
+    :param shift_minutes: shift_minutes = # of minutes (integer) to view blood sugar after bolus.
+            shift_minutes default is 120 minutes, a standard value for understanding meal-bolus
+    :param min_date: The minimum date for the window to explore
+    :param max_date: The maximum date for the window to explore. Default is current date.
+
+    :return:
+        - A dataframe containing both Dexcom (blood sugar) and Omnipod (insulin) information.
+    """
+
+    if max_date is not None and not isinstance(max_date, datetime.datetime):
+        raise TypeError('max_date must be datetime.')
+
+    elif max_date is None:
+        max_date = datetime.datetime.today()
+
+    if min_date is not None and not isinstance(min_date, datetime.datetime):
+        raise TypeError('min_date must be datetime.')
+
+    glucose = glucose_series(df_d)
+
+    bolus = df_o[['Date Time', 'Date', 'Time',
+                  'Meal', 'Meal Bolus', 'Bolus Insulin', 'Correction Bolus', 'Extended Meal Bolus',
+                  ]]
+    bolus = bolus[(bolus['Date Time'] >= min_date) & (bolus['Date Time'] <= max_date)].reset_index(drop=True)
+    bolus_times = bolus['Date Time'].to_numpy(dtype='datetime64[ns]')
+
+    # Match Omnipod and Dexcom data within the tolerance of 4.5 minutes, at the bolus and time shifted
+    omnipod_bolus = bolus.rename(columns={'Time': 'Bolus Time'}).assign(**{
+        'Glucose at Bolus': glucose.nearest(bolus_times).astype(float),
+        'Glucose after time period': glucose.nearest(bolus_times + np.timedelta64(shift_minutes, 'm'))
+        .astype(float),
+        'Bolus Time of Day': bolus_time_of_day(bolus['Date Time'])})
+
+    # extended meal bolus is excluded as it is a percentage of the actual bolus
+    omnipod_bolus['Total Bolus'] = omnipod_bolus['Meal Bolus'] + \
+                                   omnipod_bolus['Bolus Insulin'] + \
+                                   omnipod_bolus['Correction Bolus']
+
+    # Only include boluses where there is a glucose measurement at the bolus, and after the bolus
+    # time shifted
+    omnipod_bolus_only = omnipod_bolus[(omnipod_bolus['Total Bolus'] > 0.0) &
+                                       (omnipod_bolus['Glucose at Bolus'] > 0.0) &
+                                       (omnipod_bolus['Glucose after time period'] > 0.0)]
+
+    return omnipod_bolus_only
+
+
+@profile_stage
+def bolus_efficacy_horizons(df_o, df_d, horizons=bolus_horizons,
+                            min_date=datetime.datetime(2000, 1, 1, 0, 0, 0),
+                            max_date=None):
+    """
+    A function like bolus_efficacy that shows blood sugar at several time periods after each bolus in one
+    call.  Boluses are limited to the date window before any matching, and the Dexcom readings are searched
+    once for the bolus time and every time period.
+
+    Input:
+    :param df_o: A dataframe generated from an early function containing insulin/bolus information
+    :param df_d: A dataframe generated from the Dexcom data, or a GlucoseSeries built from it once with
+        glucose_series, so that calls for different windows do not each rebuild it from the whole history
+    :param horizons: A list of the # of minutes (integer) to view blood sugar after bolus
+    :param min_date: The minimum date for the window to explore
+    :param max_date: The maximum date for the window to explore. Default is current date.
+
+    :return:
+        - A dataframe with one row per bolus that has a glucose measurement at the bolus, and a
+          "Glucose after N minutes" column per horizon (NaN where there was no measurement).
+    """
+
+    if max_date is not None and not isinstance(max_date, datetime.datetime):
+        raise TypeError('max_date must be datetime.')
+
+    elif max_date is None:
+        max_date = datetime.datetime.today()
+
+    if min_date is not None and not isinstance(min_date, datetime.datetime):
+        raise TypeError('min_date must be datetime.')
+
+    bolus = df_o[['Date Time', 'Date', 'Time',
+                  'Meal', 'Meal Bolus', 'Bolus Insulin', 'Correction Bolus', 'Extended Meal Bolus',
+                  ]]
+    in_window = bolus['Date Time'] <= max_date
+    if min_date is not None:
+        in_window &= bolus['Date Time'] >= min_date
+    bolus = bolus[in_window].rename(columns={'Time': 'Bolus Time'})
+
+    # extended meal bolus is excluded as it is a percentage of the actual bolus
+    bolus = bolus.assign(**{'Total Bolus': bolus['Meal Bolus'] + bolus['Bolus Insulin'] + bolus['Correction Bolus']})
+    bolus = bolus[bolus['Total Bolus'] > 0.0]
+
+    # Glucose readings for the bolus window widened by the longest horizon
+    glucose = glucose_series(df_d)
+    if len(bolus) > 0:
+        glucose = glucose.range(bolus['Date Time'].min() - glucose_tolerance,
+                                bolus['Date Time'].max() + pd.Timedelta(minutes=max(horizons, default=0)) +
+                                glucose_tolerance)
+
+    # One search for the bolus time and every horizon
+    offsets = np.array([0] + list(horizons), dtype='timedelta64[m]').astype('timedelta64[ns]')
+    queries = bolus['Date Time'].to_numpy(dtype='datetime64[ns]')[:, None] + offsets[None, :]
+    readings = glucose.nearest(queries).astype(float)
+
+    columns = {'Glucose at Bolus': readings[:, 0]}
+    for i, minutes in enumerate(horizons):
+        columns['Glucose after %d minutes' % minutes] = readings[:, i + 1]
+    columns['Bolus Time of Day'] = bolus_time_of_day(bolus['Date Time'])
+    bolus = bolus.assign(**columns)
+
+    # Only include boluses where there is a glucose measurement at the bolus
+    bolus = bolus[bolus['Glucose at Bolus'] > 0.0]
+    return bolus[['Date Time', 'Date', 'Bolus Time',
+                  'Meal', 'Meal Bolus', 'Bolus Insulin', 'Correction Bolus', 'Extended Meal Bolus',
+                  'Glucose at Bolus'] +
+                 ['Glucose after %d minutes' % minutes for minutes in horizons] +
+                 ['Bolus Time of Day', 'Total Bolus']].reset_index(drop=True)
+
+
+@profile_stage
+def glucose_bolus_df(df_o, df_d,
+                     min_date=datetime.datetime(2000, 1, 1, 0, 0, 0),
+                     max_date=None):
+    """
+    A function to combine glucose values with bolus values for viewing on a time-series.  The
+    default tolerance for a bolus-glucose relationship is 4.5 minutes
+
+    :param df_o: A dataframe generated from an early function containing insulin/bolus information
+    :param df_d: A dataframe generated from the Dexcom data, or a GlucoseSeries built from it once with
+        glucose_series, so that calls for different windows do not each rebuild it from the whole history
+    :param min_date: The minimum date for the window to explore
+    :param max_date: The maximum date for the window to explore. Default is current date.
+    :return: A dataframe combining both sets of information.
+    """
+
+    if max_date is not None and not isinstance(max_date, datetime.datetime):
+        raise TypeError('max_date must be datetime.')
+    elif max_date is None:
+        max_date = datetime.datetime.today()
+
+    if min_date is not None and not isinstance(min_date, datetime.datetime):
+        raise TypeError('min_date must be datetime.')
+
+    # First, select only bolus data from this dataframe
+    df_o['Total Bolus'] = df_o['Meal Bolus'] + df_o['Bolus Insulin'] + df_o['Correction Bolus']
+
+    df_o = df_o[(df_o['Total Bolus'] > 0.0)]
+
+    bolus_times = np.sort(df_o['Date Time'].to_numpy(dtype='datetime64[ns]'))
+
+    # Only the glucose readings in the date window are needed
+    glucose = glucose_series(df_d).range(min_date, max_date)
+
+    # Flag glucose readings with a bolus within the tolerance of 4.5 minutes
+    has_bolus = nearest_readings(bolus_times, glucose.event_times) >= 0
+    dexcom_chart = glucose.to_frame()
+    dexcom_chart['Glucose Value (mg/dL)'] = dexcom_chart['Glucose Value (mg/dL)'].astype(float)
+    dexcom_chart['BolusFlg'] = np.where(has_bolus, dexcom_chart['Glucose Value (mg/dL)'], np.nan)
+
+    return dexcom_chart
+
+
+# Bolus types held by BolusCube.  "Total" counts each bolus event once, with the Total Bolus insulin.
+cube_types = ['Meal Bolus', 'Correction Bolus', 'Bolus Insulin', 'Extended Meal Bolus', 'Total']
+cube_measures = ['Count', 'Insulin', 'Carbs', 'Glucose at Bolus', 'Glucose Count at Bolus',
+                 'Glucose after time period', 'Glucose Count after time period']
+
+
+class BolusCube(object):
+    """
+    Precomputed bolus and glucose totals by day, time of day and bolus type.
+
+    Totals are held in one compact array shaped (days, time of day, bolus type, measure), so daily,
+    weekly, monthly or other roll-ups are sums over contiguous days rather than group-bys over the
+    pump history.  Adding new days only processes the new rows.  Each bolus type counts the bolus
+    events that include it, with that type's insulin and the event's carbs and glucose; "Total"
+    counts every bolus event once with its Total Bolus insulin.
+    """
+
+    def __init__(self, hours=time_of_day_hours, labels=time_of_day_labels, shift_minutes=120):
+        if len(labels) != len(hours) + 1:
+            raise ValueError('There must be one more time of day label than split hours.')
+        self.hours = list(hours)
+        self.labels = list(labels)
+        self.shift_minutes = shift_minutes
+        self.days = np.empty(0, dtype='datetime64[D]')
+        self.totals = np.zeros((0, len(self.labels), len(cube_types), len(cube_measures)), dtype='float32')
+        self.latest = None
+
+    def add(self, df_o, df_d):
+        """
+        A function to add bolus events to the cube.  Only events after the latest one already added are
+        used, so overlapping exports are not counted twice.  Their totals are added to any days already in
+        the cube, so a day split across two adds is the same as if it had been added at once.
+
+        :param df_o: A dataframe generated from omnipod_to_tabular
+        :param df_d: A dataframe generated from the Dexcom data, or a GlucoseSeries built from it
+        """
+        events = df_o[df_o['Date Time'].notna()].drop_duplicates('Date Time')
+        times = events['Date Time'].to_numpy(dtype='datetime64[ns]')
+        if self.latest is not None:
+            keep = times > self.latest
+            events, times = events[keep], times[keep]
+
+        doses = events[cube_types[:-1]].to_numpy(dtype=float)
+        total = events['Meal Bolus'].to_numpy(dtype=float) + events['Bolus Insulin'].to_numpy(dtype=float) + \
+            events['Correction Bolus'].to_numpy(dtype=float)
+        doses = np.column_stack([doses, total])
+        has_bolus = doses > 0
+        if not has_bolus.any():
+            return
+
+        glucose = glucose_series(df_d)
+        at_bolus = glucose.nearest(times).astype(float)
+        after = glucose.nearest(times + np.timedelta64(self.shift_minutes, 'm')).astype(float)
+        carbs = events['Meal'].to_numpy(dtype=float)
+
+        days = times.astype('datetime64[D]')
+        new_days = np.unique(days[has_bolus.any(axis=1)])
+        day = np.searchsorted(new_days, days)
+        bucket = time_of_day_index(times, self.hours)
+
+        # One flat cell per (day, time of day, type) for every event and type with a positive dose
+        rows, types = np.nonzero(has_bolus)
+        cell = (day[rows] * len(self.labels) + bucket[rows]) * len(cube_types) + types
+        measures = [np.ones(len(rows)), doses[rows, types], carbs[rows],
+                    np.nan_to_num(at_bolus[rows]), np.isfinite(at_bolus[rows]),
+                    np.nan_to_num(after[rows]), np.isfinite(after[rows])]
+        size = len(new_days) * len(self.labels) * len(cube_types)
+        totals = np.column_stack([np.bincount(cell, weights=m, minlength=size) for m in measures])
+
+        totals = totals.reshape(len(new_days), len(self.labels), len(cube_types), len(cube_measures))
+
+        # New days go in date order; a day already in the cube gets the new totals added to it
+        days = np.union1d(self.days, new_days)
+        merged = np.zeros((len(days),) + self.totals.shape[1:])
+        merged[np.searchsorted(days, self.days)] += self.totals
+        merged[np.searchsorted(days, new_days)] += totals
+        self.days, self.totals = days, merged.astype('float32')
+        self.latest = times.max()
+
+    def rollup(self, freq='D', time_of_day=None, types=None):
+        """
+        A function to total the cube over periods, parts of the day and bolus types.
+
+        :param freq: A pandas period frequency for the days, e.g. 'D', 'W' or 'M', or None for all days
+        :param time_of_day: Optionally, a dictionary of new time of day labels to lists of the cube's
+        labels to combine, e.g. {'Day': ['1. Morning', '2. Afternoon'], 'Night': [...]}
+        :param types: Optionally, a list of the bolus types to return.  Default is all of cube_types.
+        :return: A long dataframe with one row per period, time of day and type, with counts, totals and means.
+        """
+        types = cube_types if types is None else list(types)
+        totals = self.totals[:, :, [cube_types.index(name) for name in types], :].astype(float)
+
+        if time_of_day is None:
+            labels = self.labels
+        else:
+            labels = list(time_of_day)
+            totals = np.stack([totals[:, [self.labels.index(name) for name in time_of_day[label]]].sum(axis=1)
+                               for label in labels], axis=1)
+
+        # Days are sorted, so each period is a contiguous run of days
+        if freq is None:
+            periods = ['All'] * min(1, len(self.days))
+            starts = np.zeros(len(periods), dtype='int64')
+        else:
+            day_periods = pd.PeriodIndex(self.days.astype('datetime64[ns]'), freq=freq)
+            starts = np.concatenate([[0], np.nonzero(day_periods[1:] != day_periods[:-1])[0] + 1]) \
+                if len(day_periods) else np.empty(0, dtype='int64')
+            periods = day_periods[starts]
+        sums = np.add.reduceat(totals, starts, axis=0) if len(starts) else totals[:0]
+
+        grid = pd.MultiIndex.from_product([periods, labels, types], names=['Period', 'Time of Day', 'Type'])
+        flat = sums.reshape(-1, len(cube_measures))
+        result = pd.DataFrame(flat, index=grid, columns=cube_measures)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            result['Mean Insulin'] = result['Insulin'] / result['Count']
+            result['Mean Carbs'] = result['Carbs'] / result['Count']
+            result['Mean Glucose at Bolus'] = result['Glucose at Bolus'] / result['Glucose Count at Bolus']
+            result['Mean Glucose after time period'] = result['Glucose after time period'] / \
+                result['Glucose Count after time period']
+        result = result[result['Count'] > 0]
+        return result[['Count', 'Insulin', 'Mean Insulin', 'Carbs', 'Mean Carbs',
+                       'Mean Glucose at Bolus', 'Mean Glucose after time period']].reset_index()
+
+
+# ----------------------------------------------------
+# ----------------------------------------------------
+
+
+# Standard CGM summary ranges (mg/dL) and rolling windows
+glucose_low = 70
+glucose_high = 180
+metric_windows = {'daily': '1D', '14-day': '14D', '90-day': '90D'}
+
+
+def turning_points(values):
+    """
+    A function to find where a glucose trace changes direction.  Flat stretches are skipped over, and the
+    first reading is always counted as a turning point.
+
+    :param values: An array of glucose values
+    :return: An integer array of positions in values.
+    """
+    steps = np.diff(values)
+    moving = np.nonzero(steps)[0]
+    direction = np.sign(steps[moving])
+    changes = np.nonzero(direction[1:] != direction[:-1])[0]
+    return np.concatenate([[0], moving[changes + 1]]).astype('int64')
+
+
+def mage(values, limit):
+    """
+    A function to compute the mean amplitude of glycemic excursions (MAGE) of a glucose trace.  A peak or
+    nadir only counts once the trace has moved away from it by more than the limit, so small reversals
+    (sensor noise) inside a larger excursion do not split it.
+
+    :param values: An array of glucose values in time order (its turning points are enough)
+    :param limit: The smallest excursion counted, normally the SD of the trace
+    :return: The mean size of the excursions larger than the limit, or NaN if there are none.
+    """
+    swings = []
+    if len(values) == 0 or not np.isfinite(limit):
+        return np.nan
+    low = high = anchor = extreme = values[0]
+    trend = 0
+    for value in values[1:]:
+        if trend == 0:
+            # Until the first excursion, the trace's lowest and highest values so far are the candidates
+            if value < low:
+                low, trend = value, (-1 if high - value > limit else 0)
+                anchor, extreme = high, low
+            elif value > high:
+                high, trend = value, (1 if value - low > limit else 0)
+                anchor, extreme = low, high
+        elif (value - extreme) * trend > 0:
+            extreme = value
+        elif (extreme - value) * trend > limit:
+            swings.append(abs(extreme - anchor))
+            anchor, extreme, trend = extreme, value, -trend
+    if trend != 0 and abs(extreme - anchor) > limit:
+        swings.append(abs(extreme - anchor))
+    return np.mean(swings) if swings else np.nan
+
+
+class GlucoseMetrics(object):
+    """
+    Standard CGM summary metrics over any window of a glucose series: time in range/below/above,
+    mean glucose, GMI and estimated A1c, SD, CV and MAGE.
+
+    Running totals of the readings, their squares and the readings below and above range are kept
+    alongside the series, so each window is computed from the totals at its two ends rather than by
+    rescanning its readings, and sliding or extending windows only costs the new readings.  MAGE is
+    computed from the turning points in each window, counting the excursions larger than the window's SD.
+    As that threshold changes with every window, MAGE costs a pass over each window's turning points, so
+    rolling only computes it when asked.  Only EGV readings are used, as calibration fingersticks are not
+    CGM readings.
+    """
+
+    def __init__(self, glucose, low=glucose_low, high=glucose_high):
+        self.low = low
+        self.high = high
+        self.times = np.empty(0, dtype='int64')
+        self.values = np.empty(0, dtype='float32')
+        self.__totals = np.zeros((1, 5))
+        self.__turns = np.empty(0, dtype='int64')
+        self.extend(glucose)
+
+    def __len__(self):
+        return len(self.times)
+
+    def extend(self, glucose):
+        """
+        A function to add newer readings to the metrics.  Readings at or before the latest reading
+        already held are ignored.
+
+        :param glucose: A GlucoseSeries or a dataframe generated from dexcom_clean
+        """
+        glucose = glucose_series(glucose, 'EGV')
+        if len(self.times) > 0:
+            glucose = glucose.range(pd.Timestamp(self.times[-1] + 1))
+        keep = np.isfinite(glucose.values)
+        times, values = glucose.times[keep], glucose.values[keep].astype(float)
+        if len(times) == 0:
+            return
+
+        # Running totals of count, sum, sum of squares, readings below range and readings above range
+        columns = np.column_stack([np.ones(len(values)), values, values ** 2,
+                                   values < self.low, values > self.high])
+        self.__totals = np.vstack([self.__totals, self.__totals[-1] + np.cumsum(columns, axis=0)])
+
+        # Turning points are found again from the last one already known, as the end of the old
+        # series may not have been a turning point
+        start = self.__turns[-1] if len(self.__turns) > 0 else 0
+        self.times = np.concatenate([self.times, times])
+        self.values = np.concatenate([self.values, values.astype('float32')])
+        self.__turns = np.concatenate([self.__turns[:-1], start + turning_points(self.values[start:])])
+
+    def windows(self, starts, ends, with_mage=True):
+        """
+        A function to compute the metrics for many windows at once.
+
+        :param starts: An array of datetime64 window starts (inclusive)
+        :param ends: An array of datetime64 window ends (exclusive)
+        :param with_mage: Whether to compute MAGE, which takes a Python pass over the turning points of each window
+        :return: A dataframe with one row per window.  The MAGE column is left out unless it is computed.
+        """
+        starts = np.asarray(starts).astype('datetime64[ns]')
+        ends = np.asarray(ends).astype('datetime64[ns]')
+        first = np.searchsorted(self.times, starts.view('int64'), side='left')
+        stop = np.searchsorted(self.times, ends.view('int64'), side='left')
+        count, total, squares, below, above = (self.__totals[stop] - self.__totals[first]).T
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = total / count
+            sd = np.sqrt(np.maximum(squares / count - mean ** 2, 0) * count / (count - 1))
+            metrics = pd.DataFrame({'Window Start': starts,
+                                    'Window End': ends,
+                                    'Readings': count.astype('int64'),
+                                    'Mean Glucose': mean,
+                                    'SD': sd,
+                                    'CV': sd / mean,
+                                    'Time Below Range': below / count,
+                                    'Time in Range': (count - below - above) / count,
+                                    'Time Above Range': above / count,
+                                    'GMI': 3.31 + 0.02392 * mean,
+                                    'Estimated A1c': (mean + 46.7) / 28.7})
+        if not with_mage:
+            return metrics
+
+        # The turning points in each window, with its first and last readings
+        turn_first = np.searchsorted(self.__turns, first, side='left')
+        turn_stop = np.searchsorted(self.__turns, stop, side='left')
+        metrics['MAGE'] = [mage(self.values[np.unique(np.concatenate([[i], self.__turns[j:k], [n - 1]]))]
+                                .astype(float), limit) if n > i else np.nan
+                           for i, n, j, k, limit in zip(first, stop, turn_first, turn_stop, sd)]
+        return metrics
+
+    def window(self, start, end):
+        """
+        A function to compute the metrics for one window.
+
+        :param start: The window start (inclusive)
+        :param end: The window end (exclusive)
+        :return: A dictionary of metrics.
+        """
+        # Converted through the nanosecond value, as np.datetime64 drops the nanoseconds of a Timestamp
+        return self.windows(np.array([pd.Timestamp(start).value]).view('datetime64[ns]'),
+                            np.array([pd.Timestamp(end).value]).view('datetime64[ns]')).iloc[0].to_dict()
+
+    def rolling(self, window='14D', step='1D', diabetic=None, with_mage=False):
+        """
+        A function to compute the metrics over a sliding window.
+
+        :param window: The window length, e.g. '1D', '14D', '90D' or a key of metric_windows
+        :param step: How far the window slides each time
+        :param diabetic: Optionally, a Diabetic whose a1c_target the estimated A1c is compared against
+        :param with_mage: Whether to add a MAGE column.  Off by default, as MAGE is recomputed for every window:
+        cheap for daily windows, but seconds for 90-day windows over a few years of readings.
+        :return: A dataframe with one row per window, ending at each step from the first full window.
+        """
+        window = pd.Timedelta(metric_windows.get(window, window))
+        step = pd.Timedelta(step)
+        if len(self.times) == 0:
+            ends = np.empty(0, dtype='datetime64[ns]')
+        else:
+            first_day = pd.Timestamp(self.times[0]).normalize()
+            last = pd.Timestamp(self.times[-1])
+            ends = pd.date_range(first_day + window, last + step, freq=step).to_numpy(dtype='datetime64[ns]')
+        metrics = self.windows(ends - np.timedelta64(window.value, 'ns'), ends, with_mage)
+        if diabetic is not None:
+            metrics = compare_a1c_target(metrics, diabetic)
+        return metrics
+
+
+def compare_a1c_target(metrics, diabetic):
+    """
+    A function to compare glycemic metrics with a person's targets.
+
+    :param metrics: A dataframe from GlucoseMetrics.windows or GlucoseMetrics.rolling
+    :param diabetic: A Diabetic
+    :return: The metrics with the A1c and eAG targets and whether each window met the A1c target.
+    """
+    return metrics.assign(**{'A1c Target': diabetic.a1c_target,
+                             'eAG Target': diabetic.eag_target,
+                             'Meets A1c Target': metrics['Estimated A1c'] <= diabetic.a1c_target})
+
+
+# ----------------------------------------------------
+# ----------------------------------------------------
+
+
+# Insulin action defaults.  The Omnipod PDM tracks IOB with a linear decay over the duration of insulin action.
+insulin_action_minutes = 180
+insulin_peak_minutes = 75
+extended_bolus_minutes = 120
+iob_step = pd.Timedelta("5 minutes")
+# Bolus columns of omnipod_to_tabular output and the IOB column each one contributes to
+iob_columns = [('Meal Bolus', 'Meal IOB'),
+               ('Correction Bolus', 'Correction IOB'),
+               ('Bolus Insulin', 'Bolus IOB'),
+               ('Extended Meal Bolus', 'Extended IOB')]
+
+
+def insulin_action_curve(curve='linear', duration=insulin_action_minutes, peak=insulin_peak_minutes,
+                         step=iob_step):
+    """
+    A function to sample an insulin action curve: the fraction of a bolus still on board at each
+    step after it is delivered.
+
+    :param curve: "linear" (as the Omnipod PDM calculates IOB), "exponential" (a rapid-acting insulin
+    activity model with a peak), a function of minutes since the bolus, or an array already sampled at step
+    :param duration: The duration of insulin action in minutes
+    :param peak: The minutes to peak activity, for the exponential curve
+    :param step: The sampling step
+    :return: A float array starting at 1.0 (the moment of the bolus) and ending at 0.0.
+    """
+    if not isinstance(curve, str) and not callable(curve):
+        return np.asarray(curve, dtype=float)
+
+    minutes = np.arange(0, duration + 1e-9, pd.Timedelta(step).total_seconds() / 60)
+    if callable(curve):
+        remaining = curve(minutes)
+    elif curve == 'linear':
+        remaining = 1 - minutes / duration
+    elif curve == 'exponential':
+        # Source: https://github.com/LoopKit/Loop/issues/388#issuecomment-317938473
+        tau = peak * (1 - peak / duration) / (1 - 2 * peak / duration)
+        a = 2 * tau / duration
+        s = 1 / (1 - a + (1 + a) * np.exp(-duration / tau))
+        remaining = 1 - s * (1 - a) * ((minutes ** 2 / (tau * duration * (1 - a)) - minutes / tau - 1) *
+                                       np.exp(-minutes / tau) + 1)
+    else:
+        raise ValueError('curve must be "linear", "exponential", a function or an array.')
+    return np.append(np.clip(remaining, 0, 1), 0.0)
+
+
+@profile_stage
+def insulin_on_board(df_o, times=None, curve='linear', duration=insulin_action_minutes,
+                     peak=insulin_peak_minutes, extended_minutes=extended_bolus_minutes, step=iob_step):
+    """
+    A function to model insulin on board (IOB) from every bolus in the pump history.  Boluses are placed
+    on a regular grid and convolved with the insulin action curve, all bolus types at once with one FFT,
+    so there is no loop over events.  Extended meal boluses are delivered evenly over extended_minutes.
+
+    :param df_o: A dataframe generated from omnipod_to_tabular
+    :param times: Optionally, the times to report IOB at, such as Dexcom event_time values or a
+    GlucoseSeries.  The grid is aligned to the first of these times and interpolated onto them.  Missing
+    (NaT) times get NaN IOB.
+    :param curve: Passed to insulin_action_curve
+    :param duration: Passed to insulin_action_curve
+    :param peak: Passed to insulin_action_curve
+    :param extended_minutes: The minutes an extended meal bolus is delivered over
+    :param step: The grid spacing
+    :return: A dataframe with event_time and Meal, Correction, Bolus, Extended and Total IOB columns.
+    A grid time includes the boluses delivered at or before it.
+    """
+    if isinstance(times, GlucoseSeries):
+        times = times.event_times
+    step_ns = pd.Timedelta(step).value
+    remaining = insulin_action_curve(curve, duration, peak, step)
+
+    # NaT times are left out of the grid, as their int64 value would stretch it back to 1677
+    if times is not None:
+        times = np.asarray(times).astype('datetime64[ns]')
+        known = ~np.isnat(times)
+        query = times[known].view('int64')
+
+    # One row per bolus time; omnipod_to_tabular repeats the pivoted values on every event at that time
+    doses = df_o[df_o['Date Time'].notna()].drop_duplicates('Date Time').sort_values('Date Time')
+    dose_times = doses['Date Time'].to_numpy(dtype='datetime64[ns]').view('int64')
+    if times is not None and len(query) > 0:
+        origin = query.min()
+    elif len(dose_times) > 0:
+        origin = pd.Timestamp(dose_times[0]).floor(step).value
+    else:
+        return pd.DataFrame(columns=['event_time'] + [name for _, name in iob_columns] + ['Total IOB'])
+
+    # Each bolus goes in the first grid step at or after it
+    bins = np.ceil((dose_times - origin) / step_ns).astype('int64')
+    first_bin = min(0, bins.min()) if len(bins) else 0
+    bins -= first_bin
+    spread = max(1, int(round(pd.Timedelta(minutes=extended_minutes).value / step_ns)))
+    end_bin = bins.max() + len(remaining) + spread if len(bins) else len(remaining)
+    if times is not None and len(query) > 0:
+        last_time = query.max()
+        end_bin = max(end_bin, int(np.ceil((last_time - origin) / step_ns)) - first_bin + 2)
+
+    pulses = np.zeros((len(iob_columns), end_bin))
+    for row, (column, _) in enumerate(iob_columns):
+        np.add.at(pulses[row], bins, doses[column].to_numpy(dtype=float))
+
+    # Extended boluses use the action curve smeared over the extended delivery time
+    kernels = np.zeros((len(iob_columns), len(remaining) + spread - 1))
+    kernels[:, :len(remaining)] = remaining
+    kernels[-1] = np.convolve(remaining, np.full(spread, 1.0 / spread))
+
+    size = 1 << int(np.ceil(np.log2(end_bin + kernels.shape[1])))
+    iob = np.fft.irfft(np.fft.rfft(pulses, size) * np.fft.rfft(kernels, size), size)[:, :end_bin]
+    iob = np.where(np.abs(iob) < 1e-9, 0.0, iob)
+
+    grid = origin + (np.arange(end_bin) + first_bin) * step_ns
+    if times is not None:
+        at_times = np.full((len(iob_columns), len(times)), np.nan)
+        at_times[:, known] = [np.interp(query, grid, row) for row in iob]
+        iob = at_times
+        grid = times.view('int64')
+
+    result = pd.DataFrame({'event_time': grid.view('datetime64[ns]')})
+    for row, (_, name) in enumerate(iob_columns):
+        result[name] = iob[row]
+    result['Total IOB'] = iob.sum(axis=0)
+    return result
+
+
+def iob_check(df_o, curve='linear', duration=insulin_action_minutes, peak=insulin_peak_minutes,
+              extended_minutes=extended_bolus_minutes, step=iob_step):
+    """
+    A function to compare the modeled IOB with the Meal IOB and Correction IOB values scraped from the
+    Omnipod comments.  The pump reports IOB just before each bolus, so the model is read one grid step
+    before the bolus.
+
+    :param df_o: A dataframe generated from omnipod_to_tabular
+    :return: A dataframe with one row per bolus with scraped values, the modeled values and their differences.
+    """
+    scraped = df_o.groupby('Date Time', sort=True)[['Meal IOB', 'Correction IOB']].max()
+    scraped = scraped[(scraped['Meal IOB'] > 0) | (scraped['Correction IOB'] > 0)]
+    before = scraped.index.to_numpy(dtype='datetime64[ns]') - np.timedelta64(pd.Timedelta(step).value, 'ns')
+    modeled = insulin_on_board(df_o, times=before, curve=curve, duration=duration, peak=peak,
+                               extended_minutes=extended_minutes, step=step)
+
+    check = scraped.reset_index()
+    check['Modeled Meal IOB'] = modeled['Meal IOB'].to_numpy() + modeled['Extended IOB'].to_numpy()
+    check['Modeled Correction IOB'] = modeled['Correction IOB'].to_numpy()
+    check['Meal IOB Difference'] = check['Modeled Meal IOB'] - check['Meal IOB']
+    check['Correction IOB Difference'] = check['Modeled Correction IOB'] - check['Correction IOB']
+    return check
+
+
+# ----------------------------------------------------
+# ----------------------------------------------------
+
+
+# Omnipod events that set the basal rate.  Each one's value is the rate (units/hour) from then on.
+basal_event_types = ['Basal Insulin', 'Temp Basal', 'Basal Suspended', 'Basal Resumed', 'Pod Deactivated']
+
+
+class BasalTimeline(object):
+    """
+    The basal insulin delivered by the pump as a piecewise-constant rate, reconstructed from the events that
+    set it: scheduled rates, temp basals, suspends and resumes, and pod deactivation and activation.  Each
+    rate holds until the next event; the pump logs a new rate at every schedule change and at the end of
+    each temp basal.
+
+    The timeline is held as sorted arrays of interval start times and rates, with the cumulative insulin
+    delivered at each start, so the insulin delivered over any window is the difference of two lookups into
+    the cumulative integral, vectorized over as many windows or readings as needed.  The last interval ends
+    at the last event, or at end if given.
+    """
+
+    def __init__(self, times, rates, codes=None, end=None):
+        times = np.asarray(times).astype('datetime64[ns]').view('int64')
+        rates = np.asarray(rates, dtype=float)
+        codes = np.zeros(len(times), dtype='int8') if codes is None else np.asarray(codes, dtype='int8')
+        if not len(times) == len(rates) == len(codes):
+            raise ValueError('times, rates and codes must be the same length.')
+        order = np.argsort(times, kind='stable')
+        times, rates, codes = times[order], rates[order], codes[order]
+
+        # Of several events at one time the first (the last logged, as a pump log is newest first) holds
+        first = np.concatenate([[True], np.diff(times) > 0]) if len(times) else np.empty(0, dtype=bool)
+        self.starts = np.ascontiguousarray(times[first])
+        self.rates = np.ascontiguousarray(rates[first])
+        self.codes = np.ascontiguousarray(codes[first])
+        self.end = self.starts[-1] if len(self.starts) else 0
+        if end is not None:
+            self.end = max(self.end, pd.Timestamp(end).value)
+
+        hours = np.diff(np.append(self.starts, self.end)) / 3.6e12
+        self.cumulative = np.concatenate([[0.0], np.cumsum(self.rates * hours)])
+
+    def __len__(self):
+        return len(self.starts)
+
+    @property
+    def ends(self):
+        return np.append(self.starts[1:], self.end)
+
+    def delivered(self, times):
+        """
+        A function to look up the basal insulin delivered from the start of the timeline to each time.
+        Times before the start count nothing and times after the end count everything.
+
+        :param times: An array of datetime64 times of any shape
+        :return: A float array of units shaped like times.
+        """
+        query = np.asarray(times).astype('datetime64[ns]').view('int64')
+        if len(self.starts) == 0:
+            return np.zeros(query.shape)
+        query = np.clip(query, self.starts[0], self.end)
+        i = np.clip(np.searchsorted(self.starts, query, side='right') - 1, 0, len(self.starts) - 1)
+        return self.cumulative[i] + self.rates[i] * (query - self.starts[i]) / 3.6e12
+
+    def total(self, start, end):
+        """
+        A function to find the basal insulin delivered in windows.
+
+        :param start: An array (or a single) datetime64 window start
+        :param end: An array (or a single) datetime64 window end, the same shape as start
+        :return: A float array of units delivered in each window.
+        """
+        return self.delivered(end) - self.delivered(start)
+
+    def rate_at(self, times):
+        """
+        :param times: An array of datetime64 times of any shape
+        :return: The basal rate (units/hour) at each time, with NaN outside the timeline.
+        """
+        query = np.asarray(times).astype('datetime64[ns]').view('int64')
+        i = np.searchsorted(self.starts, query, side='right') - 1
+        inside = (i >= 0) & (query < self.end)
+        return np.where(inside, np.append(self.rates, np.nan)[np.where(inside, i, -1)], np.nan)
+
+    def at_readings(self, df_d, window=iob_step):
+        """
+        A function to align the timeline to glucose readings.
+
+        :param df_d: A dataframe generated from dexcom_clean, or a GlucoseSeries
+        :param window: The basal delivered is over this window up to each reading
+        :return: A dataframe with event_time, the glucose value, Basal Rate and Basal Delivered columns.
+        """
+        glucose = glucose_series(df_d)
+        frame = glucose.to_frame()
+        window = np.timedelta64(pd.Timedelta(window).value, 'ns')
+        frame['Basal Rate'] = self.rate_at(glucose.event_times)
+        frame['Basal Delivered'] = self.total(glucose.event_times - window, glucose.event_times)
+        return frame
+
+    def daily(self):
+        """
+        :return: A dataframe of the basal insulin delivered on each day of the timeline.
+        """
+        if len(self.starts) == 0:
+            return pd.DataFrame({'Date': pd.Series(dtype='datetime64[ns]'), 'Basal Delivered': pd.Series(dtype=float)})
+        days = pd.date_range(pd.Timestamp(self.starts[0]).normalize(), pd.Timestamp(self.end).normalize(), freq='D')
+        starts = days.to_numpy(dtype='datetime64[ns]')
+        return pd.DataFrame({'Date': days, 'Basal Delivered': self.total(starts, starts + np.timedelta64(1, 'D'))})
+
+    def to_frame(self):
+        """
+        :return: A dataframe with a row per interval: Start, End, Rate (units/hour), Event Type and Delivered.
+        """
+        return pd.DataFrame({'Start': self.starts.view('datetime64[ns]'),
+                             'End': self.ends.view('datetime64[ns]'),
+                             'Rate': self.rates,
+                             'Event Type': pd.Categorical.from_codes(self.codes, omnipod_event_types),
+                             'Delivered': np.diff(self.cumulative)})
+
+    def __str__(self):
+        txt = "Basal timeline: %d intervals\n" % len(self)
+        if len(self):
+            txt += "From %s to %s\n" % (pd.Timestamp(self.starts[0]), pd.Timestamp(self.end))
+            txt += "Delivered: %.2f units\n" % self.cumulative[-1]
+        return txt
+
+
+@profile_stage
+def basal_timeline(df_i, end=None):
+    """
+    A function to reconstruct the basal timeline from the pump log.  The omnipod_to_tabular view cannot be
+    used, as a suspend or pod deactivation (a rate of 0) looks the same there as no event at all.
+
+    :param df_i: A raw Omnipod dataframe, or OmnipodEvents built from one
+    :param end: Optionally, the time the last rate holds until.  Default is the time of the last event.
+    :return: A BasalTimeline.
+    """
+    events = omnipod_events(df_i).select(basal_event_types)
+    rates = np.round(events.values.astype(float), omnipod_value_decimals)
+    return BasalTimeline(events.times, rates, events.codes, end)
+
+
+def basal_check(df_i, timeline=None):
+    """
+    A function to compare the basal delivered each day by the timeline with the End of Day Basal Total
+    the pump reports in its daily Insulin Summary.
+
+    :param df_i: A raw Omnipod dataframe, with its Insulin Summary rows
+    :param timeline: Optionally, a BasalTimeline already built from df_i
+    :return: A dataframe with one row per reported day: the reported and reconstructed totals and their
+    difference.  The first and last days of a log are only partly covered by the timeline.
+    """
+    if timeline is None:
+        timeline = basal_timeline(df_i)
+    reported = df_i[(df_i['Type'] == 'Insulin Summary') &
+                    (df_i['Description'].astype(str).str.contains('Basal Total'))]
+    reported = pd.DataFrame({'Date': pd.to_datetime(reported['Date']).dt.normalize().astype('datetime64[ns]'),
+                             'Reported Basal': pd.to_numeric(reported['Value'].astype(str).str.split(' ').str[0],
+                                                             errors='coerce')})
+    check = reported.drop_duplicates('Date').merge(timeline.daily(), on='Date', how='inner')
+    check['Basal Difference'] = check['Basal Delivered'] - check['Reported Basal']
+    return check.sort_values('Date').reset_index(drop=True)
+
+
+# ----------------------------------------------------
+# ----------------------------------------------------
+
+
+# Dexcom sensor timing.  A sensor reads every 5 minutes for about 7 days, after a 2-hour warm-up that ends with
+# two back-to-back calibrations.
+reading_interval = pd.Timedelta("5 minutes")
+# A reading is missing when the next one is more than this many reading intervals later
+gap_factor = 1.5
+sensor_warm_up = pd.Timedelta("2 hours")
+# A gap this long ending in calibrations is a sensor change, rather than lost signal
+sensor_change_gap = pd.Timedelta("95 minutes")
+# Readings are least accurate just after warm-up, so the warm-up interval runs this far past a session's start
+sensor_settle = pd.Timedelta("1 hour")
+# Calibrations this close together are one calibration pair
+calibration_pair_gap = pd.Timedelta("10 minutes")
+# Transmitter Time counts seconds since the transmitter started.  Readings shifted by a change of the receiver's
+# clock interleave with it running back an hour or two, so only a larger step back is a restarted transmitter.
+transmitter_reset = pd.Timedelta("1 day")
+sensor_interval_kinds = ['session', 'warm_up', 'calibration', 'gap']
+
+
+class SensorSessions(object):
+    """
+    A Dexcom stream split into sensor sessions, with the warm-up periods, calibrations and missing-reading
+    gaps flagged as intervals.
+
+    Each kind of interval is held as sorted, non-overlapping arrays of int64 nanosecond starts and ends
+    (half-open, [start, end)), so finding which readings or boluses fall in any kind of interval is one
+    sorted search over all the times at once.  Build it with sensor_sessions.
+    """
+
+    def __init__(self, intervals, devices):
+        self.intervals = {kind: (np.asarray(intervals[kind][0], dtype='int64'),
+                                 np.asarray(intervals[kind][1], dtype='int64')) for kind in sensor_interval_kinds}
+        self.devices = np.asarray(devices, dtype=object)
+
+    def __len__(self):
+        return len(self.devices)
+
+    def locate(self, kind, times):
+        """
+        A function to find the interval of a kind containing each time.
+
+        :param kind: One of sensor_interval_kinds
+        :param times: An array of datetime64 times of any shape
+        :return: An integer array shaped like times with the interval's position, or -1 outside every interval.
+        """
+        starts, ends = self.intervals[kind]
+        query = np.asarray(times).astype('datetime64[ns]').view('int64')
+        i = np.searchsorted(starts, query, side='right') - 1
+        inside = (i >= 0) & (query < np.append(ends, 0)[i])
+        return np.where(inside, i, -1)
+
+    def session_of(self, times):
+        """:return: The session number of each time, or -1 if it is outside every session."""
+        return self.locate('session', times)
+
+    def mask(self, times, kinds=('warm_up', 'calibration', 'gap')):
+        """
+        :param times: An array of datetime64 times of any shape
+        :param kinds: The kinds of interval to flag
+        :return: A boolean array shaped like times, True where a time falls in any of the kinds of interval.
+        """
+        if isinstance(kinds, str):
+            kinds = [kinds]
+        flagged = np.zeros(np.shape(times), dtype=bool)
+        for kind in kinds:
+            flagged |= self.locate(kind, times) >= 0
+        return flagged
+
+    def exclude(self, df_d, kinds=('warm_up', 'calibration')):
+        """
+        A function to drop the readings in warm-up periods and around calibrations.
+
+        :param df_d: A dataframe generated from dexcom_clean
+        :param kinds: The kinds of interval to drop readings from
+        :return: The rows of df_d outside those intervals.
+        """
+        times = df_d['event_time'].to_numpy(dtype='datetime64[ns]')
+        return df_d[~(self.mask(times, kinds) & ~np.isnat(times))]
+
+    def fill_gaps(self, df_d, max_gap=pd.Timedelta("30 minutes")):
+        """
+        A function to fill short gaps in the readings by linear interpolation, one reading per reading_interval.
+        Gaps longer than max_gap, and the time between sessions, are left empty.
+
+        :param df_d: A dataframe generated from dexcom_clean, or a GlucoseSeries
+        :param max_gap: The longest gap to fill
+        :return: A GlucoseSeries of the readings with the filled-in values added.
+        """
+        glucose = glucose_series(df_d, 'EGV') if isinstance(df_d, pd.DataFrame) else df_d
+        starts, ends = self.intervals['gap']
+        # Gap intervals start 1 ns after the reading before the gap
+        before = starts - 1
+        fill = (ends - before <= pd.Timedelta(max_gap).value) & \
+            (self.session_of(before.view('datetime64[ns]')) == self.session_of(ends.view('datetime64[ns]')))
+        before, after = before[fill], ends[fill]
+        step = reading_interval.value
+        counts = np.maximum(np.round((after - before) / step).astype('int64') - 1, 0)
+        offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts) + 1
+        new_times = np.repeat(before, counts) + offsets * np.repeat((after - before) // (counts + 1), counts)
+        new_values = np.interp(new_times, glucose.times, glucose.values.astype(float))
+        return GlucoseSeries(np.concatenate([glucose.times, new_times]).view('datetime64[ns]'),
+                             np.concatenate([glucose.values, new_values.astype('float32')]))
+
+    def interval_index(self, kind):
+        """:return: A pandas IntervalIndex of one kind of interval."""
+        starts, ends = self.intervals[kind]
+        return pd.IntervalIndex.from_arrays(starts.view('datetime64[ns]'), ends.view('datetime64[ns]'), closed='left')
+
+    def to_frame(self):
+        """
+        :return: A dataframe with a row per interval of every kind: Kind, Start, End and the Session it is in.
+        """
+        frames = []
+        for kind in sensor_interval_kinds:
+            starts, ends = self.intervals[kind]
+            frames.append(pd.DataFrame({'Kind': kind, 'Start': starts.view('datetime64[ns]'),
+                                        'End': ends.view('datetime64[ns]'),
+                                        'Session': self.session_of(starts.view('datetime64[ns]'))}))
+        return pd.concat(frames, ignore_index=True).sort_values(['Start', 'Kind'], kind='stable') \
+            .reset_index(drop=True)
+
+    def sessions(self):
+        """
+        :return: A dataframe with a row per session: its device, start, end, duration, calibrations and the
+        minutes of missing readings, counting the gap while the sensor warmed up.
+        """
+        starts, ends = self.intervals['session']
+        frame = pd.DataFrame({'Session': np.arange(len(starts)), 'Source Device ID': self.devices,
+                              'Start': starts.view('datetime64[ns]'), 'End': ends.view('datetime64[ns]')})
+        frame['Duration'] = frame['End'] - frame['Start']
+        for kind in ['calibration', 'gap']:
+            kind_starts, kind_ends = self.intervals[kind]
+            session = self.session_of(kind_starts.view('datetime64[ns]'))
+            inside = session >= 0
+            if kind == 'calibration':
+                frame['Calibrations'] = np.bincount(session[inside], minlength=len(starts))
+            else:
+                minutes = (kind_ends - kind_starts)[inside] / 6e10
+                frame['Gap Minutes'] = np.bincount(session[inside], weights=minutes, minlength=len(starts))
+        return frame
+
+    def __str__(self):
+        txt = "Sensor sessions: %d\n" % len(self)
+        for kind in sensor_interval_kinds[1:]:
+            txt += "%s intervals: %d\n" % (kind, len(self.intervals[kind][0]))
+        return txt
+
+
+@profile_stage
+def sensor_sessions(df_d):
+    """
+    A function to split a Dexcom stream into sensor sessions, in one vectorized pass over the Event Type,
+    Source Device ID and Transmitter Time columns.
+
+    A session starts at the first reading, when the transmitter (Source Device ID) changes, when its
+    Transmitter Time goes back by more than transmitter_reset, or after a gap of at least sensor_change_gap
+    with calibrations in it, as there are after a warm-up.  Each session's warm-up runs from sensor_warm_up
+    before its first calibration (or from the previous reading, if that is later) to sensor_settle after its
+    first reading.  Calibrations within calibration_pair_gap of each other are one interval, which runs until
+    the first reading after them.  A gap is the time between two readings more than gap_factor reading
+    intervals apart.
+
+    :param df_d: A dataframe generated from dexcom_clean
+    :return: A SensorSessions.
+    """
+    df_d = df_d[df_d['event_time'].notna()]
+    events = df_d['Event Type'].astype(str).to_numpy()
+    times = df_d['event_time'].to_numpy(dtype='datetime64[ns]').view('int64')
+    egv = events == 'EGV'
+    order = np.argsort(times[egv], kind='stable')
+    egv_times = times[egv][order]
+    devices = df_d['Source Device ID'].astype(str).to_numpy()[egv][order]
+    transmitter = pd.to_numeric(df_d['Transmitter Time (Long Integer)'], errors='coerce').to_numpy(float)[egv][order]
+    calibrations = np.sort(times[events == 'Calibration'])
+
+    if len(egv_times) == 0:
+        empty = (np.empty(0, dtype='int64'), np.empty(0, dtype='int64'))
+        return SensorSessions({kind: empty for kind in sensor_interval_kinds}, [])
+
+    # Calibrations between each reading and the one before it
+    steps = np.diff(egv_times)
+    calibrations_before = np.diff(np.searchsorted(calibrations, egv_times, side='left'))
+    new_session = (devices[1:] != devices[:-1]) | (np.diff(transmitter) < -transmitter_reset.total_seconds()) | \
+        ((steps >= sensor_change_gap.value) & (calibrations_before > 0))
+    first = np.concatenate([[0], np.nonzero(new_session)[0] + 1])
+    last = np.append(first[1:] - 1, len(egv_times) - 1)
+
+    # Warm-up runs from sensor_warm_up before the calibrations that end it, but not back past the previous reading.
+    # A session with no calibrations before its first reading warms up from that reading.
+    lower = np.concatenate([[np.iinfo('int64').min], egv_times[last[:-1]] + 1])
+    startup = np.append(calibrations, np.iinfo('int64').max)[np.searchsorted(calibrations, lower, side='left')]
+    startup = np.minimum(startup, egv_times[first])
+    warm_up_start = np.maximum(startup - sensor_warm_up.value, lower)
+    warm_up_end = egv_times[first] + sensor_settle.value
+    # The export may begin part way through a session, which then has no warm-up
+    if startup[0] == egv_times[0]:
+        warm_up_start[0] = warm_up_end[0] = egv_times[0]
+    session_end = np.append(np.minimum(egv_times[last[:-1]] + reading_interval.value, warm_up_start[1:]),
+                            egv_times[-1] + reading_interval.value)
+    warm_up_end = np.minimum(warm_up_end, session_end)
+    warming = warm_up_end > warm_up_start
+
+    # Calibration pairs end at the first reading after them
+    if len(calibrations):
+        pair_start = np.concatenate([[True], np.diff(calibrations) > calibration_pair_gap.value])
+        pair_last = np.append(np.nonzero(pair_start)[0][1:] - 1, len(calibrations) - 1)
+        calibration_starts = calibrations[pair_start]
+        after = np.searchsorted(egv_times, calibrations[pair_last], side='right')
+        calibration_ends = np.where(after < len(egv_times), egv_times[np.minimum(after, len(egv_times) - 1)] + 1,
+                                    calibrations[pair_last] + reading_interval.value)
+        calibration_ends = np.minimum(calibration_ends, np.append(calibration_starts[1:], np.iinfo('int64').max))
+    else:
+        calibration_starts = calibration_ends = np.empty(0, dtype='int64')
+
+    # Gaps run from just after one reading to the next
+    missing = np.nonzero(steps > gap_factor * reading_interval.value)[0]
+    intervals = {'session': (warm_up_start, session_end),
+                 'warm_up': (warm_up_start[warming], warm_up_end[warming]),
+                 'calibration': (calibration_starts, calibration_ends),
+                 'gap': (egv_times[missing] + 1, egv_times[missing + 1])}
+    return SensorSessions(intervals, devices[first])
@@ -0,0 +1,300 @@
+"""
+Batch analysis of many patients' Omnipod and Dexcom exports.
+"""
+import os
+import re
+import json
+import datetime
+import functools
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+import pandas as pd
+
+from .data import cache_time_flag, encode_time_columns, save_frame, load_frame, source_files, read_files, \
+    omnipod_to_tabular, dexcom_clean
+from .analysis import bolus_efficacy, GlucoseMetrics, compare_a1c_target
+
+
+# Results written for each patient.  Every table has a Patient column so the tables of a cohort stack.
+cohort_tables = ['bolus_efficacy', 'glucose_summary']
+patient_id_pattern = re.compile(r'^[\w.-]+$')
+
+
+def source_mtime(path):
+    """
+    :param path: A file, folder or glob pattern of Omnipod or Dexcom exports
+    :return: The latest modification time of the exports, or None if there are none.
+    """
+    files = source_files(path)
+    return max(os.path.getmtime(name) for name in files) if files else None
+
+
+def cohort_patient(patient_id, diabetic, omnipod_path, dexcom_path, directory, shift_minutes=120,
+                   min_date=datetime.datetime(2000, 1, 1, 0, 0, 0), max_date=None, use_cache=True):
+    """
+    A function to analyze one patient and write their results to the cohort directory.  This is the unit of
+    work for Cohort.run workers, so only the row counts come back to the parent process.
+
+    :param patient_id: The patient's id, used for the result file names
+    :param diabetic: The patient's Diabetic record
+    :param omnipod_path: A file, folder or glob pattern of the patient's Omnipod logs
+    :param dexcom_path: A file, folder or glob pattern of the patient's Clarity exports
+    :param directory: The cohort directory
+    :param shift_minutes: Passed to bolus_efficacy
+    :param min_date: The minimum date for the window to explore
+    :param max_date: The maximum date for the window to explore. Default is current date.
+    :param use_cache: Passed to DiabetesData.read_data
+    :return: A dictionary of the number of rows written to each table.
+    """
+    if max_date is None:
+        max_date = datetime.datetime.today()
+
+    df_o = omnipod_to_tabular(read_files(omnipod_path, "Omnipod", workers=1, use_cache=use_cache), save=False)
+    df_d = dexcom_clean(read_files(dexcom_path, "Dexcom", workers=1, use_cache=use_cache))
+
+    bolus = bolus_efficacy(df_o, df_d, shift_minutes, min_date, max_date)
+
+    metrics = GlucoseMetrics(df_d)
+    start = max(pd.Timestamp(min_date), pd.Timestamp(metrics.times[0])) if len(metrics) else pd.Timestamp(min_date)
+    end = min(pd.Timestamp(max_date), pd.Timestamp(metrics.times[-1]) + pd.Timedelta(1)) if len(metrics) \
+        else pd.Timestamp(max_date)
+    summary = compare_a1c_target(pd.DataFrame([metrics.window(start, end)]), diabetic)
+    summary = summary.assign(**{'First Name': diabetic.first_name,
+                                'Sex': diabetic.sex,
+                                'Boluses': len(bolus),
+                                'Mean Glucose at Bolus': bolus['Glucose at Bolus'].mean(),
+                                'Mean Glucose after time period': bolus['Glucose after time period'].mean()})
+
+    tables = {'bolus_efficacy': bolus, 'glucose_summary': summary}
+    rows = {}
+    for table in cohort_tables:
+        df = tables[table].reset_index(drop=True)
+        df.insert(0, 'Patient', patient_id)
+        save_frame(df, os.path.join(directory, table, patient_id))
+        rows[table] = len(df)
+    return rows
+
+
+class Cohort(object):
+    """
+    A population of Diabetic records, each mapped to their own Omnipod and Dexcom exports, analyzed in
+    parallel with the results for every patient written to one columnar table per kind of result.
+
+    Patients are processed in a pool of worker processes with no more patients in flight than workers,
+    and each worker writes its patient's results straight to the cohort directory, so memory is bounded
+    by the largest few patients rather than the cohort.  Progress is recorded in a json index after every
+    patient, so an interrupted run picks up where it stopped: patients already done are skipped unless
+    their exports or the analysis settings have changed, and failed patients are tried again.
+    """
+
+    def __init__(self, directory, shift_minutes=120, min_date=datetime.datetime(2000, 1, 1, 0, 0, 0),
+                 max_date=None):
+        if max_date is not None and not isinstance(max_date, datetime.datetime):
+            raise TypeError('max_date must be datetime.')
+        if min_date is not None and not isinstance(min_date, datetime.datetime):
+            raise TypeError('min_date must be datetime.')
+        self.directory = os.path.abspath(directory)
+        self.shift_minutes = shift_minutes
+        self.min_date = min_date
+        self.max_date = max_date
+        self.patients = {}
+        self.__index = self.read_index()
+
+    @property
+    def index_path(self):
+        return os.path.join(self.directory, 'Cohort.json')
+
+    @property
+    def settings(self):
+        return {'shift_minutes': self.shift_minutes,
+                'min_date': None if self.min_date is None else self.min_date.isoformat(),
+                'max_date': None if self.max_date is None else self.max_date.isoformat()}
+
+    def read_index(self):
+        if os.path.exists(self.index_path):
+            with open(self.index_path) as index_file:
+                return json.load(index_file)
+        return {'patients': {}}
+
+    def write_index(self):
+        os.makedirs(self.directory, exist_ok=True)
+        with open(self.index_path + '.tmp', 'w') as index_file:
+            json.dump(self.__index, index_file, indent=1)
+        os.replace(self.index_path + '.tmp', self.index_path)
+
+    def add(self, patient_id, diabetic, omnipod_path, dexcom_path):
+        """
+        A function to add a patient to the cohort.
+
+        :param patient_id: A unique id for the patient, made of letters, digits, '_', '-' and '.'
+        :param diabetic: The patient's Diabetic record
+        :param omnipod_path: A file, folder or glob pattern of the patient's Omnipod logs
+        :param dexcom_path: A file, folder or glob pattern of the patient's Clarity exports
+        """
+        if not isinstance(patient_id, str) or not patient_id_pattern.match(patient_id):
+            raise ValueError('Patient id must be letters, digits, "_", "-" or ".": %r' % (patient_id,))
+        if patient_id in self.patients:
+            raise ValueError('Patient %s is already in the cohort.' % patient_id)
+        self.patients[patient_id] = {'diabetic': diabetic,
+                                     'omnipod': os.path.abspath(omnipod_path),
+                                     'dexcom': os.path.abspath(dexcom_path)}
+
+    def sources(self, patient_id):
+        patient = self.patients[patient_id]
+        return {'omnipod': source_mtime(patient['omnipod']), 'dexcom': source_mtime(patient['dexcom'])}
+
+    def is_done(self, patient_id):
+        entry = self.__index['patients'].get(patient_id)
+        return entry is not None and entry['status'] == 'done' and entry['settings'] == self.settings and \
+            entry['sources'] == self.sources(patient_id)
+
+    def pending(self):
+        return [patient_id for patient_id in self.patients if not self.is_done(patient_id)]
+
+    def record(self, patient_id, sources, status, rows=None, error=None):
+        self.__index['patients'][patient_id] = {'status': status, 'settings': self.settings,
+                                                'sources': sources, 'rows': rows, 'error': error}
+        self.write_index()
+
+    def run(self, workers=None, use_cache=True):
+        """
+        A function to analyze every patient that is not already done.
+
+        :param workers: The number of worker processes.  Default is the number of CPUs; 1 runs in this process.
+        :param use_cache: Passed to DiabetesData.read_data
+        :return: A dictionary of the ids of the patients processed, skipped and failed.
+        """
+        pending = self.pending()
+        summary = {'processed': [], 'skipped': [p for p in self.patients if p not in pending], 'failed': []}
+
+        def arguments(patient_id):
+            patient = self.patients[patient_id]
+            return (patient_id, patient['diabetic'], patient['omnipod'], patient['dexcom'], self.directory,
+                    self.shift_minutes, self.min_date, self.max_date, use_cache)
+
+        def finish(patient_id, sources, result):
+            # A failed patient is recorded and tried again on the next run, rather than stopping the cohort.
+            # Sources are noted before the patient is read, so exports changed during the run are read again.
+            try:
+                self.record(patient_id, sources, 'done', rows=result())
+                summary['processed'].append(patient_id)
+            except Exception as error:
+                print('%s: %s' % (patient_id, error))
+                self.record(patient_id, sources, 'failed', error=str(error))
+                summary['failed'].append(patient_id)
+
+        if workers == 1 or len(pending) <= 1:
+            for patient_id in pending:
+                finish(patient_id, self.sources(patient_id),
+                       functools.partial(cohort_patient, *arguments(patient_id)))
+            return summary
+
+        workers = workers or os.cpu_count() or 1
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            queue = list(reversed(pending))
+            running = {}
+            while queue or running:
+                # Keep no more patients in flight than there are workers
+                while queue and len(running) < workers:
+                    patient_id = queue.pop()
+                    sources = self.sources(patient_id)
+                    running[pool.submit(cohort_patient, *arguments(patient_id))] = (patient_id, sources)
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    finish(*running.pop(future), future.result)
+        return summary
+
+    def done(self, patients=None):
+        """
+        :param patients: Optionally, a list of patient ids.  Default is every patient in the cohort.
+        :return: The ids of the patients whose results are up to date: done with the current settings and
+        exports.  Results left by patients no longer in the cohort, or by other settings, are not included.
+        """
+        return [patient_id for patient_id in self.patients
+                if (patients is None or patient_id in patients) and self.is_done(patient_id)]
+
+    def result_frames(self, table='bolus_efficacy', patients=None):
+        """
+        A function to read the results of the patients that are done, one patient at a time.
+
+        :param table: One of cohort_tables
+        :param patients: Optionally, a list of patient ids.  Default is every patient done.
+        :return: A generator of (patient id, dataframe) pairs.
+        """
+        if table not in cohort_tables:
+            raise ValueError('table must be one of %s' % ', '.join(cohort_tables))
+        for patient_id in self.done(patients):
+            df = load_frame(os.path.join(self.directory, table, patient_id))
+            if df is not None:
+                yield patient_id, df
+
+    def results(self, table='bolus_efficacy', patients=None):
+        """
+        A function to combine the results of the patients that are done in memory.  Use write_results to
+        combine a large cohort.
+
+        :param table: One of cohort_tables
+        :param patients: Optionally, a list of patient ids.  Default is every patient done.
+        :return: A dataframe of the table for every patient, with a Patient column.
+        """
+        frames = [df for _, df in self.result_frames(table, patients)]
+        if len(frames) == 0:
+            return pd.DataFrame({'Patient': pd.Series(dtype=object)})
+        return pd.concat(frames, ignore_index=True)
+
+    def write_result(self, table):
+        """
+        A function to write one table for the whole cohort to a single parquet file, streaming the patients
+        that are done into it one row group at a time, so only one patient's results are in memory.  The
+        patients' column types are unified first from the parquet footers.  Times of day are encoded as by
+        save_frame, so the file is read back with load_frame.  Without pyarrow, the table is combined in
+        memory and written by save_frame.
+
+        :param table: One of cohort_tables
+        :return: The path of the file written.
+        """
+        npath = os.path.join(self.directory, 'Cohort_' + table)
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            return save_frame(self.results(table), npath)
+
+        schemas = []
+        for patient_id in self.done():
+            path = os.path.join(self.directory, table, patient_id + '.parquet')
+            if os.path.exists(path):
+                schemas.append(pq.read_schema(path).remove_metadata())
+            else:
+                df = load_frame(os.path.join(self.directory, table, patient_id))
+                if df is not None:
+                    schemas.append(pa.Schema.from_pandas(encode_time_columns(df), preserve_index=False)
+                                   .remove_metadata())
+        if len(schemas) == 0:
+            return save_frame(self.results(table), npath)
+
+        schema = pa.unify_schemas(schemas)
+        flags = [name for name in schema.names if name.endswith(cache_time_flag % '')]
+        with pq.ParquetWriter(npath + '.parquet.tmp', schema) as writer:
+            for _, df in self.result_frames(table):
+                # Patients without times of day in a column have no flag column for it
+                df = encode_time_columns(df)
+                df = df.assign(**{flag: False for flag in flags if flag not in df})
+                writer.write_table(pa.Table.from_pandas(df, schema=schema, preserve_index=False))
+        os.replace(npath + '.parquet.tmp', npath + '.parquet')
+        return npath + '.parquet'
+
+    def write_results(self):
+        """
+        A function to write each table for the whole cohort to a single file in the cohort directory.
+
+        :return: A dictionary of the path written for each table.
+        """
+        return {table: self.write_result(table) for table in cohort_tables}
+
+    def __str__(self):
+        failed = [p for p in self.patients if self.__index['patients'].get(p, {}).get('status') == 'failed']
+        pending = self.pending()
+        txt = "Cohort: %s\n" % self.directory
+        txt += "Patients: %d (%d done, %d to run, of which %d failed)\n" % (
+            len(self.patients), len(self.patients) - len(pending), len(pending), len(failed))
+        return txt
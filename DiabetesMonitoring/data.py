@@ -0,0 +1,1161 @@
+"""
+Reading, caching and storing Omnipod and Dexcom data.
+"""
+import os
+import hashlib
+import warnings
+import json
+import glob
+from concurrent.futures import ProcessPoolExecutor
+import pandas as pd
+import datetime
+import numpy as np
+
+from .profiling import profile_stage
+
+
+# Insulin on board (IOB) information is only contained within a comment string and must be extracted
+regexMeal_IOB = r"""Meal IOB: (\d{0,2}\.\d{1,2})(?=;)"""
+regexCorrection_IOB = r"""Correction IOB: (\d{0,2}\.\d{0,2})"""
+varOverride = "Override"
+# Both IOB values are pulled from the comment in one pass.  Each lookahead finds the first match of the
+# corresponding pattern above anywhere in the comment, or leaves its group empty.
+regexIOB = r"""^(?=(?:.*?""" + regexMeal_IOB + r""")?)(?=(?:.*?""" + regexCorrection_IOB + r""")?)"""
+omnipod_summary_types = ['Insulin Summary', 'Notes', 'Pump Alarm', 'Glucose']
+# Description patterns used to classify each pump event, in priority order.  Rows with no match keep their Type.
+bolus_clean_labels = [('Reverse Corrected.', "Reverse Corrected"),
+                      ("Bolus-Meal", "Meal Bolus"),
+                      ("Correction", "Correction Bolus"),
+                      ("Extended", "Extended Meal Bolus"),
+                      ("Basal suspended", "Basal Suspended"),
+                      ("Temporary basal rate set", "Temp Basal"),
+                      ("Pod deactivated", "Pod Deactivated"),
+                      ("Basal resumed", "Basal Resumed")]
+omnipod_data_save = r'DiabetesManagement\Data\Omnipod\Generated'
+# Compact Omnipod events: a small-int code per event type and a bitfield of flags.  Reverse corrected meal
+# boluses are Meal Bolus events with the reverse corrected flag; IOB values are events of their own.
+omnipod_event_types = ['Meal', 'Meal Bolus', 'Bolus Insulin', 'Correction Bolus', 'Extended Meal Bolus',
+                       'Basal Insulin', 'Basal Resumed', 'Basal Suspended', 'Temp Basal', 'Pod Deactivated',
+                       'Meal IOB', 'Correction IOB', 'Other']
+omnipod_event_flags = {'Manual Override': 1, 'Reverse Corrected': 2}
+omnipod_value_decimals = 2
+omnipod_tabular_columns = ['Date Time',
+                           'Meal',  # carbohydrates
+                           'Meal Bolus', 'Bolus Insulin', 'Correction Bolus',
+                           'Extended Meal Bolus', 'Reverse Corrected',
+                           'Meal IOB', 'Correction IOB', 'Manual Override',
+                           'Basal Insulin', 'Basal Resumed', 'Basal Suspended', 'Temp Basal',
+                           'Pod Deactivated', 'Date', 'Time']
+dexcom_data_save = r'DiabetesManagement\Data\Dexcom\Generated'
+
+# Clarity exports are read with explicit, compact types so that large files can be streamed in chunks.
+# Event types/subtypes use a fixed category set so that chunks can be concatenated without re-encoding; any
+# other type in a file is kept as an extra category, with a warning.
+dexcom_timestamp = 'Timestamp (YYYY-MM-DDThh:mm:ss)'
+dexcom_timestamp_format = '%Y-%m-%dT%H:%M:%S'
+dexcom_event_types = pd.CategoricalDtype(['EGV', 'Calibration', 'Alert', 'Device', 'FirstName', 'LastName',
+                                          'DateOfBirth', 'Carbs', 'Insulin', 'Health', 'Exercise'])
+dexcom_event_subtypes = pd.CategoricalDtype(['High', 'Low', 'Urgent Low', 'Urgent Low Soon', 'Rise', 'Fall',
+                                             'OutOfRange', 'Signal Loss', 'Fast-Acting', 'Long-Acting',
+                                             'Illness', 'Stress', 'High Symptoms', 'Low Symptoms', 'Cycle',
+                                             'Alcohol', 'Light', 'Medium', 'Heavy'])
+dexcom_dtypes = {'Index': 'int64',
+                 dexcom_timestamp: 'object',
+                 'Event Type': dexcom_event_types,
+                 'Event Subtype': dexcom_event_subtypes,
+                 'Patient Info': 'object',
+                 'Device Info': 'object',
+                 'Source Device ID': 'category',
+                 'Glucose Value (mg/dL)': 'float32',
+                 'Insulin Value (u)': 'float32',
+                 'Carb Value (grams)': 'float32',
+                 'Duration (hh:mm:ss)': 'object',
+                 'Glucose Rate of Change (mg/dL/min)': 'float32',
+                 'Transmitter Time (Long Integer)': 'Int64'}
+# Glucose values are read as text, as Clarity writes readings outside the sensor's range as "Low" or "High".
+# These are kept as the limits of the range.
+dexcom_read_dtypes = dict(dexcom_dtypes, **{'Event Type': 'category', 'Event Subtype': 'category',
+                                            'Glucose Value (mg/dL)': 'object'})
+dexcom_glucose_limits = {'Low': 40, 'High': 400}
+dexcom_chunk_rows = 10000
+
+# Parsed source files are cached as parquet in the Generated subfolders, keyed on a hash of the file contents.
+# Columns mixing times of day with text (the Time column of an Omnipod log) are stored as text, with a flag
+# column named by cache_time_flag marking the times, so that every parsed source can be stored as parquet.
+cache_suffixes = ('.parquet', '.pkl')
+cache_time_flag = '%s (is time)'
+cache_hash_length = 16
+cache_generations = 2
+cache_block_bytes = 1 << 20
+
+# Incremental stores deduplicate on a stable key per source.  The Clarity Index column is only a row number
+# within one export, so Dexcom rows are keyed on their timestamp, event type and device instead.
+store_key_columns = {'DEXCOM': [dexcom_timestamp, 'Event Type', 'Source Device ID'],
+                     'OMNIPOD': ['Date', 'Time', 'Type', 'Value', 'Description']}
+# Appended segments are compacted into one segment per calendar month once there are more than store_segment_limit.
+store_segment_limit = 64
+
+
+def encode_time_columns(df):
+    """
+    A function to make a dataframe storable as parquet by writing object columns that hold times of day
+    (datetime.time) as ISO text, with a cache_time_flag column marking which values were times.
+
+    :param df: A dataframe
+    :return: The dataframe with times encoded, or df itself if it has none.
+    """
+    encoded = {}
+    for col in df.columns[df.dtypes == object]:
+        is_time = df[col].map(lambda value: isinstance(value, datetime.time)).to_numpy(dtype=bool)
+        if is_time.any():
+            text = df[col].map(lambda value: value.isoformat() if isinstance(value, datetime.time) else value)
+            encoded[col] = text.where(df[col].isna() | is_time, df[col].astype(str))
+            encoded[cache_time_flag % col] = is_time
+    return df.assign(**encoded) if encoded else df
+
+
+def decode_time_columns(df):
+    """
+    A function to restore the times of day written by encode_time_columns.
+
+    :param df: A dataframe read from parquet
+    :return: The dataframe with its times restored and the flag columns removed.
+    """
+    flags = [col for col in df.columns if isinstance(col, str) and col.endswith(cache_time_flag % '')]
+    if not flags:
+        return df
+    df = df.copy()
+    for flag in flags:
+        col = flag[:-len(cache_time_flag % '')]
+        values = df[col].astype(object)
+        is_time = df[flag].to_numpy(dtype=bool)
+        values[is_time] = [datetime.time.fromisoformat(value) for value in values[is_time]]
+        df[col] = values
+    return df.drop(columns=flags)
+
+
+def save_frame(df, npath):
+    """
+    A function to save a dataframe in the Generated folders as parquet, with any times of day encoded by
+    encode_time_columns.  Pickle is only used if no parquet engine is installed, or for columns of other
+    types parquet cannot hold.
+
+    :param df: The dataframe to save
+    :param npath: The file path without a suffix
+    :return: The path of the file written.
+    """
+    os.makedirs(os.path.dirname(npath), exist_ok=True)
+    try:
+        encode_time_columns(df).to_parquet(npath + '.parquet')
+        return npath + '.parquet'
+    # pyarrow's conversion errors are TypeError and ValueError subclasses; anything else is a real failure
+    except (ImportError, TypeError, ValueError):
+        if os.path.exists(npath + '.parquet'):
+            os.remove(npath + '.parquet')
+    df.to_pickle(npath + '.pkl')
+    return npath + '.pkl'
+
+
+def load_frame(npath):
+    """
+    A function to load a dataframe written by save_frame.
+
+    :param npath: The file path without a suffix
+    :return: The dataframe, or None if no readable file exists.
+    """
+    try:
+        if os.path.exists(npath + '.parquet'):
+            return decode_time_columns(pd.read_parquet(npath + '.parquet'))
+        if os.path.exists(npath + '.pkl'):
+            return pd.read_pickle(npath + '.pkl')
+    except Exception as error:
+        print(error)
+    return None
+
+
+class DiabetesData(object):
+    """
+    A class for diabetes data sources specific to this project.
+    Data Sources:
+        - Omnipod (11/2017)
+        - Dexcom
+    """
+
+    def __init__(self, file_folder, file_name, data_source):
+        self.file_folder = file_folder
+        self.path = os.path.abspath(os.path.join("..", file_folder, file_name))
+        self.directory = os.path.abspath(os.path.join("..", file_folder))
+        self.file_format = os.path.splitext(self.path)[1]
+        self.data_source = data_source
+        self.__diabetes_df = None
+        self.__diabetes_mtime = None
+
+        if self.file_format not in ['.xlsx', '.xls', '.csv']:
+            raise TypeError('File must be .xlsx, .xls, or .csv.')
+
+        if self.data_source not in 'Dexcom,Omnipod':
+            raise 'Accepts raw Omnipod log or Dexcom file (from Clarity).'
+
+    @property
+    def file_name(self):
+        return self.file_name
+
+    @property
+    def cache_directory(self):
+        return os.path.join(self.directory, 'Generated')
+
+    def source_hash(self):
+        """
+        A function to fingerprint the contents of the source file.  The cache is keyed on this hash,
+        so any change to the file (rather than just its modified time) invalidates the cache.
+
+        :return: A hex digest of the file contents.
+        """
+        digest = hashlib.sha1()
+        with open(self.path, 'rb') as source:
+            for block in iter(lambda: source.read(cache_block_bytes), b''):
+                digest.update(block)
+        return digest.hexdigest()
+
+    def cache_prefix(self):
+        stem = os.path.splitext(os.path.basename(self.path))[0]
+        return self.data_source + '_' + stem + '_'
+
+    def cache_stem(self, source_hash=None):
+        if source_hash is None:
+            source_hash = self.source_hash()
+        return os.path.join(self.cache_directory, self.cache_prefix() + source_hash[:cache_hash_length])
+
+    @profile_stage
+    def parse_data(self):
+        """
+        A function to parse the source file into a dataframe, bypassing the cache.
+
+        :return: A diabetes dataframe.
+        """
+        if self.file_format == ".xlsx" and self.data_source.upper() == "OMNIPOD":
+            diabetes_dataframe = pd.read_excel(self.path, na_values='').fillna('0 NoDescription') \
+                .drop_duplicates()
+        elif self.file_format == ".csv" and self.data_source.upper() == "OMNIPOD":
+            diabetes_dataframe = pd.read_csv(self.path, na_values='').fillna('0 NoDescription') \
+                .drop_duplicates()
+
+        # By definition, Dexcom data should not contain duplicates.
+        elif self.file_format == ".xlsx" and self.data_source.upper() == "DEXCOM":
+            diabetes_dataframe = pd.read_excel(self.path, header=0, skiprows=range(1, 15)) \
+                .dropna(how="all", axis=1).drop_duplicates()
+        elif self.file_format == ".csv" and self.data_source.upper() == "DEXCOM":
+            diabetes_dataframe = pd.read_csv(self.path, header=0, skiprows=range(1, 15)). \
+                dropna(how="all", axis=1).drop_duplicates()
+        else:
+            raise TypeError("Function only accepts raw Omnipod (log) or Dexcom file (from Clarity).")
+
+        return diabetes_dataframe
+
+    @profile_stage
+    def read_data(self, use_cache=True):
+        """
+        A function to read data into a dataframe from a variety of sources.
+
+        :param use_cache: If True, a parsed copy of the file is kept in the Generated subfolder of
+        your data directory, keyed on a hash of the file contents.  Later reads of an unchanged file
+        load the cached copy instead of parsing the file again, and older cached copies of the same
+        file are pruned.
+        :return: A diabetes dataframe.
+        """
+        if not use_cache:
+            return self.parse_data()
+
+        npath = self.cache_stem()
+        diabetes_dataframe = load_frame(npath)
+        if diabetes_dataframe is not None:
+            return diabetes_dataframe
+
+        diabetes_dataframe = self.parse_data()
+        save_frame(diabetes_dataframe, npath)
+        self.prune_cache()
+
+        return diabetes_dataframe
+
+    def prune_cache(self, keep=cache_generations):
+        """
+        A function to remove older cached generations of this source file from the Generated subfolder.
+
+        :param keep: The number of most recent generations to keep.
+        """
+        if not os.path.isdir(self.cache_directory):
+            return
+        prefix = self.cache_prefix()
+        generations = [os.path.join(self.cache_directory, name) for name in os.listdir(self.cache_directory)
+                       if name.startswith(prefix)
+                       and os.path.splitext(name)[1] in cache_suffixes
+                       and len(os.path.splitext(name)[0]) == len(prefix) + cache_hash_length]
+        generations.sort(key=os.path.getmtime, reverse=True)
+        for npath in generations[keep:]:
+            os.remove(npath)
+
+    def read_chunks(self, chunksize=dexcom_chunk_rows):
+        """
+        A generator to stream a Dexcom (Clarity) csv file in fixed-size chunks.  Columns are read with
+        the compact types in dexcom_dtypes and timestamps are parsed as each chunk is read.  The header
+        and alert rows at the top of a Clarity export have no timestamp and are dropped as they are read,
+        so peak memory depends on the chunk size rather than the size of the file.
+
+        :param chunksize: The number of file rows to read per chunk.
+        :return: An iterator of Dexcom dataframes, each containing at most chunksize rows.
+        """
+        if self.file_format != ".csv" or self.data_source.upper() != "DEXCOM":
+            raise TypeError('Streaming is only supported for Dexcom (Clarity) .csv files.')
+
+        reader = pd.read_csv(self.path, header=0, dtype=dexcom_read_dtypes, chunksize=chunksize,
+                             encoding='utf-8-sig')
+        for chunk in reader:
+            chunk[dexcom_timestamp] = pd.to_datetime(chunk[dexcom_timestamp], format=dexcom_timestamp_format,
+                                                     errors='coerce').astype('datetime64[ns]')
+            chunk['Glucose Value (mg/dL)'] = dexcom_glucose_values(chunk['Glucose Value (mg/dL)'])
+            chunk['Event Type'] = dexcom_categories(chunk['Event Type'], dexcom_event_types, self.path)
+            chunk['Event Subtype'] = dexcom_categories(chunk['Event Subtype'], dexcom_event_subtypes, self.path)
+            chunk = chunk[chunk[dexcom_timestamp].notna()]
+            if len(chunk) > 0:
+                yield chunk
+
+    def read_data_chunked(self, chunksize=dexcom_chunk_rows):
+        """
+        A function to read a Dexcom (Clarity) csv file through read_chunks into a single dataframe.
+
+        :param chunksize: The number of file rows to read per chunk.
+        :return: A Dexcom dataframe with compact column types.  Nothing is written to the Generated folder.
+        """
+        return dexcom_concat_chunks(self.read_chunks(chunksize=chunksize))
+
+    def source_mtime(self):
+        if os.path.exists(self.path):
+            return os.path.getmtime(self.path)
+        return None
+
+    def cached_data(self):
+        """
+        A function to return the parsed dataframe for this file, parsing it only on first use.  The file is
+        parsed again if its modified time has changed since the dataframe was loaded.
+
+        :return: A diabetes dataframe.  The same dataframe is returned on every call, so copy it before
+        modifying it in place.
+        """
+        if self.__diabetes_df is None or self.source_mtime() != self.__diabetes_mtime:
+            return self.reload()
+        return self.__diabetes_df
+
+    def set_cached_data(self, diabetes_df):
+        """
+        A function to use an already parsed dataframe for this file instead of reading it.
+
+        :param diabetes_df: A diabetes dataframe matching the source file.
+        """
+        self.__diabetes_df = diabetes_df
+        self.__diabetes_mtime = self.source_mtime()
+
+    def reload(self):
+        """
+        A function to read the file again, replacing the dataframe held by this instance.
+
+        :return: A diabetes dataframe.
+        """
+        self.set_cached_data(self.read_data())
+        return self.__diabetes_df
+
+    def invalidate(self):
+        """
+        A function to drop the dataframe held by this instance, so that it is read again on next use.
+        """
+        self.__diabetes_df = None
+        self.__diabetes_mtime = None
+
+    def __str__(self):
+        txt = "Datasource: %s\n" % self.data_source
+        txt += "File is located at: %s\n" % self.path
+
+        return txt
+
+
+# ----------------------------------------------------
+# ----------------------------------------------------
+
+
+class Omnipod(DiabetesData):
+    def __init__(self, file_folder, file_name, data_source="", diabetes_df=""):
+        DiabetesData.__init__(self, file_folder, file_name, data_source)
+        if isinstance(diabetes_df, pd.DataFrame):
+            self.set_cached_data(diabetes_df)
+
+    @property
+    def diabetes_df(self):
+        return self.cached_data()
+
+
+def omnipod_remove_summary(x):
+    df_x = x[x.Type != 'Insulin Summary']
+    df_x = df_x[df_x.Type != 'Notes']
+    df_x = df_x[df_x.Type != 'Pump Alarm']
+    df_x = df_x[df_x.Type != 'Glucose']
+    return df_x
+
+
+@profile_stage
+def omnipod_extract_dedup(df_i):
+    """
+    A function to return a cleaned up version of a dataframe.
+    :param df_i:
+    :return:
+    """
+    # Copy to eliminate chained assignment warnings
+    df = omnipod_remove_summary(df_i).copy()
+
+    # Split units from values
+    value_units = df['Value'].str.split(' ', n=1, expand=True)
+    df['Value'], df['Units'] = value_units[0], value_units[1]
+    df[['Value']] = df[['Value']].apply(pd.to_numeric)
+    df = df.fillna(float(0))
+
+    # Create datetime field
+    df['Date'] = df['Date'].apply(lambda x: x.date())
+    df['Date Time'] = df[['Date', 'Time']].apply(lambda x: datetime.datetime.combine(*list(x)) \
+                                                 , axis=1)
+
+    # IOB values
+    df['Meal IOB'] = df['Comment'].str.extract(regexMeal_IOB, expand=True)
+    df['Meal IOB'] = df['Meal IOB'].apply(lambda x: float(x))
+    df['Correction IOB'] = df['Comment'].str.extract(regexCorrection_IOB, expand=True)
+    df['Correction IOB'] = df['Correction IOB'].apply(lambda x: float(x))
+
+    # Add override flag
+    df['Manual Override'] = np.where(df.Comment.str.contains(varOverride), 1, 0)
+
+    # remove redundancies to make data pivot table
+    df.drop_duplicates()
+    df['Bolus Clean'] = np.where(
+        df.Description.str.contains('Reverse Corrected.'),
+        "Reverse Corrected",
+        np.where(df.Description.str.contains("Bolus-Meal"), "Meal Bolus",
+                 np.where(df.Description.str.contains("Correction"), "Correction Bolus",
+                          np.where(df.Description.str.contains("Extended"),
+                                   "Extended Meal Bolus",
+                                   np.where(
+                                       df.Description.str.contains("Basal suspended"),
+                                       "Basal Suspended",
+                                       np.where(df.Description.str.contains(
+                                           "Temporary basal rate set"), "Temp Basal",
+                                           np.where(df.Description.str.contains(
+                                               "Pod deactivated"),
+                                               "Pod Deactivated",
+                                               np.where(
+                                                   df.Description.str.contains("Basal resumed"),
+                                                   "Basal Resumed",
+                                                   df["Type"]))))))))
+
+    return df
+
+
+def omnipod_classify(description, fallback):
+    """
+    A function to label pump events with the first matching pattern in bolus_clean_labels.  Descriptions
+    repeat heavily in a pump log, so the patterns are only tested against the distinct descriptions and
+    the labels are then mapped back onto every row.
+    :param description: A series of Omnipod event descriptions
+    :param fallback: A series of labels to use where no pattern matches (the event Type)
+    :return: A numpy array of labels.
+    """
+    codes, uniques = pd.factorize(description)
+    unique_text = pd.Series(uniques, dtype=object).astype(str)
+    unique_labels = np.full(len(uniques) + 1, None, dtype=object)
+    unmatched = np.ones(len(uniques), dtype=bool)
+    for pattern, label in bolus_clean_labels:
+        found = unmatched & unique_text.str.contains(pattern).to_numpy(dtype=bool)
+        unique_labels[:-1][found] = label
+        unmatched &= ~found
+
+    # Missing descriptions are factorized to -1, which picks the trailing empty label
+    labels = unique_labels[codes]
+    no_label = pd.isnull(labels)
+    labels[no_label] = np.asarray(fallback, dtype=object)[no_label]
+    return labels
+
+
+@profile_stage
+def omnipod_extract_dedup_vectorized(df_i):
+    """
+    A vectorized version of omnipod_extract_dedup that returns the same dataframe.  The timestamp is built
+    with datetime addition, both IOB values come from one regex extraction, and Bolus Clean comes from a
+    single ordered classifier rather than nested np.where calls.
+    :param df_i: A raw Omnipod dataframe
+    :return: A cleaned up Omnipod dataframe.
+    """
+    df = df_i[~df_i['Type'].isin(omnipod_summary_types)].copy()
+
+    # Split units from values
+    value_units = df['Value'].str.split(' ', n=1, expand=True)
+    df['Value'] = pd.to_numeric(value_units[0])
+    df['Units'] = value_units[1] if value_units.shape[1] > 1 else np.nan
+    df = df.fillna(float(0))
+
+    # Create datetime field
+    dates = pd.to_datetime(df['Date'])
+    df['Date'] = dates.dt.date
+    time_codes, times = pd.factorize(df['Time'])
+    offsets = pd.to_timedelta(pd.Series(times, dtype=object).astype(str)).to_numpy()
+    df['Date Time'] = dates.dt.normalize() + offsets[time_codes]
+
+    # IOB values, extracted once per distinct comment
+    comment_codes, comments = pd.factorize(df['Comment'])
+    iob = pd.Series(comments, dtype=object).str.extract(regexIOB, expand=True).astype(float).to_numpy()
+    df['Meal IOB'] = iob[comment_codes, 0]
+    df['Correction IOB'] = iob[comment_codes, 1]
+
+    # Add override flag
+    df['Manual Override'] = df['Comment'].str.contains(varOverride).astype('int64')
+
+    df['Bolus Clean'] = omnipod_classify(df['Description'], df['Type'])
+
+    return df
+
+
+@profile_stage
+def omnipod_to_tabular(df_i, save=True):
+    """
+    A function to convert omnipod data in a dataframe to a usable (tabular) format for visualization
+    :param df_i:
+    :param save: Whether to write the csv copy described below
+    :return: A cleaned up and tabularized Omnipod dataframe.  This data is also saved as a csv to the Generated
+    sub-folder in the Data section of your repository.  This will allow you to explore the data in excel as well.
+    """
+    df_o = omnipod_extract_dedup_vectorized(df_i)
+    df_pivot = df_o.pivot(index='Date Time', columns='Bolus Clean', values='Value')
+    df_pivot = df_pivot.reset_index()  # Add Date Time index back into dataframe as a column
+
+    new = pd.merge(df_pivot, df_o, how='inner', on='Date Time')
+
+    # Removed glucose and pump alarm because they were causing duplicated.  12-14-17
+    new = new[omnipod_tabular_columns]
+
+    new = new.replace(np.nan, 0.00).drop_duplicates()
+
+    # create a csv with the newly cleaned dataframe.  The file is overwritten on each run rather than
+    # adding a new timestamped copy.
+    if save:
+        npath = os.path.abspath(os.path.join("..", omnipod_data_save, "Omnipod_Tabular.csv"))
+        new.to_csv(npath)  # , compression='gzip')
+
+    return new
+
+
+class OmnipodEvents(object):
+    """
+    A compact, long-format store of Omnipod pump events held as contiguous arrays sorted by time: int64
+    nanosecond timestamps, an int8 code into omnipod_event_types, a float32 value and a uint8 bitfield of
+    omnipod_event_flags.  Each event costs 14 bytes, rather than a wide row of mostly zero float and object
+    columns with separate Date, Time and Date Time copies, and scans for a type of event are comparisons on
+    the int8 codes.  Build it with omnipod_events, and produce the omnipod_to_tabular view with to_tabular.
+    """
+
+    def __init__(self, times, codes, values, flags):
+        times = np.asarray(times).astype('datetime64[ns]').view('int64')
+        codes = np.asarray(codes, dtype='int8')
+        values = np.asarray(values, dtype='float32')
+        flags = np.asarray(flags, dtype='uint8')
+        if not len(times) == len(codes) == len(values) == len(flags):
+            raise ValueError('times, codes, values and flags must be the same length.')
+        if len(times) > 1 and (np.diff(times) < 0).any():
+            order = np.argsort(times, kind='stable')
+            times, codes, values, flags = times[order], codes[order], values[order], flags[order]
+        self.times = np.ascontiguousarray(times)
+        self.codes = np.ascontiguousarray(codes)
+        self.values = np.ascontiguousarray(values)
+        self.flags = np.ascontiguousarray(flags)
+
+    def __len__(self):
+        return len(self.times)
+
+    @property
+    def event_times(self):
+        return self.times.view('datetime64[ns]')
+
+    @property
+    def nbytes(self):
+        return self.times.nbytes + self.codes.nbytes + self.values.nbytes + self.flags.nbytes
+
+    def subset(self, keep):
+        events = OmnipodEvents.__new__(OmnipodEvents)
+        events.times, events.codes = self.times[keep], self.codes[keep]
+        events.values, events.flags = self.values[keep], self.flags[keep]
+        return events
+
+    def select(self, types=None, start=None, end=None, flag=None):
+        """
+        A function to select events by type, time and flag.
+
+        :param types: An event type or list of types from omnipod_event_types.  Default is every type.
+        :param start: The first time to include.  Default is the start of the events.
+        :param end: The last time to include.  Default is the end of the events.
+        :param flag: Optionally, only keep events with this flag from omnipod_event_flags set
+        :return: An OmnipodEvents of the selected events.
+        """
+        first = 0 if start is None else np.searchsorted(self.times, pd.Timestamp(start).value, side='left')
+        stop = len(self.times) if end is None else np.searchsorted(self.times, pd.Timestamp(end).value,
+                                                                   side='right')
+        events = self.subset(slice(first, max(first, stop)))
+        if types is not None:
+            events = events.subset(np.isin(events.codes, omnipod_event_codes(types)))
+        if flag is not None:
+            events = events.subset((events.flags & omnipod_event_flags[flag]) > 0)
+        return events
+
+    def to_frame(self):
+        """
+        :return: A long dataframe with a row per event: Date Time, Event Type, Value and a column per flag.
+        """
+        frame = pd.DataFrame({'Date Time': self.event_times,
+                              'Event Type': pd.Categorical.from_codes(self.codes, omnipod_event_types),
+                              'Value': self.values})
+        for flag, bit in omnipod_event_flags.items():
+            frame[flag] = (self.flags & bit) > 0
+        return frame
+
+    def to_tabular(self):
+        """
+        A function to produce the wide view of omnipod_to_tabular: one row per event time with a column per
+        event type.  If a type appears twice at one time, the last value is kept.  Values are rounded to the
+        pump's 0.01 resolution, as float32 cannot hold them exactly.
+
+        :return: A dataframe with the columns of omnipod_to_tabular.
+        """
+        times, rows = np.unique(self.times, return_inverse=True)
+        columns = [col for col in omnipod_tabular_columns if col not in ['Date Time', 'Manual Override', 'Date',
+                                                                         'Time']]
+        # Reverse corrected meal boluses go to their own column
+        reverse = (self.flags & omnipod_event_flags['Reverse Corrected']) > 0
+        labels = np.asarray(omnipod_event_types, dtype=object)[self.codes]
+        labels[reverse & (self.codes == omnipod_event_types.index('Meal Bolus'))] = 'Reverse Corrected'
+        column_codes = pd.Categorical(labels, categories=columns).codes
+
+        wide = np.zeros((len(times), len(columns) + 1))
+        known = column_codes >= 0
+        wide[rows[known], column_codes[known]] = np.round(self.values[known].astype(float), omnipod_value_decimals)
+        override = (self.flags & omnipod_event_flags['Manual Override']) > 0
+        wide[rows[override], -1] = 1
+
+        date_times = pd.Series(times.view('datetime64[ns]'))
+        tabular = pd.DataFrame(wide[:, :-1], columns=columns)
+        tabular.insert(0, 'Date Time', date_times)
+        tabular['Manual Override'] = wide[:, -1].astype('int64')
+        tabular['Date'] = date_times.dt.date
+        tabular['Time'] = date_times.dt.time
+        return tabular[omnipod_tabular_columns]
+
+    def __str__(self):
+        txt = "Omnipod events: %d (%d bytes)\n" % (len(self), self.nbytes)
+        if len(self):
+            txt += "From %s to %s\n" % (self.event_times[0], self.event_times[-1])
+        return txt
+
+
+def omnipod_event_codes(types):
+    """
+    :param types: An event type or list of types from omnipod_event_types
+    :return: An int8 array of their codes.
+    """
+    if isinstance(types, str):
+        types = [types]
+    unknown = [t for t in types if t not in omnipod_event_types]
+    if unknown:
+        raise ValueError('Unknown Omnipod event types: %s' % ', '.join(unknown))
+    return np.array([omnipod_event_types.index(t) for t in types], dtype='int8')
+
+
+@profile_stage
+def omnipod_events(df_i):
+    """
+    A function to build the compact OmnipodEvents store from a raw Omnipod dataframe.
+
+    :param df_i: A raw Omnipod dataframe, or an existing OmnipodEvents (returned as-is)
+    :return: An OmnipodEvents with an event per pump event, and Meal IOB and Correction IOB events for each
+    event whose comment has them.
+    """
+    if isinstance(df_i, OmnipodEvents):
+        return df_i
+    df = omnipod_extract_dedup_vectorized(df_i)
+
+    labels = df['Bolus Clean'].to_numpy(dtype=object)
+    reverse = labels == 'Reverse Corrected'
+    labels = np.where(reverse, 'Meal Bolus', labels)
+    codes = pd.Categorical(labels, categories=omnipod_event_types).codes
+    codes = np.where(codes < 0, omnipod_event_types.index('Other'), codes)
+    flags = np.where(df['Manual Override'].to_numpy() > 0, omnipod_event_flags['Manual Override'], 0) | \
+        np.where(reverse, omnipod_event_flags['Reverse Corrected'], 0)
+    times = df['Date Time'].to_numpy(dtype='datetime64[ns]')
+
+    # IOB is repeated on every row that shares a comment; one event per time and value is kept
+    iob = [pd.DataFrame({'times': times, 'codes': omnipod_event_types.index(name), 'values': df[name].to_numpy(),
+                         'flags': flags}).dropna(subset=['values']).drop_duplicates(['times', 'values'])
+           for name in ['Meal IOB', 'Correction IOB']]
+    events = pd.concat([pd.DataFrame({'times': times, 'codes': codes, 'values': df['Value'].to_numpy(dtype=float),
+                                      'flags': flags})] + iob, ignore_index=True)
+    return OmnipodEvents(events['times'].to_numpy(), events['codes'].to_numpy(), events['values'].to_numpy(),
+                         events['flags'].to_numpy())
+
+
+def average_bolus(df_i, list_cols=['Date', 'Meal Bolus', 'Correction Bolus', 'Bolus Insulin',
+                                 'Extended Meal Bolus', 'Reverse Corrected', 'Total Bolus']):
+    """
+    A function that calculates the average daily bolus used.
+    param: df_i - use the cleaned up insulin dataframe, the step after reading the data in
+    """
+    df = df_i[list_cols]
+    df_x = df.replace(0, np.NaN)
+    df_y = (df_x.mean(), df_x.count())
+    return df_y
+
+
+def daily_bolus(df_i):
+    """
+    A function to calculate the amount of bolus insulin used daily.
+    param: df_i - use the cleaned up insulin dataframe, the step after reading the data in
+    """
+
+    table = pd.pivot_table(df_i, values='Total Bolus', index='Date', aggfunc=np.sum).reset_index()
+    table['Date'] = table['Date'].astype('datetime64[ns]')
+    return table
+
+
+# ----------------------------------------------------
+# ----------------------------------------------------
+
+
+class Dexcom(DiabetesData):
+    def __init__(self, file_folder, file_name, data_source="", diabetes_df=""):
+        DiabetesData.__init__(self, file_folder, file_name, data_source)
+        if isinstance(diabetes_df, pd.DataFrame):
+            self.set_cached_data(diabetes_df)
+
+    @property
+    def diabetes_df(self):
+        return self.cached_data()
+
+
+@profile_stage
+def dexcom_clean(dexcom_df):
+    """
+    A function to clean dexcom data to a better format for joining to Omnipod data.
+
+    Input:
+        - dexcom_df - a Dexcom dataframe generates from earlier functions
+
+    Output:
+        - A new dataframe cleaned up with better names and date formats to support joining
+    """
+    dexcom = dexcom_df
+    dexcom = dexcom.rename(columns={'Timestamp (YYYY-MM-DDThh:mm:ss)': 'event_time'})
+    dexcom['event_time'] = dexcom['event_time'].astype('datetime64[ns]')
+    if not pd.api.types.is_numeric_dtype(dexcom['Glucose Value (mg/dL)']):
+        dexcom['Glucose Value (mg/dL)'] = dexcom_glucose_values(dexcom['Glucose Value (mg/dL)'])
+    return dexcom
+
+
+def dexcom_glucose_values(values):
+    """
+    A function to convert Clarity glucose values to numbers.
+
+    :param values: A series of glucose values as read from a Clarity export
+    :return: A float32 series, with "Low" and "High" set to the limits in dexcom_glucose_limits and anything
+    else that is not a number set to NaN.
+    """
+    numbers = pd.to_numeric(values, errors='coerce').astype('float32')
+    for marker, limit in dexcom_glucose_limits.items():
+        numbers = numbers.mask(values == marker, np.float32(limit))
+    return numbers
+
+
+def dexcom_categories(values, dtype, path=None):
+    """
+    A function to give a Clarity event type or subtype column the fixed categories of dtype.  Values that
+    are not in dtype are kept as extra categories, with a warning, rather than lost.
+
+    :param values: A categorical series as read from a Clarity export
+    :param dtype: dexcom_event_types or dexcom_event_subtypes
+    :param path: Optionally, the file the values were read from, for the warning
+    :return: A categorical series with the categories of dtype, then any others.
+    """
+    known = list(dtype.categories)
+    unknown = sorted(set(values.dropna().unique()) - set(known))
+    if unknown:
+        warnings.warn('Unknown Dexcom %s %s%s, kept as extra categories.'
+                      % (values.name, ', '.join(map(str, unknown)), '' if path is None else ' in ' + path))
+    return values.astype(pd.CategoricalDtype(known + unknown))
+
+
+def dexcom_concat_chunks(chunks):
+    """
+    A function to combine the chunks generated by DiabetesData.read_chunks into one dataframe.
+    Source Device ID categories differ from chunk to chunk, so they are unioned rather than
+    falling back to an object column.  So are any extra event type and subtype categories.
+
+    :param chunks: An iterable of Dexcom dataframes.
+    :return: A single Dexcom dataframe with a fresh index.
+    """
+    chunks = list(chunks)
+    if len(chunks) == 0:
+        return pd.DataFrame({col: pd.Series(dtype=dtype) for col, dtype in dexcom_dtypes.items()}) \
+            .astype({dexcom_timestamp: 'datetime64[ns]'})
+
+    columns = ['Source Device ID', 'Event Type', 'Event Subtype']
+    categories = {col: pd.api.types.union_categoricals([chunk[col] for chunk in chunks]).categories for col in columns}
+    chunks = [chunk.assign(**{col: chunk[col].cat.set_categories(categories[col]) for col in columns})
+              for chunk in chunks]
+    return pd.concat(chunks, ignore_index=True)
+
+
+def source_event_times(df, data_source):
+    """
+    A function to build a timestamp for every row of a raw Omnipod or Dexcom dataframe.
+
+    :param df: A dataframe from DiabetesData.read_data
+    :param data_source: "Omnipod" or "Dexcom"
+    :return: A datetime series; rows without a usable date and time of day are NaT.
+    """
+    if data_source.upper() == "DEXCOM":
+        return pd.to_datetime(df[dexcom_timestamp], errors='coerce')
+
+    dates = pd.to_datetime(df['Date'], errors='coerce').dt.normalize()
+    time_codes, times = pd.factorize(df['Time'])
+    offsets = pd.to_timedelta(pd.Series(times, dtype=object).astype(str), errors='coerce').to_numpy()
+    return dates + np.where(time_codes < 0, np.timedelta64('NaT'), offsets[time_codes])
+
+
+def source_files(path):
+    """
+    A function to list the Omnipod or Dexcom files in a folder, or matching a glob pattern.
+
+    :param path: A folder or a glob pattern such as "Data/Dexcom/CLARITY_*.csv"
+    :return: A sorted list of absolute file paths.
+    """
+    if os.path.isdir(path):
+        path = os.path.join(path, '*')
+    return sorted(os.path.abspath(name) for name in glob.glob(path)
+                  if os.path.splitext(name)[1] in ['.xlsx', '.xls', '.csv'])
+
+
+def read_file(path, data_source, use_cache=True):
+    """
+    A function to read one source file by its path.  This is the unit of work for read_files workers.
+
+    :param path: The path of an Omnipod or Dexcom file
+    :param data_source: "Omnipod" or "Dexcom"
+    :param use_cache: Passed to DiabetesData.read_data
+    :return: A diabetes dataframe.
+    """
+    path = os.path.abspath(path)
+    return DiabetesData(os.path.dirname(path), os.path.basename(path), data_source).read_data(use_cache)
+
+
+def read_files(path, data_source, workers=None, use_cache=True):
+    """
+    A function to read every Omnipod or Dexcom file in a folder (or matching a glob pattern) at once.
+    Files are parsed concurrently in a process pool, then combined in time order with rows that appear
+    in more than one file removed.
+
+    :param path: A folder or a glob pattern
+    :param data_source: "Omnipod" or "Dexcom"
+    :param workers: The number of worker processes.  Default is the number of CPUs; 1 reads in this process.
+    :param use_cache: Passed to DiabetesData.read_data
+    :return: A dataframe in the same shape as DiabetesData.read_data, ready for omnipod_to_tabular or
+    dexcom_clean.
+    """
+    if data_source.upper() not in store_key_columns:
+        raise ValueError('Accepts raw Omnipod log or Dexcom file (from Clarity).')
+    paths = source_files(path)
+    if len(paths) == 0:
+        raise ValueError('No .xlsx, .xls or .csv files found at %s' % path)
+
+    if workers == 1 or len(paths) == 1:
+        frames = [read_file(name, data_source, use_cache) for name in paths]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            frames = list(pool.map(read_file, paths, [data_source] * len(paths), [use_cache] * len(paths)))
+
+    df = pd.concat(frames, ignore_index=True)
+    df = df.drop_duplicates(subset=store_key_columns[data_source.upper()])
+
+    # Rows without a timestamp (Clarity header rows, Omnipod summaries) sort first, as they do in a Clarity export
+    times = source_event_times(df, data_source)
+    order = np.argsort(times.to_numpy(), kind='stable')
+    order = np.concatenate([order[times.isna().to_numpy()[order]], order[times.notna().to_numpy()[order]]])
+    return df.iloc[order].reset_index(drop=True)
+
+
+class DiabetesStore(object):
+    """
+    A persistent, time-indexed store of raw data for one source, built up incrementally from exports.
+
+    Each append only keeps rows at or after the stored high-water mark, deduplicates them on
+    store_key_columns and writes them as a new segment, so adding an export costs time proportional to
+    the new data rather than the full history.  Every segment has a side file of its row times and hashed
+    keys, which is all that deduplication and stale checks read.  Rows without a timestamp (Clarity header
+    and alert rows, Omnipod daily summaries) are not stored.  Rows before the high-water mark that are not
+    already stored (e.g. events backfilled into a later export) cannot be added; they are counted once in the
+    index as stale_rows, with a warning, and their keys are kept so appending the same export again does not
+    count them twice.  Once there are more than store_segment_limit appended segments, they are compacted
+    into one segment per calendar month.
+    """
+
+    def __init__(self, directory, data_source):
+        self.directory = os.path.abspath(directory)
+        self.data_source = data_source
+        if data_source.upper() not in store_key_columns:
+            raise ValueError('Accepts raw Omnipod log or Dexcom file (from Clarity).')
+        self.key_columns = store_key_columns[data_source.upper()]
+        self.__index = self.read_index()
+
+    @property
+    def index_path(self):
+        return os.path.join(self.directory, self.data_source + '_Store.json')
+
+    @property
+    def stale_path(self):
+        return os.path.join(self.directory, self.data_source + '_Stale.npy')
+
+    @property
+    def high_water_mark(self):
+        if self.__index['high_water_mark'] is None:
+            return None
+        return pd.Timestamp(self.__index['high_water_mark'])
+
+    @property
+    def segments(self):
+        return list(self.__index['segments'])
+
+    def read_index(self):
+        if os.path.exists(self.index_path):
+            with open(self.index_path) as index_file:
+                return json.load(index_file)
+        return {'high_water_mark': None, 'rows': 0, 'stale_rows': 0, 'next_segment': 0, 'segments': []}
+
+    def write_index(self):
+        os.makedirs(self.directory, exist_ok=True)
+        with open(self.index_path + '.tmp', 'w') as index_file:
+            json.dump(self.__index, index_file, indent=1)
+        os.replace(self.index_path + '.tmp', self.index_path)
+
+    def ingest(self, diabetes_data):
+        """
+        A function to append a source file to the store.
+
+        :param diabetes_data: An Omnipod or Dexcom object for a file from the same source as the store
+        :return: The number of new rows stored.
+        """
+        if diabetes_data.data_source.upper() != self.data_source.upper():
+            raise ValueError('A %s store cannot ingest %s data.' % (self.data_source, diabetes_data.data_source))
+        return self.append(diabetes_data.read_data())
+
+    def append(self, df):
+        """
+        A function to append the rows of a raw dataframe that are new to the store.
+
+        :param df: A dataframe from DiabetesData.read_data for this source
+        :return: The number of new rows stored.
+        """
+        times = source_event_times(df, self.data_source)
+        hwm = self.high_water_mark
+        if hwm is None:
+            new = df[times.notna()]
+            times = times[times.notna()]
+        else:
+            self.count_stale(df[times < hwm], times[times < hwm])
+            new = df[times >= hwm]
+            times = times[times >= hwm]
+        if len(new) == 0:
+            return 0
+
+        order = np.argsort(times.to_numpy(), kind='stable')
+        new, times = new.iloc[order], times.iloc[order]
+        hashes = self.key_hashes(new)
+        fresh = ~pd.Series(hashes).duplicated().to_numpy()
+
+        # Only rows sharing the high-water mark timestamp can already be in the store.
+        at_hwm = (times == hwm).to_numpy() if hwm is not None else np.zeros(len(new), dtype=bool)
+        if at_hwm.any():
+            fresh &= ~(at_hwm & np.isin(hashes, self.stored_hashes(hwm, hwm)))
+
+        new, times = new[fresh], times[fresh]
+        if len(new) == 0:
+            return 0
+
+        self.__index['segments'].append(self.write_segment(new, times))
+        self.__index['high_water_mark'] = times.iloc[-1].isoformat()
+        self.__index['rows'] += len(new)
+        self.write_index()
+
+        if sum('month' not in seg for seg in self.__index['segments']) > store_segment_limit:
+            self.compact()
+        return len(new)
+
+    def key_hashes(self, df):
+        """
+        :param df: A raw dataframe for this source
+        :return: A uint64 array with a hash of each row's store_key_columns.  Keys are hashed as text, with
+        missing values made alike, so they match whether the rows were just parsed or read back from a segment.
+        """
+        keys = df[self.key_columns].astype(object)
+        keys = keys.where(keys.notna(), None).astype(str)
+        return pd.util.hash_pandas_object(keys, index=False).to_numpy()
+
+    def write_segment(self, df, times, month=None):
+        """
+        A function to write rows in time order as a new segment, with its side file of row times and key hashes.
+
+        :param df: The rows to store
+        :param times: Their event times, from source_event_times
+        :param month: For a compacted segment, the calendar month it holds (e.g. "2017-12")
+        :return: The segment's index entry.
+        """
+        path = self.next_segment_path()
+        npath = save_frame(df.reset_index(drop=True), path)
+        np.savez(path + '_Keys.npz', times=times.to_numpy().astype('datetime64[ns]').view('int64'),
+                 hashes=self.key_hashes(df))
+        seg = {'file': os.path.basename(npath), 'keys': os.path.basename(path) + '_Keys.npz',
+               'start': times.iloc[0].isoformat(), 'end': times.iloc[-1].isoformat(), 'rows': len(df)}
+        if month is not None:
+            seg['month'] = month
+        return seg
+
+    def segment_keys(self, seg):
+        """
+        :param seg: An index entry from segments
+        :return: A (times, hashes) pair of arrays for the segment's rows, with times as int64 nanoseconds.
+        Segments written before side files were kept have one written on first use.
+        """
+        if 'keys' not in seg or not os.path.exists(os.path.join(self.directory, seg['keys'])):
+            df = self.segment(seg['file'])
+            times = source_event_times(df, self.data_source)
+            seg['keys'] = os.path.splitext(seg['file'])[0] + '_Keys.npz'
+            np.savez(os.path.join(self.directory, seg['keys']),
+                     times=times.to_numpy().astype('datetime64[ns]').view('int64'), hashes=self.key_hashes(df))
+            self.write_index()
+        with np.load(os.path.join(self.directory, seg['keys'])) as keys:
+            return keys['times'], keys['hashes']
+
+    def stored_hashes(self, start, end):
+        """
+        :param start: The first time to include
+        :param end: The last time to include
+        :return: A uint64 array of the key hashes of the stored rows between the two times, read from the side
+        files of the segments that overlap them.
+        """
+        found = [np.array([], dtype=np.uint64)]
+        for seg in self.__index['segments']:
+            if pd.Timestamp(seg['start']) <= end and pd.Timestamp(seg['end']) >= start:
+                times, hashes = self.segment_keys(seg)
+                found.append(hashes[np.searchsorted(times, pd.Timestamp(start).value, side='left'):
+                                    np.searchsorted(times, pd.Timestamp(end).value, side='right')])
+        return np.concatenate(found)
+
+    def reported_stale(self):
+        """
+        :return: A sorted uint64 array of the key hashes of stale rows already counted in stale_rows.
+        """
+        if os.path.exists(self.stale_path):
+            return np.load(self.stale_path)
+        return np.array([], dtype=np.uint64)
+
+    def count_stale(self, df, times):
+        """
+        A function to count the rows of an append that are older than the high-water mark, not already
+        stored and not already reported.  They are added to the index's stale_rows, with a warning, as they
+        cannot be stored.
+
+        :param df: The rows of a raw dataframe before the high-water mark
+        :param times: Their event times, from source_event_times
+        :return: The number of newly reported stale rows.
+        """
+        if len(df) == 0:
+            return 0
+        hashes = np.unique(self.key_hashes(df))
+        stale = hashes[~np.isin(hashes, self.stored_hashes(times.min(), times.max()))]
+        reported = self.reported_stale()
+        stale = stale[~np.isin(stale, reported)]
+        if len(stale) > 0:
+            warnings.warn('%d %s rows before the high-water mark %s are not stored and were dropped.'
+                          % (len(stale), self.data_source, self.__index['high_water_mark']))
+            os.makedirs(self.directory, exist_ok=True)
+            np.save(self.stale_path, np.union1d(reported, stale))
+            self.__index['stale_rows'] = self.__index.get('stale_rows', 0) + len(stale)
+            self.write_index()
+        return len(stale)
+
+    def next_segment_path(self):
+        self.__index['next_segment'] += 1
+        return os.path.join(self.directory, '%s_Segment_%05d' % (self.data_source, self.__index['next_segment']))
+
+    def segment(self, file_name):
+        return load_frame(os.path.join(self.directory, os.path.splitext(file_name)[0]))
+
+    def data(self, min_date=None, max_date=None):
+        """
+        A function to return the stored rows in time order, in the same shape as DiabetesData.read_data.
+
+        :param min_date: Optionally, only segments ending on or after this time are read
+        :param max_date: Optionally, only segments starting on or before this time are read
+        :return: A dataframe of the stored rows.  Rows are filtered to the window when dates are given.
+        """
+        frames = [self.segment(seg['file']) for seg in self.__index['segments']
+                  if (min_date is None or pd.Timestamp(seg['end']) >= min_date) and
+                  (max_date is None or pd.Timestamp(seg['start']) <= max_date)]
+        if len(frames) == 0:
+            return pd.DataFrame(columns=self.key_columns)
+        df = pd.concat(frames, ignore_index=True)
+        if min_date is not None or max_date is not None:
+            times = source_event_times(df, self.data_source)
+            keep = pd.Series(True, index=df.index)
+            if min_date is not None:
+                keep &= times >= min_date
+            if max_date is not None:
+                keep &= times <= max_date
+            df = df[keep].reset_index(drop=True)
+        return df
+
+    def compact(self):
+        """
+        A function to merge the appended segments into one segment per calendar month, removing the old
+        segment files.  Months that are already compacted are only rewritten when an appended segment adds
+        rows to them, so compacting reads the recent months rather than the full history.
+        """
+        old = self.__index['segments']
+        months = set()
+        for seg in old:
+            if 'month' not in seg:
+                months.update(str(month) for month in pd.period_range(seg['start'], seg['end'], freq='M'))
+        merge = [seg for seg in old if 'month' not in seg or seg['month'] in months]
+        if len(merge) == 0:
+            return
+
+        df = pd.concat([self.segment(seg['file']) for seg in merge], ignore_index=True)
+        times = source_event_times(df, self.data_source)
+        order = np.argsort(times.to_numpy(), kind='stable')
+        df, times = df.iloc[order].reset_index(drop=True), times.iloc[order].reset_index(drop=True)
+        periods = times.dt.to_period('M')
+        bounds = np.flatnonzero(np.concatenate([[True], (periods.to_numpy()[1:] != periods.to_numpy()[:-1]),
+                                                [True]]))
+        compacted = [self.write_segment(df.iloc[a:b], times.iloc[a:b], str(periods.iloc[a]))
+                     for a, b in zip(bounds[:-1], bounds[1:])]
+
+        self.__index['segments'] = sorted([seg for seg in old if seg not in merge] + compacted,
+                                          key=lambda seg: pd.Timestamp(seg['start']))
+        self.write_index()
+        for seg in merge:
+            for name in [seg['file'], seg.get('keys')]:
+                if name is not None and os.path.exists(os.path.join(self.directory, name)):
+                    os.remove(os.path.join(self.directory, name))
+
+    def __str__(self):
+        txt = "Store: %s\n" % self.data_source
+        txt += "Rows: %d in %d segments\n" % (self.__index['rows'], len(self.__index['segments']))
+        txt += "High-water mark: %s\n" % self.__index['high_water_mark']
+        txt += "Stale rows dropped: %d\n" % self.__index.get('stale_rows', 0)
+        return txt
@@ -0,0 +1,107 @@
+"""
+People whose diabetes data is being analyzed.
+"""
+import datetime
+
+
+# Define person class
+class Person(object):
+    """
+    A class for characteristics of a person.
+    """
+
+    def __init__(self, first_name=None, sex='F', dob=None):
+        self.sex = sex
+        self.first_name = first_name
+        if dob is None:
+            self.__dob = None
+        elif isinstance(dob, str):
+            try:
+                # dateutil is only needed to parse a date of birth given as text
+                from dateutil import parser
+                self.__dob = parser.parse(dob)
+            except Exception as error:
+                print(error)
+                self.__dob = None
+        elif isinstance(dob.datetime.date):
+            self.__dob = dob
+        else:
+            raise TypeError("Invalid date of birth specification")
+
+    @property
+    def dob(self):
+        return self.__dob
+
+    @property
+    def age(self):
+        td = datetime.datetime.now() - self.__dob
+        return {"years": td.days // 365, "months": td.days % 365 // 30}
+
+    @property
+    def sex(self):
+        return self.__sex
+
+    @sex.setter
+    def sex(self, value):
+        if not isinstance(value, str):
+            raise TypeError("Sex must be a string")
+        if not value.upper()[0] in "MF":
+            raise ValueError("Sex must be Male or Female")
+        self.__sex = value.upper()[0]
+
+    @property
+    def first_name(self):
+        return self.__first_name
+
+    @first_name.setter
+    def first_name(self, value):
+        if value is None:
+            if self.sex == 'F':
+                value = "Jane"
+            else:
+                value = "John"
+        if not isinstance(value, str):
+            raise TypeError("first name must be a string")
+        self.__first_name = value
+
+    def get_characteristics(self):
+        """Get the individual characteristics in a string"""
+        txt = """First Name=%s\n""" % self.first_name
+        txt += """Sex=%s\n""" % self.sex
+        txt += "Age=%d years, %d months\n" % (self.age["years"],
+                                              self.age["months"])
+        return txt
+
+
+# Define Diabetic Person class
+class Diabetic(Person):
+    """
+    A class for Diabetic people - inherits from the Person class
+    """
+
+    def __init__(self, first_name, sex, dob,
+                 a1c_target=7.0, diagnosis_year='', diagnosis_type=1):
+        Person.__init__(self, first_name, sex, dob)
+        self.__a1c_target = a1c_target
+        self.diagnosis_year = diagnosis_year
+        self.diagnosis_type = diagnosis_type
+
+    @property
+    def a1c_target(self):
+        return self.__a1c_target
+
+    @a1c_target.setter
+    def a1c_target(self, value):
+        if not type(value) == float:
+            raise TypeError("Target a1c value must be a number.")
+        if type(value) == float:
+            self.a1c_target = value
+
+    @property
+    def eag_target(self):
+        """
+        Returns the average blood glucose level for the target a1c.
+        Source: http://care.diabetesjournals.org/content/diacare/early/2008/06/07/dc08-0545.full.pdf
+        """
+        eag = 28.7 * self.a1c_target - 46.7
+        return eag
@@ -0,0 +1,90 @@
+"""
+HoloViews charts of combined Omnipod and Dexcom data.  Importing this module loads holoviews and
+the bokeh extension, so it is only imported when a chart is first needed.
+"""
+import pandas as pd
+import numpy as np
+import holoviews as hv
+hv.extension('bokeh')
+
+
+# Most glucose points sent to the browser for one view of a time-series chart
+chart_max_points = 2000
+
+
+def decimate_minmax(times, values, max_points=chart_max_points):
+    """
+    A function to downsample a time-series for display, keeping the lowest and highest reading of
+    each bucket of consecutive readings so that peaks and lows stay visible at any zoom level.
+
+    :param times: A sorted array of times
+    :param values: An array of values
+    :param max_points: The most points to return
+    :return: An integer array of the positions to keep, in time order.
+    """
+    n = len(times)
+    if n <= max_points:
+        return np.arange(n)
+
+    size = int(np.ceil(n / (max_points // 2)))
+    buckets = n // size
+    filled = np.asarray(values, dtype=float)[:buckets * size].reshape(buckets, size)
+    missing = np.isnan(filled)
+    lows = np.where(missing, np.inf, filled).argmin(axis=1)
+    highs = np.where(missing, -np.inf, filled).argmax(axis=1)
+    starts = np.arange(buckets) * size
+    keep = [starts + lows, starts + highs]
+    if buckets * size < n:
+        tail = np.asarray(values, dtype=float)[buckets * size:]
+        if not np.isnan(tail).all():
+            keep.append(buckets * size + np.array([np.nanargmin(tail), np.nanargmax(tail)]))
+        else:
+            keep.append(np.array([n - 1]))
+    return np.unique(np.concatenate(keep))
+
+
+def glucose_bolus_view(chart, x_range=None, target=None, max_points=chart_max_points):
+    """
+    A function to draw one view of glucose_bolus_df output: a downsampled glucose curve, every bolus
+    marker in the view at full resolution, and an optional target line.
+
+    :param chart: A dataframe generated from glucose_bolus_df
+    :param x_range: Optionally, a (start, end) pair of times to draw.  Default is the whole chart.
+    :param target: Optionally, a glucose target to draw, e.g. Diabetic.eag_target
+    :param max_points: The most glucose points to draw
+    :return: A holoviews Overlay.
+    """
+    times = chart['event_time'].to_numpy(dtype='datetime64[ns]')
+    first, stop = 0, len(times)
+    if x_range is not None and x_range[0] is not None:
+        first = np.searchsorted(times, np.datetime64(pd.Timestamp(x_range[0]), 'ns'), side='left')
+        stop = np.searchsorted(times, np.datetime64(pd.Timestamp(x_range[1]), 'ns'), side='right')
+    window = chart.iloc[first:stop]
+    keep = decimate_minmax(times[first:stop], window['Glucose Value (mg/dL)'].to_numpy(), max_points)
+    curve = window.iloc[keep]
+    bolus = window[window['BolusFlg'].notna() & (window['BolusFlg'] > 0)]
+
+    view = hv.Curve((curve['event_time'], curve['Glucose Value (mg/dL)']), 'Date', 'Blood Sugar', label='CGM') * \
+        hv.Scatter((bolus['event_time'], bolus['BolusFlg']), 'Date', 'Bolus', label='Bolus')
+    if target is not None:
+        view = view * hv.HLine(target, label='Target')
+    return view
+
+
+def glucose_bolus_chart(chart, target=None, max_points=chart_max_points):
+    """
+    A function to chart glucose_bolus_df output for long histories.  The glucose curve is downsampled
+    on the server to at most max_points for the visible range and redrawn whenever the chart is zoomed
+    or panned, so months of CGM data render quickly while zooming in still shows every reading.
+
+    :param chart: A dataframe generated from glucose_bolus_df
+    :param target: Optionally, a glucose target to draw, e.g. Diabetic.eag_target
+    :param max_points: The most glucose points to draw per view
+    :return: A holoviews DynamicMap.
+    """
+    chart = chart.sort_values('event_time', kind='stable')
+
+    def view(x_range):
+        return glucose_bolus_view(chart, x_range, target=target, max_points=max_points)
+
+    return hv.DynamicMap(view, streams=[hv.streams.RangeX()])
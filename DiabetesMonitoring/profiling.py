@@ -0,0 +1,149 @@
+"""
+Opt-in timing and memory instrumentation for the stages of the pipeline.
+"""
+import time
+import functools
+import tracemalloc
+
+
+# Profilers currently recording.  Stages check this list and do nothing more while it is empty.
+_active = []
+_stack = []
+
+
+def row_count(value):
+    """
+    :param value: An argument or result of a stage
+    :return: The number of rows of a dataframe, series, array or GlucoseSeries, or None for anything else.
+    """
+    if isinstance(value, (str, bytes, list, tuple, dict)) or not hasattr(value, '__len__'):
+        return None
+    try:
+        return len(value)
+    except TypeError:
+        return None
+
+
+def profile_stage(func):
+    """
+    A decorator that records a call of a pipeline stage with every active Profiler: its wall time, the
+    rows of its dataframe arguments and result, and (when a Profiler traces memory) the change in
+    allocated memory and its peak.  When no Profiler is active the stage is called directly.
+    """
+    @functools.wraps(func)
+    def stage(*args, **kwargs):
+        if not _active:
+            return func(*args, **kwargs)
+
+        counts = [row_count(arg) for arg in list(args) + list(kwargs.values())]
+        counts = [count for count in counts if count is not None]
+        tracing = tracemalloc.is_tracing()
+        frame = {'child_peak': 0}
+        if tracing:
+            current, peak = tracemalloc.get_traced_memory()
+            # The enclosing stage keeps the peak so far, as it is reset for this one
+            if _stack:
+                _stack[-1]['child_peak'] = max(_stack[-1]['child_peak'], peak)
+            tracemalloc.reset_peak()
+            frame['memory'] = current
+        _stack.append(frame)
+        start = time.perf_counter()
+        try:
+            result = func(*args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - start
+            _stack.pop()
+
+        record = {'Stage': func.__name__,
+                  'Depth': len(_stack),
+                  'Seconds': elapsed,
+                  'Rows In': sum(counts) if counts else None,
+                  'Rows Out': row_count(result),
+                  'Memory Delta (MB)': None,
+                  'Peak Memory (MB)': None}
+        if tracing:
+            current, peak = tracemalloc.get_traced_memory()
+            peak = max(peak, frame['child_peak'])
+            if _stack:
+                _stack[-1]['child_peak'] = max(_stack[-1]['child_peak'], peak)
+            record['Memory Delta (MB)'] = (current - frame['memory']) / 2 ** 20
+            record['Peak Memory (MB)'] = (peak - frame['memory']) / 2 ** 20
+        for profiler in _active:
+            profiler.records.append(record)
+        return result
+
+    return stage
+
+
+class Profiler(object):
+    """
+    A recorder for the stages of the pipeline (read_data, parse_data, omnipod_extract_dedup,
+    omnipod_to_tabular, dexcom_clean, bolus_efficacy, glucose_bolus_df, ...) run while it is active.
+
+    Use it as a context manager:
+
+        with dm.Profiler() as profiler:
+            df_o = dm.omnipod_to_tabular(omnipod.read_data())
+        profiler.report()
+
+    or call start and stop around the cells of a notebook.  Stages called by other stages are recorded
+    too, with a greater Depth.  Memory is traced with tracemalloc, which slows the stages down; pass
+    memory=False for more accurate wall times.
+    """
+
+    def __init__(self, memory=True):
+        self.memory = memory
+        self.records = []
+        self.__started_tracing = False
+
+    def start(self):
+        if self in _active:
+            return self
+        if self.memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self.__started_tracing = True
+        _active.append(self)
+        return self
+
+    def stop(self):
+        if self in _active:
+            _active.remove(self)
+        if self.__started_tracing:
+            tracemalloc.stop()
+            self.__started_tracing = False
+        return self
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def report(self):
+        """
+        :return: A dataframe with a row per stage call, in the order the calls finished.
+        """
+        import pandas as pd
+        return pd.DataFrame(self.records, columns=['Stage', 'Depth', 'Seconds', 'Rows In', 'Rows Out',
+                                                   'Memory Delta (MB)', 'Peak Memory (MB)'])
+
+    def summary(self):
+        """
+        :return: A dataframe with a row per stage: its number of calls, total time and rows, and rows per second.
+        """
+        report = self.report()
+        summary = report.groupby('Stage', sort=False).agg(**{'Calls': ('Seconds', 'size'),
+                                                              'Seconds': ('Seconds', 'sum'),
+                                                              'Rows In': ('Rows In', 'sum'),
+                                                              'Rows Out': ('Rows Out', 'sum'),
+                                                              'Peak Memory (MB)': ('Peak Memory (MB)', 'max')})
+        # Readers have no rows in, so their rate is of the rows they return
+        rows = summary['Rows In'].where(summary['Rows In'] > 0, summary['Rows Out'])
+        summary['Rows/s'] = rows / summary['Seconds']
+        return summary.sort_values('Seconds', ascending=False)
+
+    def __str__(self):
+        txt = "Profiler: %d stage calls recorded\n" % len(self.records)
+        for record in self.records:
+            txt += "%s%s: %.3fs\n" % ('  ' * record['Depth'], record['Stage'], record['Seconds'])
+        return txt
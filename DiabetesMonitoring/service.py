@@ -0,0 +1,356 @@
+"""
+A local service that watches the Omnipod and Dexcom data folders, keeps an incremental store of everything
+saved there, and serves precomputed summaries as JSON over HTTP.
+
+Usage:
+    python -m DiabetesMonitoring.service [OMNIPOD_FOLDER DEXCOM_FOLDER [PORT]]
+"""
+import os
+import sys
+import json
+import hashlib
+import asyncio
+from collections import OrderedDict
+from urllib.parse import urlsplit, parse_qs
+from concurrent.futures import ProcessPoolExecutor
+import pandas as pd
+import numpy as np
+
+from .data import DiabetesStore, source_files, read_file, source_event_times, omnipod_to_tabular, dexcom_clean
+from .analysis import bolus_efficacy, glucose_series, GlucoseMetrics, basal_timeline
+
+
+service_host = '127.0.0.1'
+service_port = 8050
+service_poll_seconds = 30
+# The most recently used responses kept in the cache, which is cleared whenever the data changes
+service_cache_entries = 256
+# Glucose window queries without a start cover this long before their end
+service_default_window = pd.Timedelta('1 day')
+# Bolus columns summed per day in the daily totals
+service_daily_columns = ['Meal', 'Meal Bolus', 'Correction Bolus', 'Bolus Insulin', 'Extended Meal Bolus',
+                         'Reverse Corrected']
+
+
+def service_store_directory(folder):
+    """The store for a watched folder is kept with the parsed-file cache, in its Generated subfolder."""
+    return os.path.join(os.path.abspath(folder), 'Generated')
+
+
+def parse_new_file(path, data_source):
+    """
+    A function to read one new source file.  This is the unit of work for the service's worker pool.
+
+    :return: A (dataframe, earliest timestamp) pair, so files can be stored oldest first.
+    """
+    df = read_file(path, data_source)
+    return df, source_event_times(df, data_source).min()
+
+
+def service_summaries(omnipod_store, dexcom_store, shift_minutes=120):
+    """
+    A function to compute every summary the service serves from the stored data.  This runs in the worker
+    pool, so the service keeps answering from the previous summaries meanwhile.
+
+    :param omnipod_store: The Omnipod store directory
+    :param dexcom_store: The Dexcom store directory
+    :param shift_minutes: Passed to bolus_efficacy
+    :return: A dictionary of the bolus_efficacy dataframe, the daily totals dataframe and the GlucoseMetrics
+    (which holds the glucose series for window queries).  Entries are None when a store is empty.
+    """
+    omnipod = DiabetesStore(omnipod_store, 'Omnipod')
+    dexcom = DiabetesStore(dexcom_store, 'Dexcom')
+    df_o, raw_o, metrics = None, None, None
+    daily = []
+
+    if len(omnipod.segments) > 0:
+        raw_o = omnipod.data()
+        df_o = omnipod_to_tabular(raw_o, save=False)
+        doses = df_o.drop_duplicates('Date Time')
+        bolus = doses.groupby(pd.to_datetime(doses['Date Time']).dt.normalize())[service_daily_columns].sum()
+        bolus['Total Bolus'] = bolus['Meal Bolus'] + bolus['Bolus Insulin'] + bolus['Correction Bolus']
+        daily.append(bolus.rename_axis('Date'))
+        daily.append(basal_timeline(raw_o).daily().set_index('Date'))
+
+    if len(dexcom.segments) > 0:
+        glucose = glucose_series(dexcom_clean(dexcom.data()), 'EGV')
+        metrics = GlucoseMetrics(glucose)
+        rolling = metrics.rolling('daily', '1D')
+        rolling.index = pd.to_datetime(rolling['Window Start']).rename('Date')
+        daily.append(rolling[['Readings', 'Mean Glucose', 'Time in Range', 'Time Below Range',
+                              'Time Above Range']])
+
+    efficacy = None
+    if df_o is not None and metrics is not None:
+        efficacy = bolus_efficacy(df_o, glucose, shift_minutes)
+    daily = pd.concat(daily, axis=1).sort_index().reset_index() if daily else None
+    return {'bolus_efficacy': efficacy, 'daily': daily, 'metrics': metrics}
+
+
+def frame_json(df):
+    """:return: A JSON-ready list of records, with times in ISO format."""
+    return json.loads(df.to_json(orient='records', date_format='iso'))
+
+
+def query_time(query, name, default=None):
+    """
+    :return: The named query parameter as a timestamp.  Times with a UTC offset (e.g. 2017-12-01T00:00:00Z) are
+    converted to UTC and made naive, to compare with the stored times.
+    """
+    if name not in query:
+        return default
+    try:
+        time = pd.Timestamp(query[name][0])
+    except ValueError:
+        raise ValueError('%s must be a date or time, not %r' % (name, query[name][0]))
+    if time.tzinfo is not None:
+        time = time.tz_convert(None)
+    return time
+
+
+def json_value(value):
+    """:return: A metric as a JSON-ready value: times in ISO format, counts as integers and missing values as None."""
+    if isinstance(value, pd.Timestamp):
+        return value.isoformat()
+    if pd.isna(value):
+        return None
+    if isinstance(value, (int, np.integer)):
+        return int(value)
+    return float(value)
+
+
+class IngestionService(object):
+    """
+    An asyncio service that polls the Omnipod and Dexcom folders for new or changed exports.
+
+    New files are parsed in a process pool off the event loop and appended, oldest first, to a DiabetesStore
+    per source (only rows newer than the store's high-water mark are added).  After each change the
+    summaries are recomputed in the pool, and the HTTP endpoint keeps answering from the previous summaries
+    until they are ready.  Responses are cached until the data changes (the service_cache_entries most recently
+    used) and carry an ETag of their content, so dashboards polling with If-None-Match get an empty 304 reply
+    until their response changes.  /status and error responses are not cached and have no ETag; a request that
+    fails unexpectedly gets a 500 response with the error.
+
+    Endpoints (GET, JSON):
+        /status                           files ingested, rows stored and the data version
+        /bolus_efficacy?start=&end=       the latest bolus_efficacy, optionally for a window
+        /daily?start=&end=                daily carbs, bolus and basal totals and glucose metrics
+        /glucose?start=&end=              the glucose readings and metrics for a window (default: the last day)
+    """
+
+    def __init__(self, omnipod_folder, dexcom_folder, host=service_host, port=service_port,
+                 poll_seconds=service_poll_seconds, workers=None, shift_minutes=120):
+        self.folders = {'Omnipod': os.path.abspath(omnipod_folder), 'Dexcom': os.path.abspath(dexcom_folder)}
+        self.stores = {source: service_store_directory(folder) for source, folder in self.folders.items()}
+        self.host = host
+        self.port = port
+        self.poll_seconds = poll_seconds
+        self.workers = workers
+        self.shift_minutes = shift_minutes
+        self.version = 0
+        self.summaries = {'bolus_efficacy': None, 'daily': None, 'metrics': None}
+        self.server = None
+        self.__pool = None
+        self.__responses = OrderedDict()
+        self.__files = {source: self.read_files_index(source) for source in self.folders}
+
+    def files_index_path(self, source):
+        return os.path.join(self.stores[source], source + '_Service.json')
+
+    def read_files_index(self, source):
+        if os.path.exists(self.files_index_path(source)):
+            with open(self.files_index_path(source)) as index_file:
+                return json.load(index_file)
+        return {}
+
+    def write_files_index(self, source):
+        os.makedirs(self.stores[source], exist_ok=True)
+        with open(self.files_index_path(source) + '.tmp', 'w') as index_file:
+            json.dump(self.__files[source], index_file, indent=1)
+        os.replace(self.files_index_path(source) + '.tmp', self.files_index_path(source))
+
+    def new_files(self, source):
+        """:return: The files in a source folder that are new or changed since they were last ingested."""
+        changed = []
+        for path in source_files(self.folders[source]):
+            stat = os.stat(path)
+            if self.__files[source].get(path) != [stat.st_mtime, stat.st_size]:
+                changed.append((path, [stat.st_mtime, stat.st_size]))
+        return changed
+
+    async def scan(self):
+        """
+        A function to ingest every new or changed file.
+
+        :return: The number of new rows stored.
+        """
+        loop = asyncio.get_running_loop()
+        added = 0
+        for source in self.folders:
+            changed = await loop.run_in_executor(None, self.new_files, source)
+            if not changed:
+                continue
+            parsed = await asyncio.gather(*[loop.run_in_executor(self.__pool, parse_new_file, path, source)
+                                            for path, _ in changed], return_exceptions=True)
+
+            # Oldest first, as a store only adds rows at or after its high-water mark
+            store = DiabetesStore(self.stores[source], source)
+            def earliest(item):
+                return pd.Timestamp.min if isinstance(item[1], Exception) or pd.isna(item[1][1]) else item[1][1]
+
+            for (path, stat), result in sorted(zip(changed, parsed), key=earliest):
+                if isinstance(result, Exception):
+                    print('%s: %s' % (path, result))
+                else:
+                    added += await loop.run_in_executor(None, store.append, result[0])
+                self.__files[source][path] = stat
+            self.write_files_index(source)
+        return added
+
+    async def refresh(self):
+        """A function to recompute the summaries from the stores and start a new data version."""
+        loop = asyncio.get_running_loop()
+        self.summaries = await loop.run_in_executor(self.__pool, service_summaries, self.stores['Omnipod'],
+                                                    self.stores['Dexcom'], self.shift_minutes)
+        self.version += 1
+        self.__responses = OrderedDict()
+
+    async def watch(self):
+        first = True
+        while True:
+            try:
+                if await self.scan() > 0 or first:
+                    await self.refresh()
+                first = False
+            except Exception as error:
+                print(error)
+            await asyncio.sleep(self.poll_seconds)
+
+    def status(self, query):
+        return {'version': self.version,
+                'files': {source: len(files) for source, files in self.__files.items()},
+                'stores': {source: DiabetesStore(store, source).read_index() for source, store in self.stores.items()}}
+
+    def bolus_efficacy(self, query):
+        df = self.summaries['bolus_efficacy']
+        if df is None:
+            return []
+        start = query_time(query, 'start', pd.Timestamp.min)
+        end = query_time(query, 'end', pd.Timestamp.max)
+        return frame_json(df[(df['Date Time'] >= start) & (df['Date Time'] <= end)])
+
+    def daily(self, query):
+        df = self.summaries['daily']
+        if df is None:
+            return []
+        start = query_time(query, 'start', pd.Timestamp.min)
+        end = query_time(query, 'end', pd.Timestamp.max)
+        return frame_json(df[(df['Date'] >= start) & (df['Date'] <= end)])
+
+    def glucose(self, query):
+        metrics = self.summaries['metrics']
+        if metrics is None or len(metrics) == 0:
+            return {'metrics': None, 'readings': []}
+        end = query_time(query, 'end', pd.Timestamp(metrics.times[-1]) + pd.Timedelta(1))
+        start = query_time(query, 'start', end - service_default_window)
+        first, stop = np.searchsorted(metrics.times, [start.value, end.value], side='left')
+        readings = pd.DataFrame({'event_time': metrics.times[first:stop].view('datetime64[ns]'),
+                                 'Glucose Value (mg/dL)': metrics.values[first:stop]})
+        window = {key: json_value(value) for key, value in metrics.window(start, end).items()}
+        return {'metrics': window, 'readings': frame_json(readings)}
+
+    routes = {'/status': status, '/bolus_efficacy': bolus_efficacy, '/daily': daily, '/glucose': glucose}
+
+    def respond(self, target):
+        """
+        :param target: The request path and query
+        :return: A (status, JSON body, ETag) triple.  Bodies are cached per target until the data changes,
+        with an ETag from a hash of the body, keeping the service_cache_entries most recently used.  The ETag is
+        None for responses that are not cached.
+        """
+        if target in self.__responses:
+            self.__responses.move_to_end(target)
+            return self.__responses[target]
+        url = urlsplit(target)
+        if url.path not in self.routes:
+            return 404, json.dumps({'error': 'Not found: %s' % url.path}).encode(), None
+        try:
+            body = json.dumps(self.routes[url.path](self, parse_qs(url.query))).encode()
+        except ValueError as error:
+            return 400, json.dumps({'error': str(error)}).encode(), None
+        except Exception as error:
+            return 500, json.dumps({'error': '%s: %s' % (type(error).__name__, error)}).encode(), None
+        # Status changes as files arrive without new rows, so it is not cached
+        if url.path == '/status':
+            return 200, body, None
+        response = (200, body, '"%s"' % hashlib.sha1(body).hexdigest()[:16])
+        self.__responses[target] = response
+        if len(self.__responses) > service_cache_entries:
+            self.__responses.popitem(last=False)
+        return response
+
+    async def handle(self, reader, writer):
+        try:
+            request = await reader.readuntil(b'\r\n\r\n')
+            lines = request.decode('latin-1').split('\r\n')
+            method, target = lines[0].split(' ')[:2]
+            headers = {k.lower(): v for k, v in (line.split(': ', 1) for line in lines[1:] if ': ' in line)}
+            if method != 'GET':
+                status, body, etag = 405, json.dumps({'error': 'Only GET is supported'}).encode(), None
+            else:
+                status, body, etag = self.respond(target)
+                if etag is not None and headers.get('if-none-match') == etag:
+                    status, body = 304, b''
+            reason = {200: 'OK', 304: 'Not Modified', 400: 'Bad Request', 404: 'Not Found',
+                      405: 'Method Not Allowed', 500: 'Internal Server Error'}[status]
+            caching = 'ETag: %s\r\nCache-Control: max-age=%d' % (etag, self.poll_seconds) if etag is not None \
+                else 'Cache-Control: no-cache'
+            writer.write(('HTTP/1.1 %d %s\r\nContent-Type: application/json\r\nContent-Length: %d\r\n'
+                          '%s\r\nConnection: close\r\n\r\n'
+                          % (status, reason, len(body), caching)).encode() + body)
+            await writer.drain()
+        except (asyncio.IncompleteReadError, ValueError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def start(self):
+        """A function to start the worker pool and the HTTP server, without blocking."""
+        self.__pool = ProcessPoolExecutor(max_workers=self.workers)
+        self.server = await asyncio.start_server(self.handle, self.host, self.port)
+        return self.server
+
+    async def stop(self):
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+        if self.__pool is not None:
+            self.__pool.shutdown()
+
+    async def run(self):
+        """A function to serve and watch the folders until cancelled."""
+        await self.start()
+        print('Serving %s:%d, watching %s' % (self.host, self.port, ', '.join(self.folders.values())))
+        try:
+            await self.watch()
+        finally:
+            await self.stop()
+
+    def __str__(self):
+        txt = "Ingestion service: http://%s:%d\n" % (self.host, self.port)
+        for source, folder in self.folders.items():
+            txt += "%s: %s (%d files)\n" % (source, folder, len(self.__files[source]))
+        txt += "Data version: %d\n" % self.version
+        return txt
+
+
+if __name__ == "__main__":
+    repo = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+    args = sys.argv[1:]
+    service = IngestionService(args[0] if len(args) > 0 else os.path.join(repo, 'Data', 'Omnipod'),
+                               args[1] if len(args) > 1 else os.path.join(repo, 'Data', 'Dexcom'),
+                               port=int(args[2]) if len(args) > 2 else service_port)
+    try:
+        asyncio.run(service.run())
+    except KeyboardInterrupt:
+        pass
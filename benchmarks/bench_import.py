@@ -0,0 +1,71 @@
+"""
+Benchmark the import time of each part of DiabetesMonitoring, and guard against regressions.
+
+Each import runs in a fresh interpreter.  The check fails (exit status 1) if a part loads a heavy
+dependency it should not need, or if it takes much longer to import than its own dependencies.
+Budgets are relative to the time to import those dependencies on this machine, so the check does
+not depend on how fast the machine is.
+
+Usage:
+    python benchmarks/bench_import.py [repeats]
+"""
+import os
+import subprocess
+import sys
+
+repo = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+# Module, the modules it must not load, and the baseline imports its time is compared against
+cases = [('DiabetesMonitoring', ['pandas', 'numpy', 'holoviews', 'bokeh'], 'pass'),
+         ('DiabetesMonitoring.profiling', ['pandas', 'numpy', 'holoviews', 'bokeh'], 'pass'),
+         ('DiabetesMonitoring.data', ['holoviews', 'bokeh'], 'import pandas, numpy'),
+         ('DiabetesMonitoring.analysis', ['holoviews', 'bokeh'], 'import pandas, numpy'),
+         ('DiabetesMonitoring.cohort', ['holoviews', 'bokeh'], 'import pandas, numpy'),
+         ('DiabetesMonitoring.service', ['holoviews', 'bokeh'], 'import pandas, numpy'),
+         ('DiabetesMonitoring.plotting', [], 'import pandas, numpy, holoviews; holoviews.extension("bokeh")')]
+# Allowed time over the baseline: a factor plus a fixed allowance in seconds
+budget_factor = 1.5
+budget_seconds = 0.1
+
+probe = """
+import sys, time
+start = time.perf_counter()
+%s
+elapsed = time.perf_counter() - start
+print(elapsed)
+print(' '.join(sorted(name for name in sys.modules if '.' not in name)))
+"""
+
+
+def run(statement):
+    out = subprocess.run([sys.executable, '-c', probe % statement], cwd=repo, check=True,
+                         capture_output=True, text=True).stdout.splitlines()
+    return float(out[0]), set(out[1].split())
+
+
+def best(statement, repeats):
+    times, modules = zip(*[run(statement) for _ in range(repeats)])
+    return min(times), modules[0]
+
+
+def main(repeats):
+    failures = []
+    print("%-30s %10s %10s %10s" % ("module", "import (s)", "base (s)", "budget (s)"))
+    for module, forbidden, baseline in cases:
+        elapsed, modules = best('import ' + module, repeats)
+        base, _ = best(baseline, repeats)
+        budget = base * budget_factor + budget_seconds
+        print("%-30s %10.3f %10.3f %10.3f" % (module, elapsed, base, budget))
+        loaded = sorted(modules.intersection(forbidden))
+        if loaded:
+            failures.append("%s loads %s" % (module, ", ".join(loaded)))
+        if elapsed > budget:
+            failures.append("%s took %.3fs to import (budget %.3fs)" % (module, elapsed, budget))
+
+    for failure in failures:
+        print("FAIL: " + failure)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(int(sys.argv[1]) if len(sys.argv) > 1 else 3))
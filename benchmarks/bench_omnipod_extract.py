@@ -0,0 +1,56 @@
+"""
+Benchmark omnipod_extract_dedup against omnipod_extract_dedup_vectorized.
+
+The sample Omnipod logs in Data/Omnipod are tiled end-to-end (shifting the dates of each copy) to
+build multi-year pump logs, then both functions are timed and their outputs compared.
+
+Usage:
+    python benchmarks/bench_omnipod_extract.py [years ...]
+"""
+import os
+import sys
+import time
+
+import pandas as pd
+
+repo = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, repo)
+import DiabetesMonitoring as dm  # noqa: E402
+
+omnipod_folder = os.path.relpath(os.path.join(repo, "Data", "Omnipod"), os.path.abspath(".."))
+
+
+def sample_log():
+    logs = [dm.Omnipod(omnipod_folder, name, "Omnipod").read_data(use_cache=False)
+            for name in sorted(os.listdir(os.path.join(repo, "Data", "Omnipod"))) if name.endswith(".xlsx")]
+    return pd.concat(logs, ignore_index=True).drop_duplicates()
+
+
+def tile_log(df, years):
+    """Repeat a pump log back-to-back, shifting each copy by the span of the log, to cover `years`."""
+    span = df['Date'].max() - df['Date'].min() + pd.Timedelta(days=1)
+    copies = max(1, int(round(pd.Timedelta(days=365 * years) / span)))
+    return pd.concat([df.assign(Date=df['Date'] + span * i) for i in range(copies)], ignore_index=True)
+
+
+def timed(func, df):
+    start = time.perf_counter()
+    out = func(df)
+    return out, time.perf_counter() - start
+
+
+def main(years):
+    base = sample_log()
+    print("%6s %10s %12s %12s %8s %6s" % ("years", "rows", "current (s)", "vector (s)", "speedup", "same"))
+    for n in years:
+        df = tile_log(base, n)
+        current, t_current = timed(dm.omnipod_extract_dedup, df)
+        vector, t_vector = timed(dm.omnipod_extract_dedup_vectorized, df)
+        same = list(current.columns) == list(vector.columns) and \
+            all(current[col].astype(str).equals(vector[col].astype(str)) for col in current.columns)
+        print("%6s %10d %12.3f %12.3f %7.1fx %6s" % (n, len(df), t_current, t_vector,
+                                                     t_current / t_vector, same))
+
+
+if __name__ == "__main__":
+    main([float(arg) for arg in sys.argv[1:]] or [0.25, 1, 5])
@@ -0,0 +1,85 @@
+"""
+Benchmark each stage of the Omnipod/Dexcom pipeline on synthetic data of increasing length.
+
+Matching Omnipod logs and Clarity exports are generated with benchmarks/synthetic.py, then each
+stage is run on the output of the stage before it.  For every stage the wall time, the peak memory
+allocated while it runs (from tracemalloc, in a second run so that tracing does not slow the timed
+run) and the input rows per second are reported.
+
+Usage:
+    python benchmarks/bench_pipeline.py [--xlsx] [days ...]
+"""
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+repo = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, repo)
+import DiabetesMonitoring as dm  # noqa: E402
+import synthetic  # noqa: E402
+
+# 90 days, 1 year and 5 years
+default_days = [90, 365, 1825]
+
+
+def measure(func, *args):
+    """Time one call, then repeat it under tracemalloc for the peak memory."""
+    start = time.perf_counter()
+    out = func(*args)
+    elapsed = time.perf_counter() - start
+
+    tracemalloc.start()
+    func(*args)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return out, elapsed, peak
+
+
+def stages(omnipod, dexcom):
+    """(name, function, arguments) for each stage.  Arguments may be the names of earlier outputs."""
+    return [('read_data (Omnipod)', lambda: omnipod.read_data(use_cache=False), []),
+            ('read_data (Dexcom)', lambda: dexcom.read_data(use_cache=False), []),
+            ('omnipod_extract_dedup', dm.omnipod_extract_dedup, ['read_data (Omnipod)']),
+            ('omnipod_extract_dedup_vectorized', dm.omnipod_extract_dedup_vectorized, ['read_data (Omnipod)']),
+            ('omnipod_to_tabular', dm.omnipod_to_tabular, ['read_data (Omnipod)']),
+            ('dexcom_clean', dm.dexcom_clean, ['read_data (Dexcom)']),
+            ('bolus_efficacy', dm.bolus_efficacy, ['omnipod_to_tabular', 'dexcom_clean']),
+            ('glucose_bolus_df', lambda df_o, df_d: dm.glucose_bolus_df(df_o.copy(), df_d),
+             ['omnipod_to_tabular', 'dexcom_clean'])]
+
+
+def run(days, folder, xlsx=False):
+    omnipod_path, dexcom_path = synthetic.write_files(days, folder, xlsx=xlsx)
+    omnipod = dm.Omnipod(os.path.dirname(omnipod_path), os.path.basename(omnipod_path), "Omnipod")
+    dexcom = dm.Dexcom(os.path.dirname(dexcom_path), os.path.basename(dexcom_path), "Dexcom")
+
+    outputs = {}
+    for name, func, inputs in stages(omnipod, dexcom):
+        args = [outputs[i] for i in inputs]
+        outputs[name], elapsed, peak = measure(func, *args)
+        rows = sum(len(arg) for arg in args) or len(outputs[name])
+        print("%6d %-34s %10d %10.3f %10.1f %12.0f" % (days, name, rows, elapsed, peak / 2 ** 20, rows / elapsed))
+
+
+def main(days, xlsx=False):
+    folder = tempfile.mkdtemp()
+    # omnipod_to_tabular writes its output next to the working directory, as the notebook does
+    work = os.path.join(folder, "work")
+    os.makedirs(os.path.join(folder, dm.omnipod_data_save), exist_ok=True)
+    os.makedirs(work)
+    os.chdir(work)
+
+    print("%6s %-34s %10s %10s %10s %12s" % ("days", "stage", "rows", "time (s)", "peak (MB)", "rows/s"))
+    try:
+        for n in days:
+            run(n, os.path.join(folder, "data"), xlsx)
+    finally:
+        os.chdir(repo)
+        shutil.rmtree(folder)
+
+
+if __name__ == "__main__":
+    main([int(arg) for arg in sys.argv[1:] if arg != '--xlsx'] or default_days, xlsx='--xlsx' in sys.argv)
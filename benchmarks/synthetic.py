@@ -0,0 +1,321 @@
+"""
+Generate synthetic Omnipod logs and Dexcom Clarity exports of any length, for benchmarking.
+
+The files use the same column layouts as the real exports in Data/: Clarity header and alert rows,
+5-minute EGV readings, twice-daily calibrations and weekly sensor sessions with a 2-hour warm-up;
+Omnipod basal schedules, temp basals, suspends, pod changes, meals, meal/correction/extended boluses
+with "Meal IOB:"/"Correction IOB:" comments, manual glucose readings, alarms and daily insulin summaries.
+Meals and boluses are shared between the two files so that the glucose trace responds to them.
+
+Usage:
+    python benchmarks/synthetic.py DAYS OUTPUT_FOLDER [--xlsx]
+"""
+import datetime
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+clarity_columns = ['Index', 'Timestamp (YYYY-MM-DDThh:mm:ss)', 'Event Type', 'Event Subtype', 'Patient Info',
+                   'Device Info', 'Source Device ID', 'Glucose Value (mg/dL)', 'Insulin Value (u)',
+                   'Carb Value (grams)', 'Duration (hh:mm:ss)', 'Glucose Rate of Change (mg/dL/min)',
+                   'Transmitter Time (Long Integer)']
+omnipod_columns = ['Hidden', 'Type', 'Date', 'Time', 'Time Period', 'Value', 'Description', 'Other Info',
+                   'Comment']
+
+# Basal schedule (hour, units/hour), meal times (hour, name, typical grams) and pump settings
+basal_schedule = [(0, 1.25), (4, 1.35), (8, 1.30), (12, 1.10), (15, 1.05), (19, 1.35)]
+meals = [(7.5, 'Breakfast', 40), (12.5, 'Lunch', 45), (18.5, 'Dinner', 55), (21.5, 'Snack', 20)]
+carb_ratio = 10.0
+correction_factor = 40.0
+glucose_target = 120.0
+insulin_action_hours = 3.0
+sensor_days = 7
+transmitter_days = 90
+
+
+def round_units(value):
+    return np.round(np.asarray(value) / 0.05) * 0.05
+
+
+def time_period(hour):
+    for limit, name in [(6, 'Sleep'), (8, 'Pre - Bkfst'), (11, 'Post - Bkfst'), (12, 'Pre - Lunch'),
+                        (16, 'Post - Lunch'), (18, 'Pre - Dinner'), (21, 'Post - Dinner'), (23, 'Bed')]:
+        if hour < limit:
+            return name
+    return 'Sleep'
+
+
+def bolus_events(start, days, rng):
+    """
+    Meals, meal boluses and correction boluses shared by both files.  The first day has one of each rarer
+    kind of bolus, so that even short logs have every column of omnipod_to_tabular.
+
+    :return: A dataframe with a row per bolus: time, carbs, meal units, correction units, extended units,
+    and flags for reverse corrected and override boluses.
+    """
+    rows = []
+    for day in range(days):
+        date = start + datetime.timedelta(days=day)
+        for hour, name, grams in meals:
+            if name == 'Snack' and rng.random() > 0.4:
+                continue
+            carbs = max(5, int(rng.normal(grams, grams * 0.3)))
+            minute = int(hour * 60 + rng.normal(0, 25))
+            extended = day == 0 or rng.random() < 0.03
+            rows.append({'time': date + datetime.timedelta(minutes=minute), 'carbs': carbs, 'meal_name': name,
+                         'meal': float(round_units(carbs / carb_ratio)), 'correction': 0.0,
+                         'extended': float(round_units(carbs / carb_ratio * 0.4)) if extended else 0.0,
+                         'reverse': day == 0 or rng.random() < 0.1, 'general': False, 'override': False})
+        for _ in range(rng.poisson(1.5) + (day == 0)):
+            minute = int(rng.uniform(0, 24 * 60 - 1))
+            rows.append({'time': date + datetime.timedelta(minutes=minute), 'carbs': 0, 'meal_name': None,
+                         'meal': 0.0, 'correction': float(round_units(rng.uniform(0.3, 2.5))), 'extended': 0.0,
+                         'reverse': False, 'general': day == 0 or rng.random() < 0.02,
+                         'override': rng.random() < 0.3})
+
+    events = pd.DataFrame(rows).sort_values('time', kind='stable')
+    # One bolus per minute, as the pump allows
+    events['time'] = events['time'].dt.floor('min')
+    return events.drop_duplicates('time').reset_index(drop=True)
+
+
+def glucose_trace(times, events, rng):
+    """
+    A smooth glucose trace that rises after meals, falls after boluses and wanders between them.
+    """
+    hours = (times - times[0]) / np.timedelta64(1, 'h')
+    noise = np.convolve(rng.normal(0, 3.0, len(times)), np.exp(-np.arange(120) / 30.0), mode='same')
+    glucose = 150 + 20 * np.sin(2 * np.pi * (hours % 24) / 24) + noise
+
+    event_hours = (events['time'].to_numpy(dtype='datetime64[ns]') - times[0]) / np.timedelta64(1, 'h')
+    insulin = events['meal'].to_numpy() + events['correction'].to_numpy()
+    effect = events['carbs'].to_numpy() * 4.0 - insulin * correction_factor
+    for when, size in zip(event_hours, effect):
+        first, stop = np.searchsorted(hours, [when, when + 5])
+        elapsed = hours[first:stop] - when
+        glucose[first:stop] += size * (1 - np.exp(-elapsed / 0.8)) * np.exp(-elapsed / 2.5)
+    return np.clip(np.round(glucose), 40, 400)
+
+
+def dexcom_export(start, days, events, rng):
+    """
+    A Dexcom Clarity export in the Clarity csv layout, including the header and alert rows.
+    """
+    seconds = np.arange(days * 288) * 300 - np.arange(days * 288) // 5
+    times = np.datetime64(start, 's') + seconds.astype('timedelta64[s]') + np.timedelta64(237, 's')
+    glucose = glucose_trace(times.astype('datetime64[ns]'), events, rng)
+
+    since_start = (times - np.datetime64(start, 's')) / np.timedelta64(1, 's')
+    session = (since_start // (sensor_days * 86400)).astype('int64')
+    transmitter = (since_start // (transmitter_days * 86400)).astype('int64')
+    warm_up = since_start - session * sensor_days * 86400 < 2 * 3600
+    dropped = rng.random(len(times)) < 0.01
+    keep = ~(warm_up & (session > 0)) & ~dropped
+
+    transmitter_ids = np.array(['%02d%s' % (40 + i % 60, 'QJ16') for i in range(transmitter.max() + 1)])
+    egv = pd.DataFrame({'Timestamp (YYYY-MM-DDThh:mm:ss)': times[keep],
+                        'Event Type': 'EGV',
+                        'Source Device ID': transmitter_ids[transmitter[keep]],
+                        'Glucose Value (mg/dL)': glucose[keep],
+                        'Transmitter Time (Long Integer)':
+                            1780752 + (since_start[keep] - transmitter[keep] * transmitter_days * 86400)})
+
+    # Two back-to-back calibrations after each warm-up, and twice a day
+    calibration_times = [np.datetime64(start, 's') + np.timedelta64(int(s * sensor_days * 86400 + 2 * 3600), 's')
+                         for s in range(1, session.max() + 1)]
+    for day in range(days):
+        for hour in (7, 19):
+            calibration_times.append(np.datetime64(start, 's') +
+                                     np.timedelta64(int((day * 24 + hour) * 3600 + rng.uniform(0, 3600)), 's'))
+    calibration_times = np.sort(np.array(calibration_times, dtype='datetime64[s]'))
+    calibration_times = np.concatenate([calibration_times, calibration_times + np.timedelta64(70, 's')])
+    position = np.clip(np.searchsorted(times, calibration_times), 0, len(times) - 1)
+    calibration = pd.DataFrame({'Timestamp (YYYY-MM-DDThh:mm:ss)': calibration_times,
+                                'Event Type': 'Calibration',
+                                'Source Device ID': transmitter_ids[transmitter[position]],
+                                'Glucose Value (mg/dL)': np.clip(glucose[position] + rng.normal(0, 8, len(position))
+                                                                 .round(), 40, 400)})
+
+    readings = pd.concat([egv, calibration], ignore_index=True).sort_values('Timestamp (YYYY-MM-DDThh:mm:ss)',
+                                                                           kind='stable')
+    readings['Timestamp (YYYY-MM-DDThh:mm:ss)'] = pd.to_datetime(readings['Timestamp (YYYY-MM-DDThh:mm:ss)']) \
+        .dt.strftime('%Y-%m-%dT%H:%M:%S')
+
+    header = pd.DataFrame([
+        {'Event Type': 'FirstName', 'Patient Info': 'Synthetic'},
+        {'Event Type': 'LastName'},
+        {'Event Type': 'Device', 'Device Info': 'Dexcom G5 Mobile', 'Source Device ID': transmitter_ids[0]},
+        {'Event Type': 'Alert', 'Event Subtype': 'Rise', 'Source Device ID': transmitter_ids[0],
+         'Glucose Rate of Change (mg/dL/min)': 3},
+        {'Event Type': 'Alert', 'Event Subtype': 'OutOfRange', 'Source Device ID': transmitter_ids[0],
+         'Duration (hh:mm:ss)': '0:20:00'},
+        {'Event Type': 'Alert', 'Event Subtype': 'High', 'Source Device ID': transmitter_ids[0],
+         'Glucose Value (mg/dL)': 230},
+        {'Event Type': 'Alert', 'Event Subtype': 'Fall', 'Source Device ID': transmitter_ids[0],
+         'Glucose Rate of Change (mg/dL/min)': 3},
+        {'Event Type': 'Alert', 'Event Subtype': 'Low', 'Source Device ID': transmitter_ids[0],
+         'Glucose Value (mg/dL)': 85}])
+
+    export = pd.concat([header, readings], ignore_index=True).reindex(columns=clarity_columns)
+    export['Index'] = np.arange(1, len(export) + 1)
+    for column in ['Glucose Value (mg/dL)', 'Transmitter Time (Long Integer)', 'Glucose Rate of Change (mg/dL/min)']:
+        export[column] = export[column].astype('Int64')
+    return export
+
+
+def bolus_iob(events, hours):
+    """Meal and correction insulin on board before each bolus, with earlier boluses decaying linearly."""
+    times = events['time'].to_numpy(dtype='datetime64[s]').astype('int64') / 3600.0
+    first = np.searchsorted(times, times - hours, side='right')
+    meal, correction = events['meal'].to_numpy(), events['correction'].to_numpy()
+    iob = np.zeros((len(events), 2))
+    for position, start in enumerate(first):
+        remaining = 1 - (times[position] - times[start:position]) / hours
+        iob[position] = remaining @ meal[start:position], remaining @ correction[start:position]
+    return iob
+
+
+def iob_comment(row, meal_iob, correction_iob):
+    """The bolus calculator comment for a bolus."""
+    def units(value):
+        return '%.2f' % value if value > 0 else ''
+
+    comment = 'Suggested Bolus: %.2f; Programmed Meal: %s; Programmed Correction: %s; Meal IOB: %.2f; ' \
+              'Correction IOB: %.2f' % (row['meal'] + row['correction'], units(row['meal']), units(row['correction']),
+                                      meal_iob, correction_iob)
+    if row['override']:
+        comment += '; Override'
+    return comment
+
+
+def omnipod_log(start, days, events, rng):
+    """
+    An Omnipod log in the layout of a log copied out of the FreeStyle CoPilot software, newest first.
+    As with the boluses, the first day has a temp basal and a suspend.
+    """
+    rows = []
+
+    def add(when, event_type, value, description=np.nan, other=np.nan, comment=np.nan, period=None):
+        rows.append({'Type': event_type, 'Date': pd.Timestamp(when.date()), 'Time': when.time(),
+                     'Time Period': period or time_period(when.hour), 'Value': value, 'Description': description,
+                     'Other Info': other, 'Comment': comment})
+
+    def basal(when, rate, prefix=''):
+        text = '%sBasal rate set to %.2f units/hour.' % (prefix, rate)
+        add(when, 'Basal Insulin', '%.2f (units)' % rate, text, 'Basal', text)
+
+    for day in range(days):
+        date = start + datetime.timedelta(days=day)
+        for hour, rate in basal_schedule:
+            basal(date + datetime.timedelta(hours=hour), rate)
+        if day % 3 == 2:
+            when = date + datetime.timedelta(hours=int(rng.integers(9, 20)), minutes=int(rng.integers(1, 50)))
+            basal(when, 0.0, 'Pod deactivated.')
+            basal(when + datetime.timedelta(minutes=6), 1.25, 'Pod activated.')
+        if day == 0 or rng.random() < 0.1:
+            when = date + datetime.timedelta(hours=int(rng.integers(9, 22)), minutes=int(rng.integers(1, 59)))
+            change = int(rng.choice([-75, -50, -30]))
+            rate = 1.25 * (100 + change) / 100
+            text = 'Temporary basal rate set to %.2f units/hour.Temp percent change: %d%%.' % (rate, change)
+            add(when, 'Basal Insulin', '%.2f (units)' % rate, text, 'Basal', text)
+        if day == 0 or rng.random() < 0.05:
+            when = date + datetime.timedelta(hours=int(rng.integers(1, 22)), minutes=int(rng.integers(1, 50)))
+            basal(when, 0.0, 'Basal suspended.')
+            basal(when + datetime.timedelta(minutes=2), 1.25, 'Basal resumed.')
+        if rng.random() < 0.05:
+            when = date + datetime.timedelta(hours=int(rng.integers(0, 23)), minutes=int(rng.integers(0, 59)))
+            add(when, 'Pump Alarm', np.nan, 'OmniPod Alarm: Pod expiration advisory alarm', np.nan,
+                'Ref: 19-000-0000-00104')
+
+    iob = bolus_iob(events, insulin_action_hours)
+    for row, (meal_iob, correction_iob) in zip(events.to_dict('records'), iob):
+        when = row['time'].to_pydatetime()
+        comment = iob_comment(row, meal_iob, correction_iob)
+        if row['carbs'] > 0:
+            add(when, 'Meal', '%d grams' % row['carbs'], period=row['meal_name'])
+        if row['correction'] > 0:
+            add(when, 'Glucose', '%d (mg/dL)' % (glucose_target + row['correction'] * correction_factor),
+                comment='Manual')
+            add(when, 'Bolus Insulin', '%.2f (units)' % row['correction'],
+                'Bolus-General Bolus.' if row['general'] else 'Bolus-Correction Bolus.', 'Bolus', comment)
+        if row['meal'] > 0:
+            add(when, 'Bolus Insulin', '%.2f (units)' % row['meal'],
+                'Bolus-Meal Bolus. Reverse Corrected.' if row['reverse'] else 'Bolus-Meal Bolus.', 'Bolus', comment)
+        if row['extended'] > 0:
+            add(when, 'Bolus Insulin', '%.2f (units)' % row['extended'], 'Bolus-Extended Meal Bolus – 30 minutes.',
+                'Bolus', comment)
+
+    log = pd.DataFrame(rows)
+    log['Time Stamp'] = log['Date'] + pd.to_timedelta(log['Time'].astype(str))
+    log = log.sort_values('Time Stamp', ascending=False, kind='stable').drop_duplicates(['Time Stamp', 'Type',
+                                                                                         'Description'])
+
+    # Daily insulin summaries follow the last (earliest) event of each day
+    daily = events.assign(Date=events['time'].dt.normalize()).groupby('Date')[['meal', 'correction']].sum()
+    summaries = []
+    for date, totals in daily.iterrows():
+        basal_total = sum(rate * (next_hour - hour) for (hour, rate), (next_hour, _) in
+                          zip(basal_schedule, basal_schedule[1:] + [(24, 0)]))
+        for description, other, value in [('Bolus-End of Day Correction Bolus Total', 'Bolus', totals['correction']),
+                                          ('Bolus-End of Day Meal Bolus Total', 'Bolus', totals['meal']),
+                                          ('End of Day Basal Total', 'Basal', basal_total)]:
+            summaries.append({'Type': 'Insulin Summary', 'Date': date, 'Time': np.nan, 'Time Period': np.nan,
+                              'Value': '%.2f (units)' % value, 'Description': description, 'Other Info': other,
+                              'Comment': np.nan, 'Time Stamp': date - pd.Timedelta(microseconds=1)})
+    log = pd.concat([log, pd.DataFrame(summaries)], ignore_index=True) \
+        .sort_values('Time Stamp', ascending=False, kind='stable')
+    return log.drop(columns='Time Stamp').reindex(columns=omnipod_columns).reset_index(drop=True)
+
+
+def generate(days, start=datetime.datetime(2015, 1, 1), seed=0):
+    """
+    A function to generate matching Omnipod and Dexcom data.
+
+    :param days: The number of days of data
+    :param start: The first day
+    :param seed: The random seed
+    :return: An (omnipod log, dexcom export) pair of dataframes in the layout of the raw files.
+    """
+    rng = np.random.default_rng(seed)
+    events = bolus_events(start, days, rng)
+    return omnipod_log(start, days, events, rng), dexcom_export(start, days, events, rng)
+
+
+def write_xlsx(df, path):
+    """Write a dataframe with openpyxl directly, which keeps datetime.time cells as Excel times."""
+    import openpyxl
+    workbook = openpyxl.Workbook(write_only=True)
+    sheet = workbook.create_sheet()
+    sheet.append(list(df.columns))
+    for row in df.astype(object).itertuples(index=False):
+        sheet.append([None if pd.isna(value) else value for value in row])
+    workbook.save(path)
+
+
+def write_files(days, folder, xlsx=False, start=datetime.datetime(2015, 1, 1), seed=0):
+    """
+    A function to write a synthetic Omnipod log (.xlsx) and Clarity export (.csv, or .xlsx) to a folder.
+
+    :return: An (omnipod path, dexcom path) pair.
+    """
+    omnipod, dexcom = generate(days, start, seed)
+    os.makedirs(folder, exist_ok=True)
+    omnipod_path = os.path.join(folder, 'Omnipod_Synthetic_%dd.xlsx' % days)
+    write_xlsx(omnipod, omnipod_path)
+    if xlsx:
+        dexcom_path = os.path.join(folder, 'CLARITY_Export_Synthetic_%dd.xlsx' % days)
+        dexcom.to_excel(dexcom_path, index=False)
+    else:
+        dexcom_path = os.path.join(folder, 'CLARITY_Export_Synthetic_%dd.csv' % days)
+        dexcom.to_csv(dexcom_path, index=False, encoding='utf-8-sig')
+    return omnipod_path, dexcom_path
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3:
+        print(__doc__)
+        sys.exit(1)
+    for path in write_files(int(sys.argv[1]), sys.argv[2], xlsx='--xlsx' in sys.argv):
+        print(path)
@@ -0,0 +1,181 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+import DiabetesMonitoring as dm
+
+
+def test_mage_ignores_noise_reversals():
+    # Three excursions of 150 mg/dL, each broken up by 5 mg/dL reversals
+    trace = np.array([100, 150, 145, 200, 195, 250, 200, 205, 150, 155, 100, 150, 145, 200, 195, 250], dtype=float)
+    assert dm.mage(trace, np.std(trace, ddof=1)) == 150.0
+
+
+def test_mage_without_excursions():
+    assert np.isnan(dm.mage(np.array([100, 110, 105, 112], dtype=float), 50.0))
+
+
+def test_glucose_metrics_mage_and_calibrations():
+    times = pd.date_range('2017-11-01', periods=16, freq='5min')
+    trace = [100, 150, 145, 200, 195, 250, 200, 205, 150, 155, 100, 150, 145, 200, 195, 250]
+    df_d = pd.DataFrame({'event_time': times, 'Event Type': 'EGV', 'Glucose Value (mg/dL)': trace})
+    # A calibration fingerstick is not a CGM reading
+    calibration = pd.DataFrame({'event_time': [times[3] + pd.Timedelta('1min')], 'Event Type': ['Calibration'],
+                                'Glucose Value (mg/dL)': [400]})
+    metrics = dm.GlucoseMetrics(pd.concat([df_d, calibration], ignore_index=True))
+    window = metrics.window(times[0], times[-1] + pd.Timedelta(1))
+    assert window['Readings'] == 16
+    assert window['MAGE'] == 150.0
+    assert window['Mean Glucose'] == np.mean(trace)
+
+
+def bolus_events():
+    times = pd.to_datetime(['2017-11-13 07:30', '2017-11-13 18:00', '2017-11-14 08:00', '2017-11-14 13:00',
+                            '2017-11-14 21:00', '2017-11-15 09:00', '2017-11-15 09:30'])
+    return pd.DataFrame({'Date Time': times,
+                         'Meal': [40, 60, 30, 0, 50, 45, 0],
+                         'Meal Bolus': [4.0, 6.0, 3.0, 0.0, 5.0, 4.5, 0.0],
+                         'Bolus Insulin': [0.0, 0.0, 0.0, 1.5, 0.0, 0.0, 0.0],
+                         'Correction Bolus': [0.5, 0.0, 1.0, 0.0, 0.0, 0.5, 0.0],
+                         'Extended Meal Bolus': [0.0, 1.0, 0.0, 0.0, 0.0, 0.0, 0.0]})
+
+
+def test_bolus_cube_split_add_matches_single_add():
+    df_o = bolus_events()
+    times = pd.date_range('2017-11-13', '2017-11-16', freq='5min')
+    glucose = dm.GlucoseSeries(times, np.full(len(times), 120.0))
+    whole = dm.BolusCube()
+    whole.add(df_o, glucose)
+
+    # Split part way through a day, with empty, no-bolus and repeated adds in between
+    split = dm.BolusCube()
+    split.add(df_o[df_o['Date Time'] < '2017-11-14 12:00'], glucose)
+    split.add(df_o.iloc[:0], glucose)
+    split.add(df_o.iloc[[-1]], glucose)
+    split.add(df_o[df_o['Date Time'] >= '2017-11-14 12:00'], glucose)
+    split.add(df_o, glucose)
+
+    assert (split.days == whole.days).all()
+    assert np.allclose(split.totals, whole.totals)
+    assert whole.rollup(None).query("Type == 'Total'")['Insulin'].sum() == 26.0
+
+
+def test_rolling_computes_mage_only_when_asked():
+    times = pd.date_range('2017-11-01', '2017-11-04', freq='5min', inclusive='left')
+    trace = 140 + 60 * np.sin(np.arange(len(times)) / 20.0)
+    metrics = dm.GlucoseMetrics(pd.DataFrame({'event_time': times, 'Event Type': 'EGV',
+                                              'Glucose Value (mg/dL)': trace}))
+    assert 'MAGE' not in metrics.rolling('daily')
+    rolling = metrics.rolling('daily', with_mage=True)
+    assert len(rolling) == 3
+    assert rolling['Readings'].tolist() == [288] * 3
+    assert rolling['MAGE'].iloc[1] == metrics.window('2017-11-02', '2017-11-03')['MAGE']
+    assert 100 < rolling['MAGE'].iloc[1] <= 120
+
+
+def omnipod_log(rows):
+    # A raw pump log, newest event first, with Time holding times of day except on summary rows
+    df = pd.DataFrame(rows, columns=['Type', 'Date', 'Time', 'Value', 'Description'])
+    df['Date'] = pd.to_datetime(df['Date'])
+    df['Time'] = [pd.Timestamp(time).time() if ':' in time else time for time in df['Time']]
+    df['Comment'] = ''
+    return df.iloc[::-1].reset_index(drop=True)
+
+
+def test_basal_check_matches_reported_daily_total():
+    raw = omnipod_log([
+        ['Basal Insulin', '2017-11-01', '00:00', '1.00 (units)', 'Basal rate set to 1.00 units/hour.'],
+        ['Basal Insulin', '2017-11-01', '06:00', '1.50 (units)', 'Basal rate set to 1.50 units/hour.'],
+        ['Bolus Insulin', '2017-11-01', '07:00', '4.00 (units)', 'Bolus-Meal Bolus'],
+        ['Basal Insulin', '2017-11-01', '09:00', '0.75 (units)',
+         'Temporary basal rate set to 0.75 units/hour.Temp percent change: -50%.'],
+        ['Basal Insulin', '2017-11-01', '10:00', '1.50 (units)', 'Basal rate set to 1.50 units/hour.'],
+        ['Basal Insulin', '2017-11-01', '14:00', '0.00 (units)', 'Basal suspended.Basal rate set to 0.00 units/hour.'],
+        ['Basal Insulin', '2017-11-01', '14:30', '1.50 (units)', 'Basal resumed.Basal rate set to 1.50 units/hour.'],
+        ['Basal Insulin', '2017-11-01', '19:00', '0.00 (units)', 'Pod deactivated.'],
+        ['Basal Insulin', '2017-11-01', '19:20', '1.50 (units)', 'Basal rate set to 1.50 units/hour.'],
+        ['Basal Insulin', '2017-11-01', '22:00', '1.00 (units)', 'Basal rate set to 1.00 units/hour.'],
+        ['Insulin Summary', '2017-11-01', '0 NoDescription', '30.00 (units)', 'End of Day Basal Total'],
+        ['Basal Insulin', '2017-11-02', '00:00', '1.00 (units)', 'Basal rate set to 1.00 units/hour.']])
+    timeline = dm.basal_timeline(raw)
+    assert list(timeline.rates) == [1.0, 1.5, 0.75, 1.5, 0.0, 1.5, 0.0, 1.5, 1.0, 1.0]
+
+    check = dm.basal_check(raw, timeline)
+    assert check['Date'].tolist() == [pd.Timestamp('2017-11-01')]
+    # 6 + 3 * 1.5 + 0.75 + 4 * 1.5 + 4.5 * 1.5 + 8 / 3 * 1.5 + 2 units, reported to the pump's 0.05 units
+    assert abs(check['Basal Delivered'].iloc[0] - 30.0) < 1e-9
+    assert abs(check['Basal Difference'].iloc[0]) <= 0.05
+
+
+def test_basal_check_matches_pump_totals():
+    folder = os.path.join(os.path.dirname(__file__), '..', 'Data', 'Omnipod')
+    raw = dm.Omnipod(os.path.abspath(folder), 'Omnipod_20171214.xlsx', 'Omnipod').read_data(use_cache=False)
+    check = dm.basal_check(raw)
+
+    # The first and last days of the log are only partly covered.  On 2017-11-05, when the clocks went back,
+    # the pump reports about 4 units more than the logged rates deliver, so that day is left out.
+    full = check.iloc[1:-1]
+    full = full[full['Date'] != pd.Timestamp('2017-11-05')]
+    assert len(full) == 62
+    # The pump delivers basal in 0.05 unit pulses and reports its totals rounded to 0.05 units
+    assert (full['Basal Difference'].abs() <= 0.06).all()
+    assert (full['Basal Difference'].abs() <= 0.05).mean() > 0.95
+
+
+def sensor_stream():
+    # A session already running when the export starts, with a 20 minute signal loss; a sensor change with a
+    # warm-up ending in a calibration pair; a 100 minute signal loss; then a new transmitter
+    egv = pd.date_range('2017-11-01 00:00', '2017-11-01 02:00', freq='5min').append(
+        [pd.date_range('2017-11-01 04:35', '2017-11-01 06:00', freq='5min'),
+         pd.date_range('2017-11-01 07:40', '2017-11-01 08:00', freq='5min')])
+    egv = egv[~egv.isin(pd.to_datetime(['2017-11-01 01:05', '2017-11-01 01:10', '2017-11-01 01:15']))]
+    new = pd.date_range('2017-11-01 08:05', '2017-11-01 08:30', freq='5min')
+    calibrations = pd.to_datetime(['2017-11-01 04:30', '2017-11-01 04:31'])
+    df_d = pd.DataFrame({'event_time': egv.append([new, calibrations]),
+                         'Event Type': ['EGV'] * (len(egv) + len(new)) + ['Calibration'] * 2,
+                         'Source Device ID': ['40QJ16'] * len(egv) + ['416CL9'] * len(new) + ['40QJ16'] * 2,
+                         'Glucose Value (mg/dL)': np.linspace(100, 200, len(egv) + len(new) + 2)})
+    started = np.where(df_d['Source Device ID'] == '40QJ16', pd.Timestamp('2017-10-30').value, new[0].value)
+    df_d['Transmitter Time (Long Integer)'] = (df_d['event_time'].to_numpy().view('int64') - started) // 10 ** 9
+    return df_d.sort_values('event_time', kind='stable').reset_index(drop=True)
+
+
+def test_sensor_sessions_boundaries_and_gaps():
+    df_d = sensor_stream()
+    sessions = dm.sensor_sessions(df_d)
+    ns = pd.Timedelta(1)
+
+    frame = sessions.sessions()
+    assert frame['Source Device ID'].tolist() == ['40QJ16', '40QJ16', '416CL9']
+    # The export starts part way through the first session.  A sensor change starts the new session
+    # sensor_warm_up before its calibrations; a new transmitter starts one straight after the last reading.
+    changed = pd.Timestamp('2017-11-01 08:00') + ns
+    assert frame['Start'].tolist() == [pd.Timestamp('2017-11-01 00:00'), pd.Timestamp('2017-11-01 02:30'), changed]
+    assert frame['End'].tolist() == [pd.Timestamp('2017-11-01 02:05'), changed, pd.Timestamp('2017-11-01 08:35')]
+    assert frame['Calibrations'].tolist() == [0, 1, 0]
+
+    # The 100 minute loss has no calibrations, so it is a gap within the second session
+    gaps = sessions.interval_index('gap')
+    assert list(gaps.left) == [pd.Timestamp('2017-11-01 01:00') + ns, pd.Timestamp('2017-11-01 02:00') + ns,
+                               pd.Timestamp('2017-11-01 06:00') + ns]
+    assert list(gaps.right) == pd.to_datetime(['2017-11-01 01:20', '2017-11-01 04:35', '2017-11-01 07:40']).tolist()
+    assert np.allclose(frame['Gap Minutes'], [175, 100, 0])
+
+    warm_up = sessions.interval_index('warm_up')
+    assert list(warm_up.left) == [pd.Timestamp('2017-11-01 02:30'), changed]
+    assert list(warm_up.right) == pd.to_datetime(['2017-11-01 05:35', '2017-11-01 08:35']).tolist()
+    calibration = sessions.interval_index('calibration')
+    assert list(calibration.left) == [pd.Timestamp('2017-11-01 04:30')]
+    assert list(calibration.right) == [pd.Timestamp('2017-11-01 04:35') + ns]
+
+    probes = pd.to_datetime(['2017-11-01 01:10', '2017-11-01 02:05', '2017-11-01 02:10', '2017-11-01 07:00',
+                             '2017-11-01 08:00', '2017-11-01 08:35']).to_numpy()
+    assert sessions.session_of(probes).tolist() == [0, -1, -1, 1, 1, -1]
+
+    # Warm-up readings (04:35 to 05:30, and the new transmitter's) and the calibrations are excluded
+    assert len(sessions.exclude(df_d)) == len(df_d) - 12 - 6 - 2
+    filled = sessions.fill_gaps(df_d)
+    added = np.setdiff1d(filled.times, dm.glucose_series(df_d, 'EGV').times).view('datetime64[ns]')
+    assert list(added) == list(pd.to_datetime(['2017-11-01 01:05', '2017-11-01 01:10',
+                                               '2017-11-01 01:15']).to_numpy())
@@ -0,0 +1,35 @@
+import numpy as np
+import pandas as pd
+
+import DiabetesMonitoring as dm
+
+
+def add_done_patient(cohort, folder, patient_id, df):
+    for source in ['omnipod', 'dexcom']:
+        (folder / patient_id / source).mkdir(parents=True, exist_ok=True)
+        (folder / patient_id / source / 'export.csv').write_text('')
+    cohort.add(patient_id, None, str(folder / patient_id / 'omnipod'), str(folder / patient_id / 'dexcom'))
+    dm.save_frame(df.assign(Patient=patient_id), str(folder / 'cohort' / 'glucose_summary' / patient_id))
+    cohort.record(patient_id, cohort.sources(patient_id), 'done', rows={'glucose_summary': len(df)})
+
+
+def test_write_results_streams_only_patients_done(tmp_path):
+    cohort = dm.Cohort(str(tmp_path / 'cohort'))
+    add_done_patient(cohort, tmp_path, 'p1', pd.DataFrame({'Mean Glucose': [150.0], 'First Name': [None]}))
+    add_done_patient(cohort, tmp_path, 'p2', pd.DataFrame({'Mean Glucose': [130.0], 'First Name': ['Ann']}))
+    add_done_patient(cohort, tmp_path, 'gone', pd.DataFrame({'Mean Glucose': [0.0], 'First Name': ['Old']}))
+
+    # A patient removed from the cohort, and one done with other settings, are left out
+    cohort = dm.Cohort(str(tmp_path / 'cohort'))
+    for patient_id in ['p1', 'p2']:
+        cohort.add(patient_id, None, str(tmp_path / patient_id / 'omnipod'), str(tmp_path / patient_id / 'dexcom'))
+    assert cohort.done() == ['p1', 'p2']
+    assert cohort.results('glucose_summary')['Patient'].tolist() == ['p1', 'p2']
+    assert dm.Cohort(str(tmp_path / 'cohort'), shift_minutes=60).results('glucose_summary').empty
+
+    path = cohort.write_results()['glucose_summary']
+    assert path.endswith('.parquet')
+    combined = pd.read_parquet(path)
+    assert combined['Patient'].tolist() == ['p1', 'p2']
+    assert combined['First Name'].tolist()[1] == 'Ann' and pd.isna(combined['First Name'].iloc[0])
+    assert np.allclose(combined['Mean Glucose'], [150.0, 130.0])
@@ -0,0 +1,152 @@
+import datetime
+import os
+import warnings
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import DiabetesMonitoring as dm
+
+
+clarity_header = ('Index,Timestamp (YYYY-MM-DDThh:mm:ss),Event Type,Event Subtype,Patient Info,Device Info,'
+                  'Source Device ID,Glucose Value (mg/dL),Insulin Value (u),Carb Value (grams),'
+                  'Duration (hh:mm:ss),Glucose Rate of Change (mg/dL/min),Transmitter Time (Long Integer)\n')
+clarity_rows = ['1,,FirstName,,Name,,,,,,,,\n',
+                '2,,Alert,High,,,40QJ16,230,,,,,\n',
+                '3,2017-09-16T00:01:57,EGV,,,,40QJ16,103,,,,,6187036\n',
+                '4,2017-09-16T00:06:58,EGV,,,,40QJ16,Low,,,,,6187336\n',
+                '5,2017-09-16T00:11:58,EGV,,,,40QJ16,High,,,,,6187636\n',
+                '6,2017-09-16T00:12:30,Calibration,,,,40QJ16,410,,,,,\n',
+                '7,2017-09-16T00:16:57,Mystery,Odd,,,416CL9,,,,,,6187936\n',
+                '8,2017-09-16T00:21:58,EGV,,,,416CL9,104,,,,,6188236\n']
+
+
+def clarity_export(folder, rows=clarity_rows):
+    path = folder / 'CLARITY_Export.csv'
+    path.write_text(clarity_header + ''.join(rows), encoding='utf-8-sig')
+    return dm.Dexcom(str(folder), path.name, 'Dexcom')
+
+
+def test_read_chunks_low_high_and_unknown_types(tmp_path):
+    dexcom = clarity_export(tmp_path)
+    with pytest.warns(UserWarning) as record:
+        df = dexcom.read_data_chunked(chunksize=2)
+    messages = [str(w.message) for w in record]
+    assert any('Event Type Mystery' in message for message in messages)
+    assert any('Event Subtype Odd' in message for message in messages)
+
+    # Header rows without a timestamp are dropped; Low and High are kept at the limits of the sensor's range
+    assert df['Index'].tolist() == [3, 4, 5, 6, 7, 8]
+    assert df['Glucose Value (mg/dL)'].dtype == 'float32'
+    assert df['Glucose Value (mg/dL)'].tolist()[:4] == [103, 40, 400, 410]
+    assert df['Event Type'].tolist() == ['EGV', 'EGV', 'EGV', 'Calibration', 'Mystery', 'EGV']
+    assert df['Event Subtype'].iloc[4] == 'Odd'
+    assert list(df['Event Type'].cat.categories) == list(dm.dexcom_event_types.categories) + ['Mystery']
+    assert df['Source Device ID'].tolist() == ['40QJ16'] * 4 + ['416CL9'] * 2
+
+
+def test_read_chunks_known_types_keep_fixed_categories(tmp_path):
+    dexcom = clarity_export(tmp_path, [row for row in clarity_rows if 'Mystery' not in row])
+    with warnings.catch_warnings():
+        warnings.simplefilter('error')
+        df = dexcom.read_data_chunked(chunksize=3)
+    assert df['Event Type'].dtype == dm.dexcom_event_types
+    assert df['Event Subtype'].dtype == dm.dexcom_event_subtypes
+    assert np.isfinite(df['Glucose Value (mg/dL)']).all()
+
+
+def test_dexcom_clean_converts_text_glucose():
+    df = pd.DataFrame({dm.dexcom_timestamp: pd.to_datetime(['2017-09-16 00:01', '2017-09-16 00:06',
+                                                            '2017-09-16 00:11']),
+                       'Glucose Value (mg/dL)': ['Low', '120', 'High']})
+    assert dm.dexcom_clean(df)['Glucose Value (mg/dL)'].tolist() == [40, 120, 400]
+
+
+def test_save_frame_stores_mixed_time_column_as_parquet(tmp_path):
+    df = pd.DataFrame({'Type': ['Bolus', 'Summary', 'Basal'],
+                       'Time': [datetime.time(7, 30), 'Insulin Summary', datetime.time(23, 59, 5)],
+                       'Value': ['4.5', '', None]})
+    path = dm.save_frame(df, str(tmp_path / 'frame'))
+    assert path.endswith('.parquet')
+
+    loaded = dm.load_frame(str(tmp_path / 'frame'))
+    assert list(loaded.columns) == list(df.columns)
+    assert loaded['Time'].tolist() == df['Time'].tolist()
+    assert loaded['Value'].iloc[2] is None or pd.isna(loaded['Value'].iloc[2])
+
+
+def dexcom_rows(start, periods, freq='5min', device='40QJ16'):
+    times = pd.date_range(start, periods=periods, freq=freq)
+    return pd.DataFrame({'Index': np.arange(periods), dm.dexcom_timestamp: times, 'Event Type': 'EGV',
+                         'Source Device ID': device, 'Glucose Value (mg/dL)': np.linspace(80, 200, periods)})
+
+
+def test_store_append_keeps_only_new_rows(tmp_path, monkeypatch):
+    store = dm.DiabetesStore(str(tmp_path), 'Dexcom')
+    first = dexcom_rows('2017-11-01', 12)
+    assert store.append(first) == 12
+    assert store.high_water_mark == first[dm.dexcom_timestamp].iloc[-1]
+
+    # An overlapping export only adds its later rows; the row at the high-water mark is matched on the
+    # segment's key side file without reading the segment back.
+    monkeypatch.setattr(dm.DiabetesStore, 'segment', lambda self, file_name: pytest.fail('segment read'))
+    assert store.append(dexcom_rows('2017-11-01 00:55', 6)) == 5
+    assert store.append(dexcom_rows('2017-11-01 00:55', 6)) == 0
+    monkeypatch.undo()
+    assert len(store.data()) == 17
+    assert store.data()[dm.dexcom_timestamp].is_monotonic_increasing
+
+
+def test_store_counts_each_stale_row_once(tmp_path):
+    store = dm.DiabetesStore(str(tmp_path), 'Dexcom')
+    store.append(dexcom_rows('2017-11-01', 12))
+    backfilled = pd.concat([dexcom_rows('2017-11-01', 12), dexcom_rows('2017-11-01 00:02', 4, device='416CL9')])
+    with pytest.warns(UserWarning, match='4 Dexcom rows'):
+        assert store.append(backfilled) == 0
+    with warnings.catch_warnings():
+        warnings.simplefilter('error')
+        assert store.append(backfilled) == 0
+    assert str(dm.DiabetesStore(str(tmp_path), 'Dexcom')).endswith('Stale rows dropped: 4\n')
+
+
+def test_store_compacts_into_months(tmp_path, monkeypatch):
+    monkeypatch.setattr(dm.data, 'store_segment_limit', 3)
+    store = dm.DiabetesStore(str(tmp_path), 'Dexcom')
+    parts = [dexcom_rows(start, 10, freq='1D') for start in ['2017-09-25', '2017-10-05', '2017-10-15', '2017-10-25']]
+    for part in parts:
+        store.append(part)
+    assert [seg.get('month') for seg in store.segments] == ['2017-09', '2017-10', '2017-11']
+    assert [seg['rows'] for seg in store.segments] == [6, 31, 3]
+    assert store.data()[dm.dexcom_timestamp].tolist() == pd.concat(parts)[dm.dexcom_timestamp].tolist()
+
+    # A later compaction only rewrites the months that new segments add rows to
+    september = store.segments[0]
+    for start in ['2017-11-04', '2017-11-14', '2017-11-24', '2017-12-04']:
+        store.append(dexcom_rows(start, 10, freq='1D'))
+    assert store.segments[0] == september
+    assert [seg.get('month') for seg in store.segments] == ['2017-09', '2017-10', '2017-11', '2017-12']
+    assert sorted(name for name in os.listdir(tmp_path) if 'Segment' in name) == sorted(
+        name for seg in store.segments for name in [seg['file'], seg['keys']])
+    assert len(store.data()) == sum(seg['rows'] for seg in store.segments) == 80
+
+
+@pytest.mark.parametrize('file_name', ['Omnipod_20171024.xlsx', 'Omnipod_20171214.xlsx'])
+def test_omnipod_events_to_tabular_matches_omnipod_to_tabular(file_name):
+    folder = os.path.join(os.path.dirname(__file__), '..', 'Data', 'Omnipod')
+    raw = dm.Omnipod(os.path.abspath(folder), file_name, 'Omnipod').read_data(use_cache=False)
+    events = dm.omnipod_events(raw)
+    tabular = events.to_tabular()
+    assert list(tabular.columns) == dm.omnipod_tabular_columns
+    assert tabular['Date Time'].is_unique
+
+    # omnipod_to_tabular repeats a time once per row of the log; every copy has the same values, apart from
+    # Manual Override, which is set if any event at that time was overridden
+    wide = dm.omnipod_to_tabular(raw, save=False)
+    columns = [col for col in dm.omnipod_tabular_columns if col not in ['Date Time', 'Date', 'Time']]
+    expected = wide.groupby('Date Time')[columns].max()
+    actual = tabular.set_index('Date Time')[columns]
+    assert actual.index.equals(expected.index)
+    assert np.allclose(actual.to_numpy(dtype=float), expected.to_numpy(dtype=float), atol=1e-9)
+    assert (tabular['Date'] == tabular['Date Time'].dt.date).all()
+    assert (tabular['Time'] == tabular['Date Time'].dt.time).all()